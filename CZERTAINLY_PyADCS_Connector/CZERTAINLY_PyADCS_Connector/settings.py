@@ -19,10 +19,85 @@ environ.Env.read_env()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-ADCS_SEARCH_PAGE_SIZE = env("ADCS_SEARCH_PAGE_SIZE", default=1000)
+ADCS_SEARCH_PAGE_SIZE = env.int("ADCS_SEARCH_PAGE_SIZE", default=1000)
 ADCS_ISSUE_POLLING_INTERVAL = env("ADCS_ISSUE_POLLING_INTERVAL", default=100)
 ADCS_ISSUE_POLLING_TIMEOUT = env("ADCS_ISSUE_POLLING_TIMEOUT", default=3000)
 
+# Pool of reusable WinRM shells kept per authority instance
+ADCS_WINRM_POOL_ENABLED = env.bool("ADCS_WINRM_POOL_ENABLED", default=True)
+ADCS_WINRM_POOL_MIN_SIZE = env.int("ADCS_WINRM_POOL_MIN_SIZE", default=0)
+ADCS_WINRM_POOL_MAX_SIZE = env.int("ADCS_WINRM_POOL_MAX_SIZE", default=5)
+ADCS_WINRM_POOL_IDLE_TIMEOUT = env.int("ADCS_WINRM_POOL_IDLE_TIMEOUT", default=300)
+ADCS_WINRM_POOL_ACQUIRE_TIMEOUT = env.int("ADCS_WINRM_POOL_ACQUIRE_TIMEOUT", default=60)
+ADCS_WINRM_POOL_LIVENESS_CHECK_AFTER = env.int("ADCS_WINRM_POOL_LIVENESS_CHECK_AFTER", default=30)
+# Number of shells this process may keep open for one user on one host, keep it below the MaxShellsPerUser
+# quota of the WinRM service divided by the number of gunicorn workers
+ADCS_WINRM_MAX_SHELLS_PER_USER = env.int("ADCS_WINRM_MAX_SHELLS_PER_USER", default=10)
+# Authenticated HTTP(S) connections kept for the next session to the same endpoint with the same credential,
+# the idle timeout must stay below the idle connection timeout of the server (120 seconds by default)
+ADCS_WINRM_TRANSPORT_REUSE_ENABLED = env.bool("ADCS_WINRM_TRANSPORT_REUSE_ENABLED", default=True)
+ADCS_WINRM_TRANSPORT_IDLE_TIMEOUT = env.int("ADCS_WINRM_TRANSPORT_IDLE_TIMEOUT", default=100)
+
+# Concurrent remote sessions per authority instance, callers over the limit wait in a bounded queue and are
+# rejected with 429 when the queue is full or with 503 when no session is free within the queue timeout. An admitted
+# operation running longer than the operation timeout fails with 503 and returns its slot, 0 disables the deadline
+ADCS_ADMISSION_MAX_CONCURRENT = env.int("ADCS_ADMISSION_MAX_CONCURRENT", default=5)
+ADCS_ADMISSION_MAX_QUEUED = env.int("ADCS_ADMISSION_MAX_QUEUED", default=20)
+ADCS_ADMISSION_QUEUE_TIMEOUT = env.int("ADCS_ADMISSION_QUEUE_TIMEOUT", default=30)
+ADCS_ADMISSION_OPERATION_TIMEOUT = env.int("ADCS_ADMISSION_OPERATION_TIMEOUT", default=300)
+
+# Consecutive transport failures after which the calls to the authority are suspended, and the seconds after which
+# the connection is probed again
+ADCS_CIRCUIT_BREAKER_FAILURE_THRESHOLD = env.int("ADCS_CIRCUIT_BREAKER_FAILURE_THRESHOLD", default=5)
+ADCS_CIRCUIT_BREAKER_RESET_TIMEOUT = env.int("ADCS_CIRCUIT_BREAKER_RESET_TIMEOUT", default=30)
+
+# Attempts of the read-only scripts failing on a transient error, the delay before a retry is random up to the
+# base delay doubled with every attempt and capped by the maximum delay. The retries against one authority
+# instance are limited to the given ratio of the calls.
+ADCS_RETRY_MAX_ATTEMPTS = env.int("ADCS_RETRY_MAX_ATTEMPTS", default=3)
+ADCS_RETRY_BASE_DELAY = env.float("ADCS_RETRY_BASE_DELAY", default=0.5)
+ADCS_RETRY_MAX_DELAY = env.float("ADCS_RETRY_MAX_DELAY", default=5.0)
+ADCS_RETRY_BUDGET_RATIO = env.float("ADCS_RETRY_BUDGET_RATIO", default=0.2)
+
+# Output of the scripts reading the authorities, templates and certificates, "list" is the padded Format-List
+# output of the PSPKI cmdlets, "json" writes every record as one line of compressed JSON
+ADCS_SCRIPT_OUTPUT_FORMAT = env("ADCS_SCRIPT_OUTPUT_FORMAT", default="list")
+# Certificates of a dump page are written as JSON records compressed with gzip on the server, the output is sent
+# base64 encoded in one block instead of the padded Format-List output
+ADCS_DUMP_COMPRESSION_ENABLED = env.bool("ADCS_DUMP_COMPRESSION_ENABLED", default=False)
+# Pages of a discovery scan for which the powershell process is started ahead on another shell, the process
+# loads PSPKI while the previous page is received
+ADCS_DISCOVERY_PREFETCH_DEPTH = env.int("ADCS_DISCOVERY_PREFETCH_DEPTH", default=1)
+
+# Number of CA and template combinations a discovery reads at once, each on its own session, unless the authority
+# instance or the discovery sets a lower number
+ADCS_DISCOVERY_PARALLELISM = env.int("ADCS_DISCOVERY_PARALLELISM", default=4)
+
+# Number of discovered certificates inserted by one statement when the database does not support COPY
+ADCS_DISCOVERY_INSERT_BATCH_SIZE = env.int("ADCS_DISCOVERY_INSERT_BATCH_SIZE", default=5000)
+
+# Number of discovered pages waiting for the database writer, the scans wait while the queue is full
+ADCS_DISCOVERY_QUEUE_SIZE = env.int("ADCS_DISCOVERY_QUEUE_SIZE", default=4)
+
+# Days after which an incremental discovery reads all certificates of a CA and template again, 0 never forces it
+ADCS_DISCOVERY_FULL_SCAN_INTERVAL = env.int("ADCS_DISCOVERY_FULL_SCAN_INTERVAL", default=30)
+
+# Seconds between the heartbeats of a running discovery, the workers look for the interrupted discoveries as often
+ADCS_DISCOVERY_HEARTBEAT_INTERVAL = env.int("ADCS_DISCOVERY_HEARTBEAT_INTERVAL", default=30)
+
+# Seconds without a heartbeat after which a discovery in progress is considered interrupted and is resumed
+ADCS_DISCOVERY_ORPHAN_TIMEOUT = env.int("ADCS_DISCOVERY_ORPHAN_TIMEOUT", default=300)
+
+# Number of certificates of a discovery the in-memory filter of the stored certificates is sized for, the filter
+# answers the repeated certificates with more database lookups when the discovery is larger
+ADCS_DISCOVERY_DEDUPLICATION_CAPACITY = env.int("ADCS_DISCOVERY_DEDUPLICATION_CAPACITY", default=1_000_000)
+
+# Engine executing the PowerShell scripts, "winrm" starts a powershell process for every script,
+# "psrp" runs the scripts in a runspace with PSPKI imported over the PowerShell Remoting Protocol
+ADCS_REMOTING_ENGINE = env("ADCS_REMOTING_ENGINE", default="winrm")
+# Seconds for which the runspace caches the certification authorities
+ADCS_PSRP_CA_CACHE_TTL = env.int("ADCS_PSRP_CA_CACHE_TTL", default=300)
+
 # Prefix used for all database tables
 DATABASE_SCHEMA = env("DATABASE_SCHEMA", default="pyadcs")
 
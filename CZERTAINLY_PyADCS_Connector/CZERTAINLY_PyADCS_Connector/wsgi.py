@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CZERTAINLY_PyADCS_Connector.settings')
 
 application = get_wsgi_application()
+
+from PyADCSConnector.services.discovery_history import start_discovery_recovery  # noqa: E402
+
+# the discoveries interrupted by a stopped worker are resumed by the running ones
+start_discovery_recovery()
@@ -0,0 +1,5 @@
+from PyADCSConnector.exceptions.service_unavailable_exception import ServiceUnavailableException
+
+
+class CircuitOpenException(ServiceUnavailableException):
+    pass
@@ -5,6 +5,8 @@ import logging
 from PyADCSConnector.exceptions.authority_exception import AuthorityException
 from PyADCSConnector.exceptions.discovery_exception import DiscoveryException
 from PyADCSConnector.exceptions.not_found_exception import NotFoundException
+from PyADCSConnector.exceptions.service_unavailable_exception import ServiceUnavailableException
+from PyADCSConnector.exceptions.too_many_requests_exception import TooManyRequestsException
 from PyADCSConnector.exceptions.validation_exception import ValidationException
 from PyADCSConnector.exceptions.winrm_execution_exception import WinRMExecutionException
 
@@ -45,6 +47,16 @@ class ExceptionHandlerMiddleware:
             logger.info("(400) DiscoveryException occurred: " + str(exception))
             # logger.exception(exception)
             return JsonResponse({'message': str(exception)}, status=400)
+        if isinstance(exception, TooManyRequestsException):
+            logger.info("(429) TooManyRequestsException occurred: " + str(exception))
+            response = JsonResponse({'message': str(exception)}, status=429)
+            response["Retry-After"] = str(exception.retry_after)
+            return response
+        if isinstance(exception, ServiceUnavailableException):
+            logger.info("(503) ServiceUnavailableException occurred: " + str(exception))
+            response = JsonResponse({'message': str(exception)}, status=503)
+            response["Retry-After"] = str(exception.retry_after)
+            return response
         if isinstance(exception, Exception):
             logger.error("(500) Exception occurred: " + str(exception))
             logger.exception(exception)
@@ -0,0 +1,121 @@
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from PyADCSConnector.models.authority_instance import AuthorityInstance
+from PyADCSConnector.models.certificate_content import CertificateContent
+from PyADCSConnector.models.discovery_certificate import DiscoveryCertificate
+from PyADCSConnector.models.discovery_history import DiscoveryHistory
+from PyADCSConnector.objects.discovery_history_request_dto import DiscoveryHistoryRequestDto
+from PyADCSConnector.services.certificate_content import delete_discovery_certificates
+from PyADCSConnector.services.discovery_history import get_discovery_history_data, clear_page_boundaries
+
+
+class Command(BaseCommand):
+    help = ("Measures the latency of the discovery result pages and of the lookups by uuid and name on a discovery "
+            "with a large number of synthetic certificates, the data are deleted afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--certificates", type=int, default=10_000_000,
+                            help="number of certificates of the benchmark discovery")
+        parser.add_argument("--items-per-page", type=int, default=100, help="certificates of one result page")
+        parser.add_argument("--repeat", type=int, default=20, help="measurements of every operation")
+
+    def handle(self, *args, **options):
+        count = options["certificates"]
+        name = "benchmark-%s" % uuid.uuid4()
+        discovery_history = DiscoveryHistory.objects.create(name=name, status="completed", total_certificates=count)
+        authority = AuthorityInstance.objects.create(name=name, address="benchmark", port=5985, attributes=[],
+                                                     credential={}, kind="PyADCS-WinRM")
+        try:
+            started = time.monotonic()
+            self.generate_certificates(discovery_history, count)
+            self.stdout.write("Generated %d certificates in %.1f s" % (count, time.monotonic() - started))
+
+            items_per_page = options["items_per_page"]
+            last_page = max(1, (count + items_per_page - 1) // items_per_page)
+            certificate_uuid = DiscoveryCertificate.objects.filter(discovery_id=discovery_history.id).values_list(
+                "uuid", flat=True).last()
+            continuation_token = self.read_page(discovery_history, last_page // 2 + 1,
+                                                items_per_page).continuation_token
+            pages = iter(range(last_page // 2 + 2, last_page))
+            operations = [
+                ("first page", lambda: self.read_page(discovery_history, 1, items_per_page)),
+                # the first read of a page skips the rows before it, the page after it continues after its last row
+                ("middle page", lambda: self.read_page(discovery_history, last_page // 2 + 1, items_per_page,
+                                                       clear_boundaries=True)),
+                ("next page", lambda: self.read_page(discovery_history, next(pages), items_per_page)),
+                ("last page", lambda: self.read_page(discovery_history, last_page, items_per_page,
+                                                     clear_boundaries=True)),
+                ("continued page", lambda: self.read_page(discovery_history, 1, items_per_page, continuation_token)),
+                ("discovery by uuid", lambda: DiscoveryHistory.objects.get(uuid=discovery_history.uuid)),
+                ("discovery by name", lambda: DiscoveryHistory.objects.filter(name=name).exists()),
+                ("certificate by uuid", lambda: DiscoveryCertificate.objects.get(uuid=certificate_uuid)),
+                ("authority by uuid", lambda: AuthorityInstance.objects.get(uuid=authority.uuid)),
+                ("authority by name", lambda: AuthorityInstance.objects.filter(name=name).exists()),
+            ]
+            self.stdout.write("%-20s %10s %10s %10s" % ("operation", "p50 ms", "p95 ms", "max ms"))
+            for label, operation in operations:
+                latencies = self.measure(operation, options["repeat"])
+                self.stdout.write("%-20s %10.2f %10.2f %10.2f" % (
+                    label, statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1],
+                    latencies[-1]))
+
+            # the discovery is deleted the same way as by the API, with the contents no other discovery references
+            started = time.monotonic()
+            with transaction.atomic():
+                delete_discovery_certificates(discovery_history)
+                DiscoveryHistory.objects.filter(id=discovery_history.id).delete()
+            self.stdout.write("Deleted the discovery in %.1f s" % (time.monotonic() - started))
+        finally:
+            DiscoveryHistory.objects.filter(id=discovery_history.id).delete()
+            authority.delete()
+            self.delete_contents(name, count)
+
+    @staticmethod
+    def generate_certificates(discovery_history, count):
+        # the rows are generated by the database, the benchmark measures the reads and not the ingestion, the
+        # fingerprints of the certificates are derived from the name of the discovery
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO %s (fingerprint, der) "
+                "SELECT encode(sha256((%%s || i)::bytea), 'hex'), decode(repeat('MIIB', 400), 'base64') "
+                "FROM generate_series(1, %%s) AS i" % CertificateContent._meta.db_table,
+                [discovery_history.name, count])
+            cursor.execute(
+                "INSERT INTO %s (uuid, fingerprint, discovery_id, meta) "
+                "SELECT md5(random()::text || i)::uuid, encode(sha256((%%s || i)::bytea), 'hex'), %%s, NULL "
+                "FROM generate_series(1, %%s) AS i" % DiscoveryCertificate._meta.db_table,
+                [discovery_history.name, discovery_history.id, count])
+            cursor.execute("ANALYZE %s" % CertificateContent._meta.db_table)
+            cursor.execute("ANALYZE %s" % DiscoveryCertificate._meta.db_table)
+
+    @staticmethod
+    def delete_contents(name, count):
+        # the contents left by a benchmark that failed before the discovery was deleted, no other discovery
+        # references the generated ones
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM %s WHERE fingerprint IN "
+                "(SELECT encode(sha256((%%s || i)::bytea), 'hex') FROM generate_series(1, %%s) AS i)"
+                % CertificateContent._meta.db_table, [name, count])
+
+    @staticmethod
+    def read_page(discovery_history, page_number, items_per_page, continuation_token=None, clear_boundaries=False):
+        if clear_boundaries:
+            clear_page_boundaries()
+        request = DiscoveryHistoryRequestDto(page_number=page_number, items_per_page=items_per_page,
+                                             continuation_token=continuation_token)
+        return get_discovery_history_data(request, discovery_history)
+
+    @staticmethod
+    def measure(operation, repeat):
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            operation()
+            latencies.append((time.perf_counter() - started) * 1000)
+        return sorted(latencies)
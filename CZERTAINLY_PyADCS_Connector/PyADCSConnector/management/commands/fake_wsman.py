@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from PyADCSConnector.remoting.winrm.fake_server import FakeAdcs, FakeWsmanServer
+
+
+class Command(BaseCommand):
+    help = "Runs a fake WinRM endpoint answering the connector scripts with synthetic ADCS data for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="0.0.0.0")
+        parser.add_argument("--port", type=int, default=5985)
+        parser.add_argument("--username", default="user")
+        parser.add_argument("--password", default="password")
+        parser.add_argument("--cas", type=int, default=1, help="number of certification authorities")
+        parser.add_argument("--templates", type=int, default=3, help="number of certificate templates")
+        parser.add_argument("--certificates", type=int, default=1000,
+                            help="number of issued certificates of every certification authority")
+        parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every script")
+        parser.add_argument("--row-latency", type=float, default=0.0,
+                            help="seconds added to every line of the script output")
+        parser.add_argument("--failure-rate", type=float, default=0.0,
+                            help="probability that a command is rejected with 503")
+        parser.add_argument("--chunk-size", type=int, default=65536,
+                            help="bytes of output returned by one receive")
+
+    def handle(self, *args, **options):
+        adcs = FakeAdcs(options["cas"], options["templates"], options["certificates"])
+        server = FakeWsmanServer((options["host"], options["port"]), adcs, options["username"], options["password"],
+                                 options["latency"], options["row_latency"], options["failure_rate"],
+                                 options["chunk_size"])
+        self.stdout.write("Fake WinRM endpoint listening on %s:%d" % server.server_address[:2])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write("Served %s" % dict(server.stats))
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+def count_discovered_certificates(apps, schema_editor):
+    DiscoveryHistory = apps.get_model("PyADCSConnector", "DiscoveryHistory")
+    DiscoveryCertificate = apps.get_model("PyADCSConnector", "DiscoveryCertificate")
+    for discovery_history in DiscoveryHistory.objects.all():
+        discovery_history.total_certificates = DiscoveryCertificate.objects.filter(
+            discovery_id=discovery_history.id).count()
+        discovery_history.save(update_fields=["total_certificates"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PyADCSConnector', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discoveryhistory',
+            name='total_certificates',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='discoveryhistory',
+            name='progress',
+            field=models.JSONField(null=True, default=None),
+        ),
+        migrations.RunPython(count_discovered_certificates, migrations.RunPython.noop),
+    ]
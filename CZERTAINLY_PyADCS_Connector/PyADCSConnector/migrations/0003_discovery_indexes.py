@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+DISCOVERY_CERTIFICATE_TABLE = f'"{settings.DATABASE_SCHEMA}"."discovery_certificate"'
+DISCOVERY_HISTORY_TABLE = f'"{settings.DATABASE_SCHEMA}"."discovery_history"'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PyADCSConnector', '0002_discovery_history_progress'),
+    ]
+
+    operations = [
+        # the certificates of the deleted discoveries would violate the foreign key
+        migrations.RunSQL(
+            f'DELETE FROM {DISCOVERY_CERTIFICATE_TABLE} c WHERE NOT EXISTS '
+            f'(SELECT 1 FROM {DISCOVERY_HISTORY_TABLE} h WHERE h.id = c.discovery_id)',
+            migrations.RunSQL.noop,
+        ),
+        # the column keeps its name, it becomes the foreign key to the discovery with ON DELETE CASCADE
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    f'ALTER TABLE {DISCOVERY_CERTIFICATE_TABLE} ALTER COLUMN discovery_id TYPE bigint, '
+                    f'ADD CONSTRAINT discovery_certificate_discovery_fk FOREIGN KEY (discovery_id) '
+                    f'REFERENCES {DISCOVERY_HISTORY_TABLE} (id) ON DELETE CASCADE',
+                    f'ALTER TABLE {DISCOVERY_CERTIFICATE_TABLE} DROP CONSTRAINT discovery_certificate_discovery_fk, '
+                    f'ALTER COLUMN discovery_id TYPE integer',
+                ),
+            ],
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='discoverycertificate',
+                    name='discovery_id',
+                ),
+                migrations.AddField(
+                    model_name='discoverycertificate',
+                    name='discovery',
+                    field=models.ForeignKey(db_constraint=False, db_index=False,
+                                            on_delete=django.db.models.deletion.DO_NOTHING,
+                                            to='PyADCSConnector.discoveryhistory'),
+                    preserve_default=False,
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='discoverycertificate',
+            index=models.Index(fields=['discovery', 'id'], name='discovery_certificate_page'),
+        ),
+        migrations.AlterField(
+            model_name='discoverycertificate',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='discoveryhistory',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='discoveryhistory',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='authorityinstance',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='authorityinstance',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PyADCSConnector', '0003_discovery_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscoveryWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('config_string', models.CharField(max_length=255)),
+                ('template', models.CharField(default='', max_length=255)),
+                ('request_id', models.BigIntegerField(default=0)),
+                ('scanned_at', models.DateTimeField(default=None, null=True)),
+                ('full_scan_at', models.DateTimeField(default=None, null=True)),
+                ('authority', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                to='PyADCSConnector.authorityinstance')),
+            ],
+            options={
+                'db_table': f'"{settings.DATABASE_SCHEMA}"."discovery_watermark"',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='discoverywatermark',
+            constraint=models.UniqueConstraint(fields=('authority', 'config_string', 'template'),
+                                               name='discovery_watermark_unique'),
+        ),
+    ]
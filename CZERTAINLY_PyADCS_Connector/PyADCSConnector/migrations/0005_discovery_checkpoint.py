@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PyADCSConnector', '0004_discovery_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discoveryhistory',
+            name='request',
+            field=models.JSONField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='discoveryhistory',
+            name='heartbeat_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.CreateModel(
+            name='DiscoveryCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('ca', models.JSONField()),
+                ('template', models.JSONField(default=None, null=True)),
+                ('request_id', models.BigIntegerField(default=0)),
+                ('certificates', models.IntegerField(default=0)),
+                ('full_scan', models.BooleanField(default=False)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('discovery', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                to='PyADCSConnector.discoveryhistory')),
+            ],
+            options={
+                'db_table': f'"{settings.DATABASE_SCHEMA}"."discovery_checkpoint"',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='discoverycheckpoint',
+            constraint=models.UniqueConstraint(fields=('discovery', 'position'), name='discovery_checkpoint_unique'),
+        ),
+    ]
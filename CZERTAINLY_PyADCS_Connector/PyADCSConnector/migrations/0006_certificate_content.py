@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+CERTIFICATE_CONTENT_TABLE = f'"{settings.DATABASE_SCHEMA}"."certificate_content"'
+DISCOVERY_CERTIFICATE_TABLE = f'"{settings.DATABASE_SCHEMA}"."discovery_certificate"'
+DISCOVERY_HISTORY_TABLE = f'"{settings.DATABASE_SCHEMA}"."discovery_history"'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PyADCSConnector', '0005_discovery_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CertificateContent',
+            fields=[
+                ('fingerprint', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('base64content', models.TextField()),
+            ],
+            options={
+                'db_table': f'"{settings.DATABASE_SCHEMA}"."certificate_content"',
+            },
+        ),
+        migrations.AddField(
+            model_name='discoverycertificate',
+            name='content',
+            field=models.ForeignKey(db_column='fingerprint', db_index=False, null=True,
+                                    on_delete=django.db.models.deletion.PROTECT,
+                                    to='PyADCSConnector.certificatecontent'),
+        ),
+        # the column is removed after the certificates are moved, a reverted migration restores it from the contents
+        migrations.AlterField(
+            model_name='discoverycertificate',
+            name='base64content',
+            field=models.TextField(null=True),
+        ),
+        # the certificates are moved to the content table by the SHA-256 of their DER, the repeated certificates of
+        # a discovery are removed and the totals of the discoveries counted again
+        migrations.RunSQL(
+            [
+                f'INSERT INTO {CERTIFICATE_CONTENT_TABLE} (fingerprint, base64content) '
+                f'SELECT DISTINCT ON (fingerprint) fingerprint, base64content FROM (SELECT base64content, '
+                f'encode(sha256(decode(base64content, \'base64\')), \'hex\') AS fingerprint '
+                f'FROM {DISCOVERY_CERTIFICATE_TABLE}) c ORDER BY fingerprint',
+                f'UPDATE {DISCOVERY_CERTIFICATE_TABLE} '
+                f'SET fingerprint = encode(sha256(decode(base64content, \'base64\')), \'hex\')',
+                f'DELETE FROM {DISCOVERY_CERTIFICATE_TABLE} c WHERE EXISTS (SELECT 1 FROM {DISCOVERY_CERTIFICATE_TABLE} '
+                f'd WHERE d.discovery_id = c.discovery_id AND d.fingerprint = c.fingerprint AND d.id < c.id)',
+                f'UPDATE {DISCOVERY_HISTORY_TABLE} h SET total_certificates = '
+                f'(SELECT count(*) FROM {DISCOVERY_CERTIFICATE_TABLE} c WHERE c.discovery_id = h.id)',
+            ],
+            f'UPDATE {DISCOVERY_CERTIFICATE_TABLE} c SET base64content = t.base64content '
+            f'FROM {CERTIFICATE_CONTENT_TABLE} t WHERE t.fingerprint = c.fingerprint',
+        ),
+        migrations.AlterField(
+            model_name='discoverycertificate',
+            name='content',
+            field=models.ForeignKey(db_column='fingerprint', db_index=False,
+                                    on_delete=django.db.models.deletion.PROTECT,
+                                    to='PyADCSConnector.certificatecontent'),
+        ),
+        migrations.RemoveField(
+            model_name='discoverycertificate',
+            name='base64content',
+        ),
+        migrations.AddConstraint(
+            model_name='discoverycertificate',
+            constraint=models.UniqueConstraint(fields=('discovery', 'content'), name='discovery_certificate_unique'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db import migrations, models
+
+CERTIFICATE_CONTENT_TABLE = f'"{settings.DATABASE_SCHEMA}"."certificate_content"'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PyADCSConnector', '0006_certificate_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='certificatecontent',
+            name='der',
+            field=models.BinaryField(null=True),
+        ),
+        # the column is removed after the certificates are decoded, a reverted migration encodes them again
+        migrations.AlterField(
+            model_name='certificatecontent',
+            name='base64content',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunSQL(
+            f'UPDATE {CERTIFICATE_CONTENT_TABLE} SET der = decode(base64content, \'base64\')',
+            # encode wraps the base64 in lines of 76 characters
+            f'UPDATE {CERTIFICATE_CONTENT_TABLE} '
+            f'SET base64content = translate(encode(der, \'base64\'), E\'\\n\', \'\')',
+        ),
+        migrations.AlterField(
+            model_name='certificatecontent',
+            name='der',
+            field=models.BinaryField(),
+        ),
+        migrations.RemoveField(
+            model_name='certificatecontent',
+            name='base64content',
+        ),
+    ]
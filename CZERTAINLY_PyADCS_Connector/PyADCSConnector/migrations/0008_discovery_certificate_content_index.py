@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PyADCSConnector', '0007_certificate_content_der'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discoverycertificate',
+            index=models.Index(fields=['content'], name='discovery_certificate_content'),
+        ),
+    ]
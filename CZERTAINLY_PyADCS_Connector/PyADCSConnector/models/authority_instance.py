@@ -6,8 +6,8 @@ from django.db import models
 
 
 class AuthorityInstance(models.Model):
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
-    name = models.CharField(max_length=255)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    name = models.CharField(max_length=255, db_index=True)
     address = models.CharField(max_length=255)
     https = models.BooleanField(default=False)
     port = models.IntegerField()
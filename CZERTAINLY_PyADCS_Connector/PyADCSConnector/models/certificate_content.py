@@ -0,0 +1,17 @@
+import json
+
+from django.conf import settings
+from django.db import models
+
+
+class CertificateContent(models.Model):
+    # hex SHA-256 of the DER of the certificate, every certificate is stored once and referenced by the discoveries
+    fingerprint = models.CharField(max_length=64, primary_key=True)
+    # the certificate is decoded once when it is discovered, the API encodes it
+    der = models.BinaryField()
+
+    def __str__(self):
+        return json.dumps(self.__dict__, default=str)
+
+    class Meta:
+        db_table = f'"{settings.DATABASE_SCHEMA}"."certificate_content"'
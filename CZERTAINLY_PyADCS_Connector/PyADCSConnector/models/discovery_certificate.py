@@ -4,11 +4,20 @@ import json
 from django.conf import settings
 from django.db import models
 
+from PyADCSConnector.models.certificate_content import CertificateContent
+from PyADCSConnector.models.discovery_history import DiscoveryHistory
+
 
 class DiscoveryCertificate(models.Model):
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
-    base64content = models.TextField()
-    discovery_id = models.IntegerField()
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # the column holds the fingerprint of the certificate, a discovery references every certificate once, the index
+    # serves the removal of the contents no discovery references
+    content = models.ForeignKey(CertificateContent, on_delete=models.PROTECT, db_column="fingerprint",
+                                db_index=False)
+    # the foreign key is created by the migration with ON DELETE CASCADE, the database deletes the certificates of
+    # the discovery without loading them, and the index starting with the discovery serves the lookups
+    discovery = models.ForeignKey(DiscoveryHistory, on_delete=models.DO_NOTHING, db_constraint=False,
+                                  db_index=False)
     meta = models.JSONField(null=True, default=None)
 
     def __str__(self):
@@ -16,3 +25,10 @@ class DiscoveryCertificate(models.Model):
 
     class Meta:
         db_table = f'"{settings.DATABASE_SCHEMA}"."discovery_certificate"'
+        indexes = [
+            models.Index(fields=["discovery", "id"], name="discovery_certificate_page"),
+            models.Index(fields=["content"], name="discovery_certificate_content"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["discovery", "content"], name="discovery_certificate_unique"),
+        ]
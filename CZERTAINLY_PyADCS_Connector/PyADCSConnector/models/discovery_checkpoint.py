@@ -0,0 +1,30 @@
+import json
+
+from django.conf import settings
+from django.db import models
+
+from PyADCSConnector.models.discovery_history import DiscoveryHistory
+
+
+class DiscoveryCheckpoint(models.Model):
+    discovery = models.ForeignKey(DiscoveryHistory, on_delete=models.CASCADE)
+    # the order of the CA and template combinations in the discovery
+    position = models.IntegerField()
+    ca = models.JSONField()
+    # null when the discovery reads the certificates of all templates
+    template = models.JSONField(null=True, default=None)
+    # the RequestID of the last committed certificate, the resumed scan continues after it
+    request_id = models.BigIntegerField(default=0)
+    certificates = models.IntegerField(default=0)
+    full_scan = models.BooleanField(default=False)
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return json.dumps(self.__dict__, default=str)
+
+    class Meta:
+        db_table = f'"{settings.DATABASE_SCHEMA}"."discovery_checkpoint"'
+        constraints = [
+            models.UniqueConstraint(fields=["discovery", "position"], name="discovery_checkpoint_unique"),
+        ]
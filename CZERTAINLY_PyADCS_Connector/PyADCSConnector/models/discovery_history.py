@@ -6,13 +6,19 @@ from django.db import models
 
 
 class DiscoveryHistory(models.Model):
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
-    name = models.CharField(max_length=255)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    name = models.CharField(max_length=255, db_index=True)
     status = models.CharField()
     meta = models.JSONField(null=True, default=None)
+    total_certificates = models.IntegerField(default=0)
+    progress = models.JSONField(null=True, default=None)
+    # the request of the discovery, an interrupted discovery is resumed with it
+    request = models.JSONField(null=True, default=None)
+    # refreshed while the discovery runs, a discovery in progress without a recent heartbeat was interrupted
+    heartbeat_at = models.DateTimeField(null=True, default=None)
 
     def __str__(self):
-        return json.dumps(self.__dict__)
+        return json.dumps(self.__dict__, default=str)
 
     class Meta:
         db_table = f'"{settings.DATABASE_SCHEMA}"."discovery_history"'
@@ -0,0 +1,27 @@
+import json
+
+from django.conf import settings
+from django.db import models
+
+from PyADCSConnector.models.authority_instance import AuthorityInstance
+
+
+class DiscoveryWatermark(models.Model):
+    authority = models.ForeignKey(AuthorityInstance, on_delete=models.CASCADE)
+    config_string = models.CharField(max_length=255)
+    # empty when the discovery reads the certificates of all templates
+    template = models.CharField(max_length=255, default="")
+    # the RequestID of the last certificate found, the next incremental discovery continues after it
+    request_id = models.BigIntegerField(default=0)
+    scanned_at = models.DateTimeField(null=True, default=None)
+    full_scan_at = models.DateTimeField(null=True, default=None)
+
+    def __str__(self):
+        return json.dumps(self.__dict__, default=str)
+
+    class Meta:
+        db_table = f'"{settings.DATABASE_SCHEMA}"."discovery_watermark"'
+        constraints = [
+            models.UniqueConstraint(fields=["authority", "config_string", "template"],
+                                    name="discovery_watermark_unique"),
+        ]
@@ -1,12 +1,16 @@
+import base64
+
+
 class DiscoveryCertificateDto:
-    def __init__(self, uuid: str, base64_content: str, meta: list[dict]):
+    def __init__(self, uuid: str, der: bytes | memoryview, meta: list[dict]):
         self.uuid = uuid
-        self.base64_content = base64_content
+        self.der = der
         self.meta = meta
 
     def to_json(self):
         return {
             "uuid": self.uuid,
-            "base64Content": self.base64_content,
+            # the stored DER is encoded from the buffer read from the database, without a copy
+            "base64Content": base64.b64encode(self.der).decode("ascii"),
             "meta": self.meta
         }
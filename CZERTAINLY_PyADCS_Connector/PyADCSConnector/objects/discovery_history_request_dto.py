@@ -1,16 +1,19 @@
 class DiscoveryHistoryRequestDto:
-    def __init__(self, name: str = None, kind: str = None, page_number: int = 0, items_per_page: int = 100):
+    def __init__(self, name: str = None, kind: str = None, page_number: int = 0, items_per_page: int = 100,
+                 continuation_token: str = None):
         self.name = name
         self.kind = kind
         self.page_number = page_number
         self.items_per_page = items_per_page
+        self.continuation_token = continuation_token
 
     def to_json(self):
         return {
             "name": self.name,
             "kind": self.kind,
             "pageNumber": self.page_number,
-            "itemsPerPage": self.items_per_page
+            "itemsPerPage": self.items_per_page,
+            "continuationToken": self.continuation_token
         }
 
     @staticmethod
@@ -19,5 +22,6 @@ class DiscoveryHistoryRequestDto:
             request_json["name"],
             request_json["kind"],
             request_json["pageNumber"],
-            request_json["itemsPerPage"]
+            request_json["itemsPerPage"],
+            request_json.get("continuationToken")
         )
@@ -5,13 +5,14 @@ from PyADCSConnector.utils.discovery_status import DiscoveryStatus
 class DiscoveryHistoryResponseDto:
     def __init__(self, name: str = None, uuid: str = None, status: DiscoveryStatus = DiscoveryStatus.IN_PROGRESS,
                  certificate_data: list[DiscoveryCertificateDto] = None, meta: list[dict] = None,
-                 total_certificates_discovered: int = 0):
+                 total_certificates_discovered: int = 0, continuation_token: str = None):
         self.name = name
         self.uuid = uuid
         self.status = status
         self.certificate_data = certificate_data
         self.meta = meta
         self.total_certificates_discovered = total_certificates_discovered
+        self.continuation_token = continuation_token
 
     def to_json(self):
         return {
@@ -20,5 +21,6 @@ class DiscoveryHistoryResponseDto:
             "status": self.status,
             "certificateData": [certificate for certificate in self.certificate_data],
             "meta": self.meta,
-            "totalCertificatesDiscovered": self.total_certificates_discovered
+            "totalCertificatesDiscovered": self.total_certificates_discovered,
+            "continuationToken": self.continuation_token
         }
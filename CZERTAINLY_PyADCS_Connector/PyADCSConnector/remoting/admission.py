@@ -0,0 +1,302 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+
+from CZERTAINLY_PyADCS_Connector.settings import ADCS_ADMISSION_MAX_CONCURRENT, ADCS_ADMISSION_MAX_QUEUED, \
+    ADCS_ADMISSION_QUEUE_TIMEOUT, ADCS_ADMISSION_OPERATION_TIMEOUT
+from PyADCSConnector.exceptions.service_unavailable_exception import ServiceUnavailableException
+from PyADCSConnector.exceptions.too_many_requests_exception import TooManyRequestsException
+
+logger = logging.getLogger(__name__)
+
+# how long to sleep between checks when a coroutine waits for a free slot
+ASYNC_POLL_INTERVAL = 0.05
+# seconds returned in the Retry-After header when the operation is rejected
+RETRY_AFTER = 5
+
+
+class AdmissionLimiter(object):
+    """
+    Limits the number of concurrent remote sessions against one authority instance, shared by threads and
+    coroutines. Callers over the limit wait in a bounded queue, the caller is rejected immediately when the queue
+    is full and when the slot is not free before the deadline.
+    """
+
+    def __init__(self, key, max_concurrent=5, max_queued=20):
+        if max_concurrent < 1:
+            raise ValueError("Maximum number of concurrent operations must be at least 1")
+        self.key = key
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.expired = 0
+
+        self._active = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if self._try_enter():
+                return
+            self._enqueue()
+            try:
+                while self._active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timed_out(timeout)
+                    self._condition.wait(remaining)
+                self._enter()
+            finally:
+                self._waiting -= 1
+
+    async def acquire_async(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if self._try_enter():
+                return
+            self._enqueue()
+        try:
+            # the condition can not be awaited, the slot is polled instead
+            while True:
+                await asyncio.sleep(ASYNC_POLL_INTERVAL)
+                with self._condition:
+                    if self._try_enter():
+                        return
+                    if time.monotonic() >= deadline:
+                        raise self._timed_out(timeout)
+        finally:
+            with self._condition:
+                self._waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "active": self._active,
+                "waiting": self._waiting,
+                "maxConcurrent": self.max_concurrent,
+                "maxQueued": self.max_queued,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timedOut": self.timed_out,
+                "expired": self.expired,
+            }
+
+    def _try_enter(self):
+        # must be called with the condition held
+        if self._active < self.max_concurrent:
+            self._enter()
+            return True
+        return False
+
+    def _enter(self):
+        self._active += 1
+        self.admitted += 1
+
+    def _enqueue(self):
+        if self._waiting >= self.max_queued:
+            self.rejected += 1
+            raise TooManyRequestsException(
+                "Too many concurrent operations against authority %s, %d running and %d waiting"
+                % (self.key, self._active, self._waiting), RETRY_AFTER)
+        self._waiting += 1
+
+    def _timed_out(self, timeout):
+        self.timed_out += 1
+        return ServiceUnavailableException(
+            "Authority %s is busy, no operation slot became free in %ss" % (self.key, timeout), RETRY_AFTER)
+
+    def operation_expired(self, timeout):
+        with self._condition:
+            self.expired += 1
+        return ServiceUnavailableException(
+            "Operation against authority %s did not complete in %ss" % (self.key, timeout), RETRY_AFTER)
+
+
+class AdmittedSession(object):
+    """
+    Session that takes a slot of the admission limiter when connected and returns it when disconnected. An operation
+    running longer than the operation timeout fails with 503, the blocking call can not be interrupted, so it is
+    left to finish in its thread and the session is disconnected after it while the slot is returned at once.
+    """
+
+    def __init__(self, session, limiter, timeout, operation_timeout=0):
+        self.session = session
+        self.limiter = limiter
+        self.timeout = timeout
+        self.operation_timeout = operation_timeout
+        # the operation still running after its deadline
+        self._overrun = None
+
+    def connect(self):
+        self.limiter.acquire(self.timeout)
+        try:
+            self.session.connect()
+        except BaseException:
+            self.limiter.release()
+            raise
+
+    def run(self, command, args=()):
+        return self._within_deadline(self.session.run, command, args)
+
+    def run_ps(self, script):
+        return self._within_deadline(self.session.run_ps, script)
+
+    def stream_ps(self, script):
+        if not self.operation_timeout:
+            yield from self.session.stream_ps(script)
+            return
+        # the deadline is checked between the chunks
+        deadline = time.monotonic() + self.operation_timeout
+        chunks = self.session.stream_ps(script)
+        try:
+            for chunk in chunks:
+                if time.monotonic() > deadline:
+                    raise self.limiter.operation_expired(self.operation_timeout)
+                yield chunk
+        finally:
+            chunks.close()
+
+    def _within_deadline(self, method, *args):
+        if not self.operation_timeout:
+            return method(*args)
+        operation = concurrent.futures.Future()
+
+        def call():
+            try:
+                operation.set_result(method(*args))
+            except BaseException as e:
+                operation.set_exception(e)
+
+        threading.Thread(target=call, name="admitted-operation-%s" % self.limiter.key, daemon=True).start()
+        try:
+            return operation.result(self.operation_timeout)
+        except concurrent.futures.TimeoutError:
+            self._overrun = operation
+            raise self.limiter.operation_expired(self.operation_timeout)
+
+    def disconnect(self):
+        if self._overrun is not None:
+            # the session is still used by the operation, it is disconnected when the operation ends
+            self._overrun.add_done_callback(lambda _: self.session.disconnect())
+            self._overrun = None
+            self.limiter.release()
+            return
+        try:
+            self.session.disconnect()
+        finally:
+            self.limiter.release()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
+
+
+class AsyncAdmittedSession(object):
+    """Asynchronous counterpart of the AdmittedSession, the operation is cancelled at its deadline"""
+
+    def __init__(self, session, limiter, timeout, operation_timeout=0):
+        self.session = session
+        self.limiter = limiter
+        self.timeout = timeout
+        self.operation_timeout = operation_timeout
+
+    async def connect(self):
+        await self.limiter.acquire_async(self.timeout)
+        try:
+            await self.session.connect()
+        except BaseException:
+            self.limiter.release()
+            raise
+
+    async def run(self, command, args=()):
+        return await self._within_deadline(self.session.run(command, args), self._deadline())
+
+    async def run_ps(self, script):
+        return await self._within_deadline(self.session.run_ps(script), self._deadline())
+
+    async def stream_ps(self, script):
+        deadline = self._deadline()
+        chunks = self.session.stream_ps(script)
+        try:
+            while True:
+                try:
+                    chunk = await self._within_deadline(anext(chunks), deadline)
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    def _deadline(self):
+        if not self.operation_timeout:
+            return None
+        return asyncio.get_running_loop().time() + self.operation_timeout
+
+    async def _within_deadline(self, awaitable, deadline):
+        timeout = asyncio.timeout_at(deadline)
+        try:
+            async with timeout:
+                return await awaitable
+        except TimeoutError:
+            # a timeout of the operation itself is not the expired deadline
+            if not timeout.expired():
+                raise
+            raise self.limiter.operation_expired(self.operation_timeout)
+
+    async def disconnect(self):
+        try:
+            await self.session.disconnect()
+        finally:
+            self.limiter.release()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_admission_limiter(authority_instance_uuid):
+    key = str(authority_instance_uuid)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = AdmissionLimiter(key, ADCS_ADMISSION_MAX_CONCURRENT, ADCS_ADMISSION_MAX_QUEUED)
+            _limiters[key] = limiter
+        return limiter
+
+
+def admit(session, authority_instance_uuid):
+    return AdmittedSession(session, get_admission_limiter(authority_instance_uuid), ADCS_ADMISSION_QUEUE_TIMEOUT,
+                           ADCS_ADMISSION_OPERATION_TIMEOUT)
+
+
+def admit_async(session, authority_instance_uuid):
+    return AsyncAdmittedSession(session, get_admission_limiter(authority_instance_uuid),
+                                ADCS_ADMISSION_QUEUE_TIMEOUT, ADCS_ADMISSION_OPERATION_TIMEOUT)
+
+
+def get_admission_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.key: limiter.stats() for limiter in limiters}
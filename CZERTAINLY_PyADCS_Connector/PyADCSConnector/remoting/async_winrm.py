@@ -0,0 +1,740 @@
+import asyncio
+import base64
+import logging
+import ssl
+import struct
+import uuid
+import xml.etree.ElementTree as ET
+
+import spnego
+import winrm
+import xmltodict
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.serialization import Encoding
+from spnego.channel_bindings import GssChannelBindings
+from winrm.exceptions import InvalidCredentialsError, WinRMError, WinRMOperationTimeoutError, WinRMTransportError, \
+    WSManFaultError
+
+from CZERTAINLY_PyADCS_Connector.settings import ADCS_WINRM_POOL_ENABLED, ADCS_WINRM_POOL_MAX_SIZE, \
+    ADCS_WINRM_POOL_IDLE_TIMEOUT, ADCS_WINRM_POOL_ACQUIRE_TIMEOUT, ADCS_WINRM_POOL_LIVENESS_CHECK_AFTER, \
+    ADCS_WINRM_MAX_SHELLS_PER_USER
+from PyADCSConnector.exceptions.winrm_execution_exception import WinRMExecutionException
+from PyADCSConnector.remoting.admission import admit_async
+from PyADCSConnector.remoting.circuit_breaker import AsyncGuardedSession
+from PyADCSConnector.remoting.retry import retrying_async
+from PyADCSConnector.remoting.shell_pool import AsyncShellPool
+from PyADCSConnector.remoting.transport_cache import transport_cache
+from PyADCSConnector.remoting.winrm_remoting import check_result, get_credentials, shell_quota, powershell_command, \
+    stdin_chunks, get_authority_circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+# failures of a reused transport after which the connection is authenticated again
+REAUTHENTICATE_ERRORS = (InvalidCredentialsError, ConnectionError, asyncio.IncompleteReadError)
+
+# same defaults as the winrm.Protocol used by the synchronous client
+OPERATION_TIMEOUT = 20
+READ_TIMEOUT = 30
+CONNECT_TIMEOUT = 30
+
+RESOURCE_URI_CMD = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd"
+ACTION_CREATE = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Create"
+ACTION_DELETE = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete"
+ACTION_COMMAND = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Command"
+ACTION_RECEIVE = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Receive"
+ACTION_SIGNAL = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Signal"
+ACTION_SEND = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Send"
+SIGNAL_TERMINATE = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/signal/terminate"
+OPERATION_TIMEOUT_FAULT_CODE = 2150858793
+
+NAMESPACES = {
+    "soapenv": "http://www.w3.org/2003/05/soap-envelope",
+    "wsmanfault": "http://schemas.microsoft.com/wbem/wsman/1/wsmanfault",
+}
+
+SOAP_CONTENT_TYPE = "application/soap+xml;charset=UTF-8"
+MIME_BOUNDARY = b"--Encrypted Boundary"
+# CredSSP can encrypt at most 16KB at once, larger messages are sent in multiple encrypted parts
+CREDSSP_CHUNK_SIZE = 16384
+
+
+class HttpResponse(object):
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class AsyncHttpConnection(object):
+    """Minimal HTTP/1.1 keep-alive connection to the /wsman endpoint built on asyncio streams"""
+
+    def __init__(self, hostname, port, use_https=False, read_timeout=READ_TIMEOUT):
+        self.hostname = hostname
+        self.port = port
+        self.use_https = use_https
+        self.read_timeout = read_timeout
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        ssl_context = ssl.create_default_context() if self.use_https else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.hostname, self.port, ssl=ssl_context), CONNECT_TIMEOUT)
+
+    @property
+    def is_open(self):
+        # the reader is at EOF when the server closed the idle keep-alive connection
+        return self.writer is not None and not self.writer.is_closing() and not self.reader.at_eof()
+
+    def peer_certificate(self):
+        ssl_object = self.writer.get_extra_info("ssl_object")
+        return ssl_object.getpeercert(binary_form=True) if ssl_object is not None else None
+
+    async def request(self, body, headers):
+        lines = ["POST /wsman HTTP/1.1",
+                 "Host: %s:%s" % (self.hostname, self.port),
+                 "Connection: Keep-Alive",
+                 "Content-Length: %d" % len(body)]
+        lines.extend("%s: %s" % (name, value) for name, value in headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        try:
+            await self.writer.drain()
+            return await asyncio.wait_for(self._read_response(), self.read_timeout)
+        except BaseException:
+            # the state of the connection is unknown, it must not be reused
+            self.close()
+            raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection to %s:%s closed by the server" % (self.hostname, self.port))
+        status = int(status_line.split(b" ", 2)[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = headers[name] + ", " + value if name in headers else value
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";", 1)[0], 16)
+                if size == 0:
+                    # skip the trailer
+                    while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await self.reader.read()
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return HttpResponse(status, headers, body)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = None
+        self.reader = None
+
+
+class AsyncTransport(object):
+    """
+    Authenticated connection to the WinRM service. NTLM and CredSSP authenticate the connection once, the messages
+    are then encrypted with the negotiated context when HTTPS is not used, the same way as pywinrm does.
+    """
+
+    def __init__(self, hostname, port, use_https, transport, username, password, read_timeout=READ_TIMEOUT):
+        self.hostname = hostname
+        self.port = port
+        self.use_https = use_https
+        self.transport = transport
+        self.username = username
+        self.password = password
+        self.read_timeout = read_timeout
+        self.connection = None
+        self.context = None
+        self.encrypt = False
+
+    @property
+    def endpoint(self):
+        return "http%s://%s:%s/wsman" % ("s" if self.use_https else "", self.hostname, self.port)
+
+    async def send_message(self, message):
+        if self.connection is None or not self.connection.is_open:
+            if self.connection is not None:
+                # the connection expired, a new one must be authenticated again
+                transport_cache.record_reauthentication()
+            await self.connect()
+
+        body = message.encode("utf-8")
+        headers = {"User-Agent": "Python WinRM client"}
+        if self.encrypt:
+            body, headers["Content-Type"] = self._encrypt(body)
+        else:
+            headers["Content-Type"] = SOAP_CONTENT_TYPE
+        if self.transport == "basic":
+            headers["Authorization"] = self._basic_authorization()
+
+        response = await self.connection.request(body, headers)
+        if response.status == 401:
+            self.close()
+            raise InvalidCredentialsError("the specified credentials were rejected by the server")
+
+        content = self._decrypt(response) if self.encrypt else response.body
+        if response.status != 200:
+            raise WinRMTransportError("http", response.status, content.decode("utf-8", errors="replace"))
+        return content
+
+    async def connect(self):
+        self.close()
+        self.connection = AsyncHttpConnection(self.hostname, self.port, self.use_https, self.read_timeout)
+        await self.connection.open()
+        if self.transport in ("ntlm", "credssp"):
+            await self._authenticate()
+        elif self.transport != "basic":
+            raise WinRMError("Transport %s is not supported by the asynchronous WinRM client" % self.transport)
+
+    async def _authenticate(self):
+        if self.transport == "ntlm":
+            scheme = "Negotiate"
+            context = spnego.client(self.username, self.password, hostname=self.hostname, service="HTTP",
+                                    protocol="ntlm", channel_bindings=self._channel_bindings())
+        else:
+            scheme = "CredSSP"
+            context = spnego.client(self.username, self.password, hostname=self.hostname, service="HTTP",
+                                    protocol="credssp")
+
+        in_token = None
+        while True:
+            out_token = context.step(in_token)
+            headers = {"Authorization": "%s %s" % (scheme, base64.b64encode(out_token).decode("ascii")),
+                       "Content-Type": SOAP_CONTENT_TYPE}
+            response = await self.connection.request(b"", headers)
+            if context.complete:
+                if response.status != 200:
+                    raise InvalidCredentialsError("the specified credentials were rejected by the server")
+                break
+            in_token = self._get_auth_token(response, scheme)
+            if in_token is None:
+                raise InvalidCredentialsError("the server did not continue the %s authentication" % self.transport)
+
+        self.context = context
+        # HTTPS protects the messages already, otherwise they are sealed with the authentication context
+        self.encrypt = not self.use_https
+
+    def _channel_bindings(self):
+        if not self.use_https:
+            return None
+        certificate = x509.load_der_x509_certificate(self.connection.peer_certificate())
+        # RFC 5929, MD5 and SHA-1 signatures use SHA-256 for the certificate hash
+        algorithm = certificate.signature_hash_algorithm
+        if algorithm is None or isinstance(algorithm, (hashes.MD5, hashes.SHA1)):
+            algorithm = hashes.SHA256()
+        digest = hashes.Hash(algorithm)
+        digest.update(certificate.public_bytes(Encoding.DER))
+        return GssChannelBindings(application_data=b"tls-server-end-point:" + digest.finalize())
+
+    @staticmethod
+    def _get_auth_token(response, scheme):
+        for value in response.headers.get("www-authenticate", "").split(","):
+            value = value.strip()
+            if value.lower().startswith(scheme.lower() + " "):
+                return base64.b64decode(value[len(scheme) + 1:].strip())
+        return None
+
+    def _basic_authorization(self):
+        credentials = ("%s:%s" % (self.username, self.password)).encode("utf-8")
+        return "Basic " + base64.b64encode(credentials).decode("ascii")
+
+    def _encrypt(self, message):
+        return seal_message(self.context, self.transport, message)
+
+    def _decrypt(self, response):
+        return unseal_message(self.context, self.transport, response.headers.get("content-type", ""), response.body)
+
+    @property
+    def is_open(self):
+        return self.connection is not None and self.connection.is_open
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+        self.context = None
+        self.encrypt = False
+
+
+def _protocol_string(transport):
+    if transport == "credssp":
+        return b"application/HTTP-CredSSP-session-encrypted"
+    return b"application/HTTP-SPNEGO-session-encrypted"
+
+
+def seal_message(context, transport, message):
+    """
+    encrypts the SOAP message with the NTLM or CredSSP context in the multipart format of the WinRM service,
+    returns the payload and its content type
+    """
+    protocol = _protocol_string(transport)
+    if transport == "credssp" and len(message) > CREDSSP_CHUNK_SIZE:
+        content_type = "multipart/x-multi-encrypted"
+        chunks = [message[i:i + CREDSSP_CHUNK_SIZE] for i in range(0, len(message), CREDSSP_CHUNK_SIZE)]
+    else:
+        content_type = "multipart/encrypted"
+        chunks = [message]
+
+    payload = b""
+    for chunk in chunks:
+        wrapped = context.wrap_winrm(chunk)
+        payload += (MIME_BOUNDARY + b"\r\n"
+                    b"\tContent-Type: " + protocol + b"\r\n"
+                    b"\tOriginalContent: type=application/soap+xml;charset=UTF-8;Length="
+                    + str(len(chunk)).encode() + b"\r\n"
+                    + MIME_BOUNDARY + b"\r\n"
+                    b"\tContent-Type: application/octet-stream\r\n"
+                    + struct.pack("<i", len(wrapped.header)) + wrapped.header + wrapped.data)
+    payload += MIME_BOUNDARY + b"--\r\n"
+    return payload, '%s;protocol="%s";boundary="Encrypted Boundary"' % (content_type, protocol.decode())
+
+
+def unseal_message(context, transport, content_type, body):
+    """decrypts the payload created by seal_message, the body is returned as it is when it is not encrypted"""
+    if ('protocol="%s"' % _protocol_string(transport).decode()) not in content_type:
+        return body
+
+    parts = [part for part in body.split(MIME_BOUNDARY + b"\r\n") if part]
+    message = b""
+    for i in range(0, len(parts), 2):
+        expected_length = int(parts[i].strip().split(b"Length=")[1])
+        payload = parts[i + 1]
+        if payload.endswith(MIME_BOUNDARY + b"--\r\n"):
+            payload = payload[:-len(MIME_BOUNDARY + b"--\r\n")]
+        encrypted = payload.replace(b"\tContent-Type: application/octet-stream\r\n", b"")
+        header_length = struct.unpack("<i", encrypted[:4])[0]
+        decrypted = context.unwrap_winrm(encrypted[4:4 + header_length], encrypted[4 + header_length:])
+        if len(decrypted) != expected_length:
+            raise WinRMError("Encrypted length from server does not match the expected size, "
+                             "message has been tampered with")
+        message += decrypted
+    return message
+
+
+class AsyncWinRmRemoting(object):
+    """
+    Asynchronous counterpart of the WinRmRemoting. Opens a cmd shell over WS-Management and runs the commands
+    without blocking the event loop, so a single thread can have many remote operations in flight.
+    """
+
+    def __init__(self, username, password, hostname, use_https=False, port=5985, transport='credssp'):
+        self.shell_id = None
+        self.username = username
+        self.password = password
+        self.hostname = hostname
+        self.use_https = use_https
+        self.port = port
+        self.transport = transport
+        self.http = None
+
+    async def connect(self):
+        self.http = transport_cache.checkout(self._transport_key())
+        if self.http is None:
+            self.http = AsyncTransport(self.hostname, self.port, self.use_https, self.transport, self.username,
+                                       self.password)
+        elif self.http.is_open:
+            try:
+                self.shell_id = await self.open_shell()
+                transport_cache.record_handshake(avoided=True)
+                return
+            except REAUTHENTICATE_ERRORS as e:
+                # the server closed the connection or the security context expired
+                logger.debug("Reused WinRM transport to %s failed, authenticating again: %s" % (self.hostname, e))
+                self.http.close()
+                transport_cache.record_reauthentication()
+        self.shell_id = await self.open_shell()
+        transport_cache.record_handshake(avoided=False)
+
+    def _transport_key(self):
+        return "async", self.hostname, self.port, self.use_https, self.transport, self.username, self.password
+
+    async def open_shell(self):
+        req = {"env:Envelope": self._build_header(ACTION_CREATE)}
+        req["env:Envelope"]["env:Header"]["w:OptionSet"] = {
+            "w:Option": [
+                {"@Name": "WINRS_NOPROFILE", "#text": "FALSE"},
+                {"@Name": "WINRS_CODEPAGE", "#text": "437"},
+            ]
+        }
+        shell = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Shell", {})
+        shell["rsp:InputStreams"] = "stdin"
+        shell["rsp:OutputStreams"] = "stdout stderr"
+
+        root = await self._send(req)
+        return next(node for node in root.iter() if node.get("Name") == "ShellId").text
+
+    async def run_command(self, command, args=(), console_mode_stdin=True):
+        req = {"env:Envelope": self._build_header(ACTION_COMMAND, self.shell_id)}
+        req["env:Envelope"]["env:Header"]["w:OptionSet"] = {
+            "w:Option": [
+                {"@Name": "WINRS_CONSOLEMODE_STDIN", "#text": str(console_mode_stdin).upper()},
+                {"@Name": "WINRS_SKIP_CMD_SHELL", "#text": "FALSE"},
+            ]
+        }
+        command_line = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:CommandLine", {})
+        command_line["rsp:Command"] = {"#text": command}
+        if args:
+            command_line["rsp:Arguments"] = " ".join(args)
+
+        root = await self._send(req)
+        return next(node for node in root.iter() if node.tag.endswith("CommandId")).text
+
+    async def send_command_input(self, command_id, data, end=False):
+        req = {"env:Envelope": self._build_header(ACTION_SEND, self.shell_id)}
+        stream = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Send", {}) \
+            .setdefault("rsp:Stream", {})
+        stream["@CommandId"] = command_id
+        stream["@Name"] = "stdin"
+        stream["@End"] = str(end).lower()
+        stream["#text"] = base64.b64encode(data).decode("ascii")
+        await self._send(req)
+
+    async def get_command_output_raw(self, command_id):
+        """returns the next available (stdout, stderr, return code, done) of the command"""
+        req = {"env:Envelope": self._build_header(ACTION_RECEIVE, self.shell_id)}
+        stream = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Receive", {}) \
+            .setdefault("rsp:DesiredStream", {})
+        stream["@CommandId"] = command_id
+        stream["#text"] = "stdout stderr"
+
+        root = await self._send(req)
+        stdout = []
+        stderr = []
+        for node in root.iter():
+            if not node.tag.endswith("Stream") or not node.text:
+                continue
+            if node.get("Name") == "stdout":
+                stdout.append(base64.b64decode(node.text.encode("ascii")))
+            elif node.get("Name") == "stderr":
+                stderr.append(base64.b64decode(node.text.encode("ascii")))
+
+        return_code = -1
+        done = any(node.get("State", "").endswith("CommandState/Done") for node in root.iter())
+        if done:
+            return_code = int(next(node for node in root.iter() if node.tag.endswith("ExitCode")).text or -1)
+        return b"".join(stdout), b"".join(stderr), return_code, done
+
+    async def get_command_output(self, command_id):
+        stdout_buffer, stderr_buffer = [], []
+        done = False
+        return_code = -1
+        while not done:
+            try:
+                stdout, stderr, return_code, done = await self.get_command_output_raw(command_id)
+                stdout_buffer.append(stdout)
+                stderr_buffer.append(stderr)
+            except WinRMOperationTimeoutError:
+                # expected while waiting for a long-running command, just receive again
+                pass
+        return b"".join(stdout_buffer), b"".join(stderr_buffer), return_code
+
+    async def cleanup_command(self, command_id):
+        req = {"env:Envelope": self._build_header(ACTION_SIGNAL, self.shell_id)}
+        signal = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Signal", {})
+        signal["@CommandId"] = command_id
+        signal["rsp:Code"] = SIGNAL_TERMINATE
+        await self._send(req)
+
+    async def close_shell(self):
+        req = {"env:Envelope": self._build_header(ACTION_DELETE, self.shell_id)}
+        req["env:Envelope"].setdefault("env:Body", {})
+        await self._send(req)
+
+    async def run(self, command, args=(), stdin=None):
+        logger.debug("Running command: " + command + " " + str(args))
+        command_id = await self._start(command, args, stdin)
+        result = winrm.Response(await self.get_command_output(command_id))
+        await self.cleanup_command(command_id)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Return code: " + str(result.status_code))
+            if result.status_code != 0:
+                logger.debug("Error: " + result.std_err.decode(encoding='utf-8'))
+            else:
+                logger.debug("Output: " + result.std_out.decode(encoding='utf-8'))
+
+        check_result(result)
+        return result
+
+    async def run_ps(self, script):
+        """base64 encodes a Powershell script and executes the powershell encoded script command"""
+        logger.debug("Running Powershell script: " + script)
+        command, stdin = powershell_command(script)
+        return await self.run(command, stdin=stdin)
+
+    async def _start(self, command, args, stdin):
+        command_id = await self.run_command(command, args, console_mode_stdin=stdin is None)
+        if stdin is not None:
+            for chunk, end in stdin_chunks(stdin):
+                await self.send_command_input(command_id, chunk, end)
+        return command_id
+
+    async def stream(self, command, args=(), stdin=None):
+        """runs the command and yields the chunks of stdout as the Receive responses arrive"""
+        logger.debug("Streaming command: " + command + " " + str(args))
+        if not isinstance(stdin, asyncio.Future):
+            command_id = await self._start(command, args, stdin)
+        else:
+            command_id = await self.run_command(command, args, console_mode_stdin=False)
+        std_err = []
+        return_code = -1
+        try:
+            if isinstance(stdin, asyncio.Future):
+                # the process was started ahead, the input is sent once the parameters are known
+                stdin = await asyncio.shield(stdin)
+                if stdin is None:
+                    return
+                for chunk, end in stdin_chunks(stdin):
+                    await self.send_command_input(command_id, chunk, end)
+            done = False
+            while not done:
+                try:
+                    std_out, err, return_code, done = await self.get_command_output_raw(command_id)
+                except WinRMOperationTimeoutError:
+                    # expected while waiting for a long-running command, just receive again
+                    continue
+                std_err.append(err)
+                if std_out:
+                    yield std_out
+        finally:
+            await self.cleanup_command(command_id)
+        check_result(winrm.Response((b"", b"".join(std_err), return_code)))
+
+    async def stream_ps(self, script):
+        logger.debug("Streaming Powershell script: " + script)
+        command, stdin = powershell_command(script)
+        async for chunk in self.stream(command, stdin=stdin):
+            yield chunk
+
+    async def is_alive(self):
+        try:
+            command_id = await self.run_command("echo", ["alive"])
+            await self.get_command_output(command_id)
+            await self.cleanup_command(command_id)
+            return True
+        except Exception as e:
+            logger.debug("WinRM shell %s is not alive: %s" % (self.shell_id, e))
+            return False
+
+    async def disconnect(self):
+        try:
+            if self.shell_id is not None:
+                await self.close_shell()
+        except BaseException:
+            self.http.close()
+            raise
+        else:
+            # keep the authenticated connection for the next shell
+            transport_cache.checkin(self._transport_key(), self.http, AsyncTransport.close)
+        finally:
+            self.http = None
+            self.shell_id = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+    def _build_header(self, action, shell_id=None):
+        header = {
+            "@xmlns:xsd": "http://www.w3.org/2001/XMLSchema",
+            "@xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
+            "@xmlns:env": NAMESPACES["soapenv"],
+            "@xmlns:a": "http://schemas.xmlsoap.org/ws/2004/08/addressing",
+            "@xmlns:b": "http://schemas.dmtf.org/wbem/wsman/1/cimbinding.xsd",
+            "@xmlns:n": "http://schemas.xmlsoap.org/ws/2004/09/enumeration",
+            "@xmlns:x": "http://schemas.xmlsoap.org/ws/2004/09/transfer",
+            "@xmlns:w": "http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd",
+            "@xmlns:p": "http://schemas.microsoft.com/wbem/wsman/1/wsman.xsd",
+            "@xmlns:rsp": "http://schemas.microsoft.com/wbem/wsman/1/windows/shell",
+            "@xmlns:cfg": "http://schemas.microsoft.com/wbem/wsman/1/config",
+            "env:Header": {
+                "a:To": self.http.endpoint,
+                "a:ReplyTo": {"a:Address": {
+                    "@mustUnderstand": "true",
+                    "#text": "http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous"}},
+                "w:MaxEnvelopeSize": {"@mustUnderstand": "true", "#text": "153600"},
+                "a:MessageID": "uuid:%s" % uuid.uuid4(),
+                "w:Locale": {"@mustUnderstand": "false", "@xml:lang": "en-US"},
+                "p:DataLocale": {"@mustUnderstand": "false", "@xml:lang": "en-US"},
+                "w:OperationTimeout": "PT%dS" % OPERATION_TIMEOUT,
+                "w:ResourceURI": {"@mustUnderstand": "true", "#text": RESOURCE_URI_CMD},
+                "a:Action": {"@mustUnderstand": "true", "#text": action},
+            },
+        }
+        if shell_id:
+            header["env:Header"]["w:SelectorSet"] = {"w:Selector": {"@Name": "ShellId", "#text": shell_id}}
+        return header
+
+    async def _send(self, req):
+        try:
+            return ET.fromstring(await self.http.send_message(xmltodict.unparse(req)))
+        except WinRMTransportError as e:
+            raise parse_fault(e)
+
+
+def parse_fault(error):
+    """converts the SOAP fault in the response of the failed request to the same exceptions as pywinrm raises"""
+    try:
+        root = ET.fromstring(error.response_text)
+    except ET.ParseError:
+        return error
+    fault = root.find("soapenv:Body/soapenv:Fault", NAMESPACES)
+    if fault is None:
+        return error
+
+    wsman_fault_code = None
+    wsman_fault = fault.find("soapenv:Detail/wsmanfault:WSManFault[@Code]", NAMESPACES)
+    if wsman_fault is not None:
+        wsman_fault_code = int(wsman_fault.attrib["Code"])
+        if wsman_fault_code == OPERATION_TIMEOUT_FAULT_CODE:
+            return WinRMOperationTimeoutError()
+
+    fault_code = fault.find("soapenv:Code/soapenv:Value", NAMESPACES)
+    fault_subcode = fault.find("soapenv:Code/soapenv:Subcode/soapenv:Value", NAMESPACES)
+    reason = fault.find("soapenv:Reason/soapenv:Text", NAMESPACES)
+    return WSManFaultError(
+        code=error.code,
+        message=error.message,
+        response=error.response_text,
+        reason=reason.text if reason is not None and reason.text else "(no error message in fault)",
+        fault_code=fault_code.text if fault_code is not None else None,
+        fault_subcode=fault_subcode.text if fault_subcode is not None else None,
+        wsman_fault_code=wsman_fault_code,
+    )
+
+
+class AsyncPooledSession(object):
+    """Session leased from the asynchronous shell pool of the authority instance, see PooledSession"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.session = None
+        self.broken = False
+
+    async def connect(self):
+        self.session = await self.pool.acquire(ADCS_WINRM_POOL_ACQUIRE_TIMEOUT)
+        self.broken = False
+
+    async def run(self, command, args=()):
+        return await self._call(self.session.run(command, args))
+
+    async def run_ps(self, script):
+        return await self._call(self.session.run_ps(script))
+
+    async def stream_ps(self, script):
+        try:
+            async for chunk in self.session.stream_ps(script):
+                yield chunk
+        except WinRMExecutionException:
+            raise
+        except (Exception, asyncio.CancelledError):
+            # a stream cancelled at its deadline may leave the shell in the middle of a request
+            self.broken = True
+            raise
+
+    async def _call(self, coroutine):
+        try:
+            return await coroutine
+        except WinRMExecutionException:
+            # the command failed, the shell itself is still usable
+            raise
+        except BaseException:
+            self.broken = True
+            raise
+
+    async def disconnect(self):
+        if self.session is None:
+            return
+        self.pool.release(self.session, discard=self.broken)
+        self.session = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+
+def create_async_session_from_authority_instance(authority_instance):
+    """must be called on the remoting loop when pooling is enabled, the pools belong to that loop"""
+    if not ADCS_WINRM_POOL_ENABLED:
+        session = _create_async_session(authority_instance)
+    else:
+        session = AsyncPooledSession(get_async_shell_pool(authority_instance))
+    session = AsyncGuardedSession(admit_async(session, authority_instance.uuid),
+                                  get_authority_circuit_breaker(authority_instance))
+    return retrying_async(session, authority_instance.uuid)
+
+
+def _create_async_session(authority_instance):
+    username, password = get_credentials(authority_instance)
+    return AsyncWinRmRemoting(username, password, authority_instance.address, authority_instance.https,
+                              authority_instance.port)
+
+
+async def run_ps_async(authority_instance, script, idempotent=False):
+    async with create_async_session_from_authority_instance(authority_instance) as session:
+        return await session.run_ps(script, idempotent=idempotent)
+
+
+# accessed only from the remoting loop, so no locking is needed
+_async_shell_pools = {}
+
+
+def get_async_shell_pool(authority_instance):
+    username, password = get_credentials(authority_instance)
+    fingerprint = (authority_instance.address, authority_instance.port, authority_instance.https,
+                   authority_instance.transport, username, password)
+    key = str(authority_instance.uuid)
+
+    pool = _async_shell_pools.get(key)
+    if pool is not None and pool.fingerprint != fingerprint:
+        logger.info("Connection of authority instance %s changed, closing its asynchronous WinRM shells" % key)
+        asyncio.ensure_future(pool.close())
+        pool = None
+    if pool is None:
+        pool = AsyncShellPool(key,
+                              lambda: _create_async_session(authority_instance),
+                              shell_quota,
+                              (authority_instance.address.lower(), username),
+                              fingerprint=fingerprint,
+                              max_size=min(ADCS_WINRM_POOL_MAX_SIZE, ADCS_WINRM_MAX_SHELLS_PER_USER),
+                              idle_timeout=ADCS_WINRM_POOL_IDLE_TIMEOUT,
+                              liveness_check_after=ADCS_WINRM_POOL_LIVENESS_CHECK_AFTER)
+        _async_shell_pools[key] = pool
+    return pool
+
+
+async def close_async_shell_pool(authority_instance_uuid):
+    pool = _async_shell_pools.pop(str(authority_instance_uuid), None)
+    if pool is not None:
+        await pool.close()
+
+
+def get_async_shell_pool_stats():
+    return {pool.key: pool.stats() for pool in list(_async_shell_pools.values())}
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import threading
+import time
+
+from pypsrp.exceptions import WinRMTransportError as PsrpTransportError
+from winrm.exceptions import WinRMTransportError
+
+from CZERTAINLY_PyADCS_Connector.settings import ADCS_CIRCUIT_BREAKER_FAILURE_THRESHOLD, \
+    ADCS_CIRCUIT_BREAKER_RESET_TIMEOUT
+from PyADCSConnector.exceptions.circuit_open_exception import CircuitOpenException
+from PyADCSConnector.exceptions.remoting_exception import RemotingException
+from PyADCSConnector.exceptions.service_unavailable_exception import ServiceUnavailableException
+from PyADCSConnector.exceptions.too_many_requests_exception import TooManyRequestsException
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def is_transport_failure(exception):
+    """failures showing that the endpoint is not reachable, a failed script or a SOAP fault is not one of them"""
+    # requests exceptions and asyncio timeouts are subclasses of the OSError
+    return isinstance(exception, (OSError, WinRMTransportError, PsrpTransportError))
+
+
+def is_local_rejection(exception):
+    """failures raised by the connector before the endpoint was called, like a full admission queue or shell pool"""
+    return isinstance(exception, (RemotingException, TooManyRequestsException, ServiceUnavailableException))
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling an authority instance after consecutive transport failures. While the circuit is open the callers
+    fail immediately, after the reset timeout the next caller probes the endpoint and closes the circuit when the
+    probe succeeds.
+    """
+
+    def __init__(self, key, probe, failure_threshold=5, reset_timeout=30):
+        self.key = key
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_failure = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        if self._start_probe():
+            try:
+                self.probe()
+            except Exception as e:
+                raise self._probe_failed(e)
+            except BaseException as e:
+                # a cancelled or interrupted probe must not leave the circuit half open
+                self._probe_failed(e)
+                raise
+            self._probe_succeeded()
+
+    async def before_call_async(self):
+        if self._start_probe():
+            try:
+                # the probe is synchronous, it must not block the loop
+                await asyncio.get_running_loop().run_in_executor(None, self.probe)
+            except Exception as e:
+                raise self._probe_failed(e)
+            except BaseException as e:
+                # a cancelled or interrupted probe must not leave the circuit half open
+                self._probe_failed(e)
+                raise
+            self._probe_succeeded()
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self, exception):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_failure = str(exception)
+            if self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+                logger.warning("Opening circuit of authority %s after %d consecutive failures: %s"
+                               % (self.key, self.consecutive_failures, exception))
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutiveFailures": self.consecutive_failures,
+                "lastFailure": self.last_failure,
+            }
+
+    def _start_probe(self):
+        """returns True when the caller must probe the endpoint before the call"""
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+                return True
+            raise CircuitOpenException(
+                "Authority %s is not reachable, calls are suspended after %d consecutive failures: %s"
+                % (self.key, self.consecutive_failures, self.last_failure),
+                max(1, int(remaining)))
+
+    def _probe_succeeded(self):
+        logger.info("Probe of authority %s succeeded, closing circuit" % self.key)
+        self.reset()
+
+    def _probe_failed(self, exception):
+        with self._lock:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.last_failure = str(exception)
+        logger.info("Probe of authority %s failed, circuit stays open: %s" % (self.key, exception))
+        return CircuitOpenException("Authority %s is not reachable: %s" % (self.key, exception),
+                                    self.reset_timeout)
+
+
+class GuardedSession(object):
+    """Session whose connect and commands go through the circuit breaker of the authority instance"""
+
+    def __init__(self, session, breaker):
+        self.session = session
+        self.breaker = breaker
+
+    def connect(self):
+        self.breaker.before_call()
+        self._call(self.session.connect)
+
+    def run(self, command, args=()):
+        return self._call(self.session.run, command, args)
+
+    def run_ps(self, script):
+        return self._call(self.session.run_ps, script)
+
+    def stream_ps(self, script):
+        try:
+            yield from self.session.stream_ps(script)
+        except Exception as e:
+            self._record(e)
+            raise
+        self.breaker.record_success()
+
+    def _call(self, method, *args):
+        try:
+            result = method(*args)
+        except Exception as e:
+            self._record(e)
+            raise
+        self.breaker.record_success()
+        return result
+
+    def _record(self, exception):
+        if is_transport_failure(exception):
+            self.breaker.record_failure(exception)
+        elif not is_local_rejection(exception):
+            # the endpoint answered
+            self.breaker.record_success()
+
+    def disconnect(self):
+        self.session.disconnect()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
+
+
+class AsyncGuardedSession(GuardedSession):
+    """Asynchronous counterpart of the GuardedSession"""
+
+    async def connect(self):
+        await self.breaker.before_call_async()
+        await self._call(self.session.connect)
+
+    async def run(self, command, args=()):
+        return await self._call(self.session.run, command, args)
+
+    async def run_ps(self, script):
+        return await self._call(self.session.run_ps, script)
+
+    async def stream_ps(self, script):
+        try:
+            async for chunk in self.session.stream_ps(script):
+                yield chunk
+        except Exception as e:
+            self._record(e)
+            raise
+        self.breaker.record_success()
+
+    async def _call(self, method, *args):
+        try:
+            result = await method(*args)
+        except Exception as e:
+            self._record(e)
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def disconnect(self):
+        await self.session.disconnect()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(authority_instance_uuid, probe):
+    """probe is used when the breaker is created, it must check the endpoint with a new unpooled session"""
+    key = str(authority_instance_uuid)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key, probe, ADCS_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                                     ADCS_CIRCUIT_BREAKER_RESET_TIMEOUT)
+            _breakers[key] = breaker
+        else:
+            # the connection of the authority instance may have changed
+            breaker.probe = probe
+        return breaker
+
+
+def reset_circuit_breaker(authority_instance_uuid):
+    with _breakers_lock:
+        breaker = _breakers.pop(str(authority_instance_uuid), None)
+    if breaker is not None:
+        breaker.reset()
+
+
+def get_circuit_breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.key: breaker.stats() for breaker in breakers}
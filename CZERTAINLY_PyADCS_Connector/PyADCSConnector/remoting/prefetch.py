@@ -0,0 +1,71 @@
+import asyncio
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the output in the queue of a prefetched script
+_END = object()
+
+
+class ScriptPrefetcher(object):
+    """
+    Runs a template script repeatedly with parameters known only when the previous run finished, like the pages
+    of a dump continuing after the last row of the previous page. The powershell processes of the next runs are
+    started ahead on their own sessions, so the start of the process and the import of the modules overlap with
+    the output of the current run. The depth is the number of processes waiting for their parameters.
+    """
+
+    def __init__(self, session_factory, template, depth=1):
+        self.session_factory = session_factory
+        self.template = template
+        self.depth = depth
+        self._ready = collections.deque()
+
+    async def stream(self, **parameters):
+        """yields the chunks of the output of the script run with the parameters"""
+        if not self._ready:
+            self._start()
+        script, output, task = self._ready.popleft()
+        script.resolve(**parameters)
+        while len(self._ready) < self.depth:
+            self._start()
+
+        while True:
+            chunk = await output.get()
+            if chunk is _END:
+                break
+            yield chunk
+        # raises the failure of the run
+        await task
+
+    def _start(self):
+        script = self.template.defer()
+        output = asyncio.Queue()
+        task = asyncio.ensure_future(self._run(script, output))
+        self._ready.append((script, output, task))
+
+    async def _run(self, script, output):
+        try:
+            async with self.session_factory() as session:
+                async for chunk in session.stream_ps(script, idempotent=True):
+                    await output.put(chunk)
+        finally:
+            await output.put(_END)
+
+    async def close(self):
+        """terminates the processes still waiting for their parameters"""
+        ready, self._ready = list(self._ready), collections.deque()
+        for script, _, _ in ready:
+            script.abandon()
+        for _, _, task in ready:
+            try:
+                await task
+            except Exception as e:
+                logger.debug("Prefetched script %s failed: %s" % (self.template.name, e))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
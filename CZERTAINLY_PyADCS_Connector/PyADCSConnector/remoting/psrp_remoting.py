@@ -0,0 +1,136 @@
+import logging
+
+import requests
+import winrm
+from pypsrp.exceptions import AuthenticationError
+from pypsrp.powershell import PowerShell, RunspacePool
+from pypsrp.wsman import WSMan
+
+from CZERTAINLY_PyADCS_Connector.settings import ADCS_PSRP_CA_CACHE_TTL
+from PyADCSConnector.exceptions.winrm_execution_exception import WinRMExecutionException
+from PyADCSConnector.remoting.transport_cache import transport_cache
+from PyADCSConnector.remoting.winrm.script_template import Script
+from PyADCSConnector.remoting.winrm.scripts import psrp_runspace_initialization_script, strip_prelude
+
+logger = logging.getLogger(__name__)
+
+# failures of a reused transport after which the connection is authenticated again
+REAUTHENTICATE_ERRORS = (AuthenticationError, requests.exceptions.ConnectionError)
+
+# width of the text output, same as the console buffer width set by the script prelude
+OUTPUT_WIDTH = 2048
+
+
+class PsrpRemoting(object):
+    """
+    Executes scripts in a warm PowerShell runspace opened over the PowerShell Remoting Protocol instead of
+    starting a new powershell process for every script. The runspace has PSPKI imported when connected.
+    """
+
+    def __init__(self, username, password, hostname, use_https=False, port=5985, transport='credssp'):
+        self.username = username
+        self.password = password
+        self.hostname = hostname
+        self.use_https = use_https
+        self.port = port
+        self.transport = transport
+        self.wsman = None
+        self.runspace_pool = None
+
+    def connect(self):
+        self.wsman = transport_cache.checkout(self._transport_key())
+        if self.wsman is not None:
+            try:
+                self._open_runspace_pool()
+                transport_cache.record_handshake(avoided=True)
+                return
+            except REAUTHENTICATE_ERRORS as e:
+                # the server closed the connection or the security context expired
+                logger.debug("Reused PSRP transport to %s failed, authenticating again: %s" % (self.hostname, e))
+                self.wsman.close()
+                transport_cache.record_reauthentication()
+        self.wsman = WSMan(self.hostname,
+                           port=self.port,
+                           username=self.username,
+                           password=self.password,
+                           ssl=self.use_https,
+                           auth=self.transport)
+        self._open_runspace_pool()
+        transport_cache.record_handshake(avoided=False)
+
+    def _open_runspace_pool(self):
+        self.runspace_pool = RunspacePool(self.wsman)
+        self.runspace_pool.open()
+        self._invoke(psrp_runspace_initialization_script(ADCS_PSRP_CA_CACHE_TTL))
+
+    def _transport_key(self):
+        return "psrp", self.hostname, self.port, self.use_https, self.transport, self.username, self.password
+
+    def run(self, command, args=()):
+        return self.run_ps(" ".join([command] + list(args)))
+
+    def run_ps(self, script):
+        """executes the script in the prepared runspace, the module import and console setup are skipped"""
+        logger.debug("Running Powershell script in runspace: " + script)
+        if isinstance(script, Script) and script.template.parameterized:
+            result = self._invoke(script.template.body, script.parameters)
+        else:
+            result = self._invoke(strip_prelude(script))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Return code: " + str(result.status_code))
+            if result.status_code != 0:
+                logger.debug("Error: " + result.std_err.decode(encoding='utf-8'))
+            else:
+                logger.debug("Output: " + result.std_out.decode(encoding='utf-8'))
+
+        if result.status_code != 0:
+            raise WinRMExecutionException(result.status_code, result.std_err.decode('utf-8'))
+        return result
+
+    def stream_ps(self, script):
+        """the runspace returns the formatted output at once, it is yielded as a single chunk"""
+        yield self.run_ps(script).std_out
+
+    def _invoke(self, script, parameters=None):
+        ps = PowerShell(self.runspace_pool)
+        # the runspace is reused, the variables of a script must not leak into the scripts executed after it
+        if parameters is not None:
+            # the parameters are passed as a hashtable, the script reads them the same way as from the JSON input
+            ps.add_script("param($params)\n" + script, use_local_scope=True).add_parameter("params", parameters)
+        else:
+            ps.add_script(script, use_local_scope=True)
+        # format the objects the same way as the console of the powershell process does
+        ps.add_command("Out-String").add_parameter("Width", OUTPUT_WIDTH)
+        output = ps.invoke()
+
+        std_out = "".join(str(value) for value in output).encode('utf-8')
+        std_err = "\n".join(str(error) for error in ps.streams.error).encode('utf-8')
+        return winrm.Response((std_out, std_err, 1 if ps.had_errors else 0))
+
+    def is_alive(self):
+        try:
+            return self.runspace_pool.is_alive()
+        except Exception as e:
+            logger.debug("PowerShell runspace on %s is not alive: %s" % (self.hostname, e))
+            return False
+
+    def disconnect(self):
+        try:
+            self.runspace_pool.close()
+        except Exception:
+            self.wsman.close()
+            raise
+        else:
+            # keep the authenticated session for the next runspace
+            transport_cache.checkin(self._transport_key(), self.wsman, WSMan.close)
+        finally:
+            self.runspace_pool = None
+            self.wsman = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
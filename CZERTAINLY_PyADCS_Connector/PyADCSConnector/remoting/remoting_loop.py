@@ -0,0 +1,35 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_remoting_loop():
+    """
+    Returns the process wide event loop that runs all asynchronous remote operations. The loop runs in its own
+    daemon thread and is started lazily, so that it is created after the worker process was forked.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="remoting-loop", daemon=True).start()
+            logger.debug("Started remoting event loop")
+        return _loop
+
+
+def submit(coroutine):
+    """schedules the coroutine on the remoting loop from any thread, returns concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coroutine, get_remoting_loop())
+
+
+async def run_on_remoting_loop(coroutine):
+    """awaits the coroutine on the remoting loop, so that connections and shells are shared by all callers"""
+    loop = get_remoting_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coroutine
+    return await asyncio.wrap_future(submit(coroutine))
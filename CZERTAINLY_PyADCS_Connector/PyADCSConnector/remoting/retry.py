@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import requests
+from pypsrp.exceptions import WinRMTransportError as PsrpTransportError, WSManFaultError as PsrpFaultError
+from winrm.exceptions import WinRMOperationTimeoutError, WinRMTransportError, WSManFaultError
+
+from CZERTAINLY_PyADCS_Connector.settings import ADCS_RETRY_MAX_ATTEMPTS, ADCS_RETRY_BASE_DELAY, \
+    ADCS_RETRY_MAX_DELAY, ADCS_RETRY_BUDGET_RATIO
+
+logger = logging.getLogger(__name__)
+
+# WS-Man faults after which the same request can succeed, ERROR_WSMAN_OPERATION_TIMEDOUT (0x80338029) and
+# ERROR_WSMAN_INVALID_SELECTORS (0x8033805B) returned when the shell was closed on the server
+TRANSIENT_WSMAN_FAULT_CODES = (2150858793, 2150858843)
+# retries an authority instance may accumulate while the calls succeed
+RETRY_BUDGET_CAPACITY = 10
+
+
+def is_transient(exception):
+    """failures after which the same read-only script can be run again, a failed script is not one of them"""
+    if isinstance(exception, (WinRMTransportError, PsrpTransportError)):
+        return exception.code >= 500
+    if isinstance(exception, WSManFaultError):
+        return exception.wsman_fault_code in TRANSIENT_WSMAN_FAULT_CODES
+    if isinstance(exception, PsrpFaultError):
+        return exception.code in TRANSIENT_WSMAN_FAULT_CODES
+    return isinstance(exception, (WinRMOperationTimeoutError, ConnectionError, TimeoutError,
+                                  asyncio.IncompleteReadError, requests.exceptions.ConnectionError,
+                                  requests.exceptions.Timeout))
+
+
+class RetryBudget(object):
+    """
+    Token bucket limiting the retries against one authority instance. Every call deposits a part of a token and
+    every retry takes a whole one, so that the retries stay a fraction of the calls and do not multiply the load
+    of an endpoint that fails for everybody.
+    """
+
+    def __init__(self, key, ratio=0.2, capacity=RETRY_BUDGET_CAPACITY):
+        self.key = key
+        self.ratio = ratio
+        self.capacity = capacity
+
+        self.retries = 0
+        self.exhausted = 0
+
+        self._tokens = capacity
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                self.exhausted += 1
+                return False
+            self._tokens -= 1
+            self.retries += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tokens": self._tokens,
+                "retries": self.retries,
+                "exhausted": self.exhausted,
+            }
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter, the delay before a retry is random up to the capped exponential value"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=5.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def should_retry(self, exception, attempt, budget):
+        if attempt >= self.max_attempts or not is_transient(exception):
+            return False
+        if not budget.withdraw():
+            logger.warning("Retry budget of authority %s is exhausted, not retrying: %s" % (budget.key, exception))
+            return False
+        return True
+
+
+class RetryingSession(object):
+    """
+    Session that runs the idempotent scripts again after a transient failure. The inner session is reconnected
+    before the retry, so that a broken shell or connection is replaced. Scripts that change the state of the
+    authority, like the certificate submission or revocation, are never retried.
+    """
+
+    def __init__(self, session, policy, budget):
+        self.session = session
+        self.policy = policy
+        self.budget = budget
+
+    def connect(self):
+        self.session.connect()
+
+    def run(self, command, args=()):
+        return self.session.run(command, args)
+
+    def run_ps(self, script, idempotent=False):
+        self.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                return self.session.run_ps(script)
+            except Exception as e:
+                if not idempotent or not self.policy.should_retry(e, attempt, self.budget):
+                    raise
+                self._before_retry(e, attempt)
+                attempt += 1
+
+    def stream_ps(self, script, idempotent=False):
+        self.budget.deposit()
+        attempt = 1
+        while True:
+            started = False
+            try:
+                for chunk in self.session.stream_ps(script):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                # the consumer already has a part of the output, running the script again would duplicate it
+                if started or not idempotent or not self.policy.should_retry(e, attempt, self.budget):
+                    raise
+                self._before_retry(e, attempt)
+                attempt += 1
+
+    def _before_retry(self, exception, attempt):
+        delay = self.policy.delay(attempt)
+        logger.info("Attempt %d against authority %s failed, retrying in %.2fs: %s"
+                    % (attempt, self.budget.key, delay, exception))
+        time.sleep(delay)
+        self._reconnect()
+
+    def _reconnect(self):
+        try:
+            self.session.disconnect()
+        except Exception as e:
+            logger.debug("Failed to close the session before retry: %s" % e)
+        self.session.connect()
+
+    def disconnect(self):
+        self.session.disconnect()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
+
+
+class AsyncRetryingSession(RetryingSession):
+    """Asynchronous counterpart of the RetryingSession"""
+
+    async def connect(self):
+        await self.session.connect()
+
+    async def run(self, command, args=()):
+        return await self.session.run(command, args)
+
+    async def run_ps(self, script, idempotent=False):
+        self.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                return await self.session.run_ps(script)
+            except Exception as e:
+                if not idempotent or not self.policy.should_retry(e, attempt, self.budget):
+                    raise
+                await self._before_retry(e, attempt)
+                attempt += 1
+
+    async def stream_ps(self, script, idempotent=False):
+        self.budget.deposit()
+        attempt = 1
+        while True:
+            started = False
+            try:
+                async for chunk in self.session.stream_ps(script):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not idempotent or not self.policy.should_retry(e, attempt, self.budget):
+                    raise
+                await self._before_retry(e, attempt)
+                attempt += 1
+
+    async def _before_retry(self, exception, attempt):
+        delay = self.policy.delay(attempt)
+        logger.info("Attempt %d against authority %s failed, retrying in %.2fs: %s"
+                    % (attempt, self.budget.key, delay, exception))
+        await asyncio.sleep(delay)
+        await self._reconnect()
+
+    async def _reconnect(self):
+        try:
+            await self.session.disconnect()
+        except Exception as e:
+            logger.debug("Failed to close the session before retry: %s" % e)
+        await self.session.connect()
+
+    async def disconnect(self):
+        await self.session.disconnect()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+
+retry_policy = RetryPolicy(ADCS_RETRY_MAX_ATTEMPTS, ADCS_RETRY_BASE_DELAY, ADCS_RETRY_MAX_DELAY)
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def get_retry_budget(authority_instance_uuid):
+    key = str(authority_instance_uuid)
+    with _budgets_lock:
+        budget = _budgets.get(key)
+        if budget is None:
+            budget = RetryBudget(key, ADCS_RETRY_BUDGET_RATIO)
+            _budgets[key] = budget
+        return budget
+
+
+def retrying(session, authority_instance_uuid):
+    return RetryingSession(session, retry_policy, get_retry_budget(authority_instance_uuid))
+
+
+def retrying_async(session, authority_instance_uuid):
+    return AsyncRetryingSession(session, retry_policy, get_retry_budget(authority_instance_uuid))
+
+
+def get_retry_stats():
+    with _budgets_lock:
+        budgets = list(_budgets.values())
+    return {budget.key: budget.stats() for budget in budgets}
@@ -0,0 +1,382 @@
+import asyncio
+import logging
+import threading
+import time
+
+from winrm.exceptions import WSManFaultError
+
+from PyADCSConnector.exceptions.remoting_exception import RemotingException
+
+logger = logging.getLogger(__name__)
+
+# how long to sleep between checks when the per-user quota is held by another pool
+QUOTA_POLL_INTERVAL = 1.0
+# seconds without a quota fault after which a lowered ceiling of the pool is raised by one shell
+CEILING_RECOVERY_INTERVAL = 300
+
+
+class ShellQuota(object):
+    """
+    Process wide counter of open shells per (host, user), so that pools of different authority instances
+    pointing to the same host with the same user do not exceed the MaxShellsPerUser quota together.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def try_reserve(self, quota_key):
+        with self._lock:
+            current = self._open.get(quota_key, 0)
+            if current >= self.limit:
+                return False
+            self._open[quota_key] = current + 1
+            return True
+
+    def release(self, quota_key):
+        with self._lock:
+            current = self._open.get(quota_key, 0)
+            if current <= 1:
+                self._open.pop(quota_key, None)
+            else:
+                self._open[quota_key] = current - 1
+
+    def used(self, quota_key):
+        with self._lock:
+            return self._open.get(quota_key, 0)
+
+
+class PooledShell(object):
+    def __init__(self, session):
+        self.session = session
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+
+class ShellPool(object):
+    """
+    Thread-safe pool of connected remoting sessions (open shells) for one authority instance.
+
+    Sessions are created by the factory and must provide connect(), disconnect() and is_alive().
+    """
+
+    def __init__(self, key, factory, quota, quota_key, fingerprint=None, min_size=0, max_size=5, idle_timeout=300,
+                 liveness_check_after=30, ceiling_recovery_interval=CEILING_RECOVERY_INTERVAL):
+        if max_size < 1:
+            raise ValueError("Maximum size of the shell pool must be at least 1")
+        self.key = key
+        self.factory = factory
+        self.quota = quota
+        self.quota_key = quota_key
+        self.fingerprint = fingerprint
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.liveness_check_after = liveness_check_after
+        self.ceiling_recovery_interval = ceiling_recovery_interval
+
+        # lowered when the server refuses new shells because of the quota, raised again after a quiet period
+        self.ceiling = max_size
+        self._ceiling_lowered_at = None
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+        self._idle = []
+        self._leased = 0
+        self._opening = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def size(self):
+        with self._condition:
+            return self._size()
+
+    def _size(self):
+        return len(self._idle) + self._leased + self._opening
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            shell = None
+            open_new = False
+            timed_out = False
+            with self._condition:
+                if self._closed:
+                    raise RemotingException("Shell pool for %s is closed" % self.key)
+                expired = self._take_expired()
+                self._recover_ceiling()
+                if self._idle:
+                    shell = self._idle.pop()
+                    self._leased += 1
+                elif self._size() < self.ceiling and self.quota.try_reserve(self.quota_key):
+                    self._opening += 1
+                    open_new = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        timed_out = True
+                    else:
+                        if self._size() < self.ceiling:
+                            # quota is used by a pool of another authority, nobody will notify us
+                            remaining = min(remaining, QUOTA_POLL_INTERVAL)
+                        self._condition.wait(remaining)
+            self._close_shells(expired)
+            if timed_out:
+                raise RemotingException(
+                    "Timed out after %ss waiting for a free WinRM shell for %s" % (timeout, self.key))
+
+            if shell is not None:
+                if self._is_usable(shell):
+                    with self._condition:
+                        self.reused += 1
+                    shell.last_used_at = time.monotonic()
+                    return shell
+                logger.debug("Discarding dead WinRM shell of %s" % self.key)
+                self.release(shell, discard=True)
+            elif open_new:
+                shell = self._open_shell()
+                if shell is not None:
+                    return shell
+
+    def prewarm(self):
+        """
+        Opens shells until the pool holds min_size of them, so that the first operations do not wait for the shell
+        creation. A failure is logged, the shells are then opened on demand.
+        """
+        while True:
+            with self._condition:
+                if (self._closed or self._size() >= min(self.min_size, self.ceiling)
+                        or not self.quota.try_reserve(self.quota_key)):
+                    return
+                self._opening += 1
+            try:
+                shell = self._open_shell()
+            except Exception as e:
+                logger.warning("Failed to pre-warm WinRM shells for %s: %s" % (self.key, e))
+                return
+            if shell is None:
+                return
+            self.release(shell)
+
+    def release(self, shell, discard=False):
+        with self._condition:
+            self._leased -= 1
+            keep = not discard and not self._closed
+            if keep:
+                shell.last_used_at = time.monotonic()
+                self._idle.append(shell)
+            self._condition.notify()
+        if not keep:
+            self._close_shells([shell])
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            shells = self._idle
+            self._idle = []
+            self._condition.notify_all()
+        self._close_shells(shells)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "idle": len(self._idle),
+                "leased": self._leased,
+                "ceiling": self.ceiling,
+                "maxSize": self.max_size,
+                "created": self.created,
+                "reused": self.reused,
+                "evicted": self.evicted,
+            }
+
+    def _open_shell(self):
+        session = self.factory()
+        try:
+            session.connect()
+        except WSManFaultError as e:
+            self._abort_opening()
+            if not is_shell_quota_fault(e):
+                raise
+            with self._condition:
+                # server quota is lower than configured, keep at most the shells we already have
+                self.ceiling = max(1, self._size())
+                self._ceiling_lowered_at = time.monotonic()
+                logger.warning("WinRM shell quota reached for %s, limiting pool to %d shells"
+                               % (self.key, self.ceiling))
+                if self._size() == 0:
+                    raise
+            return None
+        except Exception:
+            self._abort_opening()
+            raise
+
+        shell = PooledShell(session)
+        with self._condition:
+            self._opening -= 1
+            self._leased += 1
+            self.created += 1
+        logger.debug("Opened new WinRM shell for %s" % self.key)
+        return shell
+
+    def _abort_opening(self):
+        self.quota.release(self.quota_key)
+        with self._condition:
+            self._opening -= 1
+            self._condition.notify()
+
+    def _is_usable(self, shell):
+        if time.monotonic() - shell.last_used_at < self.liveness_check_after:
+            return True
+        return shell.session.is_alive()
+
+    def _recover_ceiling(self):
+        # must be called with the condition held, the quota of the server may have been raised or the shells of
+        # other clients closed, one more shell is tried after every quiet period
+        if (self.ceiling < self.max_size
+                and time.monotonic() - self._ceiling_lowered_at >= self.ceiling_recovery_interval):
+            self.ceiling += 1
+            self._ceiling_lowered_at = time.monotonic()
+            logger.info("Raising the WinRM shell limit of %s to %d shells" % (self.key, self.ceiling))
+
+    def _take_expired(self):
+        # must be called with the condition held, the oldest idle shells are at the beginning of the list
+        now = time.monotonic()
+        expired = []
+        while (self._idle and self._size() > self.min_size
+               and now - self._idle[0].last_used_at > self.idle_timeout):
+            expired.append(self._idle.pop(0))
+        self.evicted += len(expired)
+        return expired
+
+    def _close_shells(self, shells):
+        for shell in shells:
+            try:
+                shell.session.disconnect()
+            except Exception as e:
+                logger.debug("Failed to close WinRM shell of %s: %s" % (self.key, e))
+            finally:
+                self.quota.release(self.quota_key)
+
+
+class AsyncShellPool(object):
+    """
+    Pool of connected asynchronous sessions for one authority instance. The pool belongs to the event loop it is
+    used from and is not thread-safe. Sessions must provide coroutines connect(), disconnect() and is_alive().
+    The per-user quota is shared with the synchronous pools.
+    """
+
+    def __init__(self, key, factory, quota, quota_key, fingerprint=None, max_size=5, idle_timeout=300,
+                 liveness_check_after=30):
+        if max_size < 1:
+            raise ValueError("Maximum size of the shell pool must be at least 1")
+        self.key = key
+        self.factory = factory
+        self.quota = quota
+        self.quota_key = quota_key
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.liveness_check_after = liveness_check_after
+
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+        self._idle = []
+        self._leased = 0
+        self._closed = False
+        self._slots = asyncio.Semaphore(max_size)
+
+    def size(self):
+        return len(self._idle) + self._leased
+
+    async def acquire(self, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise RemotingException(
+                "Timed out after %ss waiting for a free WinRM shell for %s" % (timeout, self.key))
+
+        try:
+            if self._closed:
+                raise RemotingException("Shell pool for %s is closed" % self.key)
+            await self._close_sessions(self._take_expired())
+            while self._idle:
+                shell = self._idle.pop()
+                if (time.monotonic() - shell.last_used_at < self.liveness_check_after
+                        or await shell.session.is_alive()):
+                    self.reused += 1
+                    self._leased += 1
+                    return shell.session
+                logger.debug("Discarding dead WinRM shell of %s" % self.key)
+                await self._close_sessions([shell])
+
+            # quota is used by pools of other authorities or the synchronous pools, nobody will notify us
+            while not self.quota.try_reserve(self.quota_key):
+                if loop.time() >= deadline:
+                    raise RemotingException(
+                        "Timed out after %ss waiting for a free WinRM shell for %s" % (timeout, self.key))
+                await asyncio.sleep(QUOTA_POLL_INTERVAL)
+
+            session = self.factory()
+            try:
+                await session.connect()
+            except BaseException:
+                self.quota.release(self.quota_key)
+                raise
+            self.created += 1
+            self._leased += 1
+            logger.debug("Opened new asynchronous WinRM shell for %s" % self.key)
+            return session
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, session, discard=False):
+        self._leased -= 1
+        self._slots.release()
+        if discard or self._closed:
+            asyncio.ensure_future(self._close_sessions([PooledShell(session)]))
+        else:
+            self._idle.append(PooledShell(session))
+
+    async def close(self):
+        self._closed = True
+        shells = self._idle
+        self._idle = []
+        await self._close_sessions(shells)
+
+    def stats(self):
+        return {
+            "idle": len(self._idle),
+            "leased": self._leased,
+            "maxSize": self.max_size,
+            "created": self.created,
+            "reused": self.reused,
+            "evicted": self.evicted,
+        }
+
+    def _take_expired(self):
+        now = time.monotonic()
+        expired = []
+        while self._idle and now - self._idle[0].last_used_at > self.idle_timeout:
+            expired.append(self._idle.pop(0))
+        self.evicted += len(expired)
+        return expired
+
+    async def _close_sessions(self, shells):
+        for shell in shells:
+            try:
+                await shell.session.disconnect()
+            except Exception as e:
+                logger.debug("Failed to close WinRM shell of %s: %s" % (self.key, e))
+            finally:
+                self.quota.release(self.quota_key)
+
+
+def is_shell_quota_fault(exception):
+    return isinstance(exception, WSManFaultError) and "concurrent shells" in str(exception)
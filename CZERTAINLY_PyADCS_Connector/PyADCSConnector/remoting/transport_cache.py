@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+
+from CZERTAINLY_PyADCS_Connector.settings import ADCS_WINRM_TRANSPORT_REUSE_ENABLED, \
+    ADCS_WINRM_TRANSPORT_IDLE_TIMEOUT, ADCS_WINRM_MAX_SHELLS_PER_USER
+
+logger = logging.getLogger(__name__)
+
+
+class TransportCache(object):
+    """
+    Keeps the authenticated transports of closed sessions, i.e. the HTTP connection with the completed TLS and
+    NTLM/CredSSP handshake, so that the next session for the same endpoint and credential can skip the handshake.
+    A transport is checked out by one session at a time, the message encryption is not safe for concurrent use.
+    """
+
+    def __init__(self, enabled=True, max_idle_per_key=10, idle_timeout=60):
+        self.enabled = enabled
+        self.max_idle_per_key = max_idle_per_key
+        self.idle_timeout = idle_timeout
+
+        self.handshakes_performed = 0
+        self.handshakes_avoided = 0
+        self.reauthentications = 0
+
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def checkout(self, key):
+        """returns an idle authenticated transport for the key or None when a new one must be created"""
+        if not self.enabled:
+            return None
+        transport = None
+        expired = []
+        with self._lock:
+            idle = self._idle.get(key, [])
+            now = time.monotonic()
+            while idle:
+                candidate, close, checked_in_at = idle.pop()
+                if now - checked_in_at > self.idle_timeout:
+                    expired.append((candidate, close))
+                else:
+                    transport = candidate
+                    break
+            if not idle:
+                self._idle.pop(key, None)
+        self._close(expired)
+        return transport
+
+    def checkin(self, key, transport, close):
+        """returns the transport for reuse, close(transport) is called when the transport is dropped"""
+        if not self.enabled:
+            self._close([(transport, close)])
+            return
+        dropped = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            idle.append((transport, close, time.monotonic()))
+            while len(idle) > self.max_idle_per_key:
+                candidate, candidate_close, _ = idle.pop(0)
+                dropped.append((candidate, candidate_close))
+        self._close(dropped)
+
+    def record_handshake(self, avoided):
+        with self._lock:
+            if avoided:
+                self.handshakes_avoided += 1
+            else:
+                self.handshakes_performed += 1
+
+    def record_reauthentication(self):
+        with self._lock:
+            self.reauthentications += 1
+
+    def clear(self):
+        with self._lock:
+            transports = [(transport, close) for idle in self._idle.values() for transport, close, _ in idle]
+            self._idle = {}
+        self._close(transports)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "idle": sum(len(idle) for idle in self._idle.values()),
+                "handshakesPerformed": self.handshakes_performed,
+                "handshakesAvoided": self.handshakes_avoided,
+                "reauthentications": self.reauthentications,
+            }
+
+    @staticmethod
+    def _close(transports):
+        for transport, close in transports:
+            try:
+                close(transport)
+            except Exception as e:
+                logger.debug("Failed to close WinRM transport: %s" % e)
+
+
+transport_cache = TransportCache(ADCS_WINRM_TRANSPORT_REUSE_ENABLED,
+                                 ADCS_WINRM_MAX_SHELLS_PER_USER,
+                                 ADCS_WINRM_TRANSPORT_IDLE_TIMEOUT)
@@ -0,0 +1,485 @@
+import base64
+import datetime
+import functools
+import gzip
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import spnego
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+
+from PyADCSConnector.remoting.async_winrm import seal_message, unseal_message, SOAP_CONTENT_TYPE
+from PyADCSConnector.remoting.winrm import scripts
+from PyADCSConnector.remoting.winrm.script_template import get_script_template, READ_PARAMETERS
+
+logger = logging.getLogger(__name__)
+
+NAMESPACES = {
+    "s": "http://www.w3.org/2003/05/soap-envelope",
+    "a": "http://schemas.xmlsoap.org/ws/2004/08/addressing",
+    "w": "http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd",
+    "rsp": "http://schemas.microsoft.com/wbem/wsman/1/windows/shell",
+}
+ENVELOPE = ('<s:Envelope xmlns:s="%(s)s" xmlns:a="%(a)s" xmlns:w="%(w)s" xmlns:rsp="%(rsp)s">'
+            '<s:Header><a:Action>%%s</a:Action><a:RelatesTo>%%s</a:RelatesTo></s:Header>'
+            '<s:Body>%%s</s:Body></s:Envelope>' % NAMESPACES)
+COMMAND_STATE = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/"
+# ERROR_WSMAN_INVALID_SELECTORS, returned for a shell or command that does not exist
+INVALID_SELECTORS_FAULT_CODE = 2150858843
+# properties of the records written by the JSON variants of the scripts
+CA_FIELDS = ("Name", "DisplayName", "ComputerName", "ConfigString", "Type", "IsEnterprise", "IsRoot", "IsAccessible",
+             "ServiceStatus")
+TEMPLATE_FIELDS = ("Name", "DisplayName", "SchemaVersion", "Version", "OID")
+IDENTIFIED_FIELDS = ("SerialNumber", "CertificateTemplate", "ConfigString")
+FIRST_ISSUED = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def format_list(records):
+    """formats the records, lists of name and value pairs, the same way as the Format-List cmdlet of PowerShell"""
+    lines = ["", ""]
+    for record in records:
+        width = max(len(name) for name, _ in record)
+        for name, value in record:
+            value_lines = str(value).split("\n") if value is not None else [""]
+            lines.append("%s : %s" % (name.ljust(width), value_lines[0]))
+            lines.extend(" " * (width + 3) + line for line in value_lines[1:])
+        lines.append("")
+    lines.append("")
+    return "\r\n".join(lines).encode("utf-8")
+
+
+def format_json(records, names=None):
+    """formats the values of the records as lines of compressed JSON, the same way as ConvertTo-Json -Compress"""
+    lines = [json.dumps({name: value for name, value in record if names is None or name in names},
+                        separators=(",", ":"))
+             for record in records]
+    return "".join(line + "\r\n" for line in lines).encode("utf-8")
+
+
+def format_gzip(data):
+    """compresses the output the same way as the compressed dump script, base64 with lines of 76 characters"""
+    encoded = base64.b64encode(gzip.compress(data)).decode("ascii")
+    return "\r\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76)).encode("ascii") + b"\r\n"
+
+
+def wrap_base64(der):
+    encoded = base64.b64encode(der).decode("ascii")
+    return "\n".join(encoded[i:i + 64] for i in range(0, len(encoded), 64))
+
+
+class FakeAdcs(object):
+    """
+    Synthetic certification authorities with templates and issued certificates, answers the scripts of the
+    connector with output in the format of the PSPKI cmdlets. The certificates are generated on demand, so that
+    a large dataset costs no memory until it is read.
+    """
+
+    def __init__(self, ca_count=1, template_count=3, certificate_count=1000, computer_name="fake-adcs.local"):
+        self.computer_name = computer_name
+        self.certificate_count = certificate_count
+        self.cas = ["Fake CA %d" % (i + 1) for i in range(ca_count)]
+        self.templates = [("FakeTemplate%d" % (i + 1), "1.3.6.1.4.1.311.21.8.1000.%d" % (i + 1))
+                          for i in range(template_count)]
+        self.revoked = set()
+
+        self._key = ec.generate_private_key(ec.SECP256R1())
+        self._issuer = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Fake Issuing CA")])
+        self._next_serial = ca_count * 10 ** 9
+        self._lock = threading.Lock()
+
+    def run_script(self, script, stdin=b""):
+        """returns the exit code, standard output and standard error of the PowerShell script"""
+        template = get_script_template(script)
+        if template is None:
+            if script.startswith("echo "):
+                return 0, script[len("echo "):].encode() + b"\r\n", b""
+            return 1, b"", ("The term '%s' is not recognized as the name of a cmdlet" % script.split()[0]).encode()
+
+        params = json.loads(stdin) if template.parameterized else {}
+        handlers = {
+            scripts.VERIFY_CONNECTION: lambda p: b"",
+            scripts.GET_CA: lambda p: format_list(self._cas()),
+            scripts.GET_CAS: lambda p: format_list(self._cas()),
+            scripts.GET_CAS_JSON: lambda p: format_json(self._cas(), CA_FIELDS),
+            scripts.GET_TEMPLATES: lambda p: format_list(self._templates()),
+            scripts.GET_TEMPLATES_JSON: lambda p: format_json(self._templates(), TEMPLATE_FIELDS),
+            scripts.GET_TEMPLATE_OID: self._template_oid,
+            scripts.DUMP_CERTIFICATES: lambda p: format_list(self._dump(p)),
+            scripts.DUMP_CERTIFICATES_JSON: lambda p: format_json(self._dump(p)),
+            scripts.DUMP_CERTIFICATES_GZIP: lambda p: format_gzip(format_json(self._dump(p))),
+            scripts.IDENTIFY_CERTIFICATE: lambda p: format_list(self._identify(p)),
+            scripts.IDENTIFY_CERTIFICATE_JSON: lambda p: format_json(self._identify(p), IDENTIFIED_FIELDS),
+            scripts.SUBMIT_CERTIFICATE_REQUEST: self._submit,
+            scripts.REVOKE_CERTIFICATE: self._revoke,
+        }
+        try:
+            return 0, handlers[template](params), b""
+        except ValueError as e:
+            return 1, b"", str(e).encode()
+
+    def _cas(self):
+        return [[
+            ("Name", name),
+            ("DisplayName", name),
+            ("ComputerName", self.computer_name),
+            ("ConfigString", "%s\\%s" % (self.computer_name, name)),
+            ("Type", "Enterprise Subordinate CA"),
+            ("IsEnterprise", True),
+            ("IsRoot", False),
+            ("IsAccessible", True),
+            ("ServiceStatus", "Running"),
+        ] for name in self.cas]
+
+    def _templates(self):
+        return [[
+            ("Name", name),
+            ("DisplayName", name),
+            ("SchemaVersion", "2"),
+            ("Version", "100.2"),
+            ("OID", oid),
+        ] for name, oid in self.templates]
+
+    def _rows(self, template, issued_after, after_request_id):
+        # the request id of the certificate is its index increased by one
+        for index in range(after_request_id, self.certificate_count):
+            name, oid = self.templates[index % len(self.templates)]
+            if template is not None and template not in (name, oid):
+                continue
+            if issued_after is not None and self._issued(index) < issued_after:
+                continue
+            yield index, oid
+
+    def _template_oid(self, params):
+        return "".join(oid + "\r\n" for name, oid in self.templates if name == params["Template"]).encode()
+
+    def _ca_index(self, name):
+        if name not in self.cas:
+            raise ValueError("The certification authority '%s' is not available" % name)
+        return self.cas.index(name)
+
+    def _dump(self, params):
+        ca_index = self._ca_index(params["CaName"])
+        page_size = params["PageSize"]
+        issued_after = params["IssuedAfter"]
+        if issued_after is not None:
+            issued_after = datetime.datetime.fromisoformat(issued_after)
+            if issued_after.tzinfo is None:
+                issued_after = issued_after.replace(tzinfo=datetime.timezone.utc)
+
+        rows = []
+        for index, oid in self._rows(params["Template"], issued_after, params["After"]):
+            if len(rows) >= page_size:
+                break
+            issued = self._issued(index)
+            rows.append([
+                ("RequestID", index + 1),
+                ("Request.StatusCode", 0),
+                ("Request.DispositionMessage", "Issued"),
+                ("Request.RequesterName", "FAKE\\requester"),
+                ("Request.SubmittedWhen", issued.strftime("%m/%d/%Y %I:%M:%S %p")),
+                ("Request.CommonName", "fake-%d" % (index + 1)),
+                ("CertificateTemplate", oid),
+                ("RawCertificate", wrap_base64(self._certificate(ca_index, index))),
+                ("RowId", index + 1),
+            ])
+        # the rows are reduced to the selected columns as by Select-Object
+        properties = params.get("Properties")
+        if properties:
+            rows = [[(name, value) for name, value in row if name in properties] for row in rows]
+        return rows
+
+    def _identify(self, params):
+        ca_index = self._ca_index(params["CaName"])
+        serial_number = int(params["SerialNumber"], 16)
+        index = serial_number - ca_index * 10 ** 9 - 1
+        if not 0 <= index < self.certificate_count:
+            return []
+        return [[
+            ("SerialNumber", "%x" % serial_number),
+            ("CertificateTemplate", self.templates[index % len(self.templates)][1]),
+            ("ConfigString", "%s\\%s" % (self.computer_name, self.cas[ca_index])),
+        ]]
+
+    def _submit(self, params):
+        request = base64.b64decode(params["Request"])
+        try:
+            subject = x509.load_der_x509_csr(request).subject
+        except ValueError:
+            # CMS wrapped CRMF request, the subject is not needed for the synthetic certificate
+            subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "fake-submitted")])
+        with self._lock:
+            self._next_serial += 1
+            serial_number = self._next_serial
+        der = self._sign(subject, serial_number, datetime.datetime.now(datetime.timezone.utc))
+        return (wrap_base64(der).replace("\n", "\r\n") + "\r\n").encode()
+
+    def _revoke(self, params):
+        with self._lock:
+            self.revoked.add(params["SerialNumber"])
+        return b""
+
+    @staticmethod
+    def _issued(index):
+        return FIRST_ISSUED + datetime.timedelta(minutes=index)
+
+    @functools.lru_cache(maxsize=10000)
+    def _certificate(self, ca_index, index):
+        subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "fake-%d" % (index + 1))])
+        return self._sign(subject, ca_index * 10 ** 9 + index + 1, self._issued(index))
+
+    def _sign(self, subject, serial_number, not_before):
+        certificate = (x509.CertificateBuilder()
+                       .subject_name(subject)
+                       .issuer_name(self._issuer)
+                       .public_key(self._key.public_key())
+                       .serial_number(serial_number)
+                       .not_valid_before(not_before)
+                       .not_valid_after(not_before + datetime.timedelta(days=365))
+                       .sign(self._key, hashes.SHA256()))
+        return certificate.public_bytes(Encoding.DER)
+
+
+class FakeWsmanServer(ThreadingHTTPServer):
+    """
+    WS-Management endpoint running the shell, command and receive flow of the WinRM service against FakeAdcs.
+    Accepts Basic, NTLM and CredSSP authentication of the given user and seals the messages the same way as the
+    WinRM service over HTTP. Only the cmd shell is implemented, the PSRP engine can not use the server. The
+    parameters of the template scripts are read from the standard input of the command.
+
+    The latency is the start of the powershell process with the module import, it runs from the start of the
+    command, also while the command waits for its input. The row latency is added to every line of the output,
+    the output is returned as it is produced by the receives. The failure rate is the probability that a command
+    is rejected with 503.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, adcs, username="user", password="password", latency=0.0, row_latency=0.0,
+                 failure_rate=0.0, chunk_size=65536):
+        super().__init__(address, FakeWsmanHandler)
+        self.adcs = adcs
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.row_latency = row_latency
+        self.failure_rate = failure_rate
+        self.chunk_size = chunk_size
+
+        self.stats = Counter()
+        self.shells = {}
+        self.lock = threading.Lock()
+
+        # the NTLM server context reads the accepted credentials from a file
+        user_file = tempfile.NamedTemporaryFile("w", prefix="fake-wsman-", suffix=".txt", delete=False)
+        with user_file:
+            user_file.write(":%s:%s\n" % (username, password))
+        self.user_file = user_file.name
+        os.environ["NTLM_USER_FILE"] = self.user_file
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.user_file):
+            os.unlink(self.user_file)
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def handle_message(self, message):
+        """returns the HTTP status and the response to the SOAP message"""
+        root = ET.fromstring(message)
+        action = root.find("s:Header/a:Action", NAMESPACES).text
+        message_id = root.find("s:Header/a:MessageID", NAMESPACES).text
+        shell_id = root.find("s:Header/w:SelectorSet/w:Selector[@Name='ShellId']", NAMESPACES)
+        shell_id = shell_id.text if shell_id is not None else None
+        name = action.rsplit("/", 1)[1]
+        self.count("action:" + name)
+
+        with self.lock:
+            shell = self.shells.get(shell_id)
+        if name != "Create" and shell is None:
+            return 500, self._fault(action, message_id, "The shell %s does not exist" % shell_id)
+
+        if name == "Create":
+            shell_id = str(uuid.uuid4()).upper()
+            with self.lock:
+                self.shells[shell_id] = {}
+            body = ('<x:ResourceCreated xmlns:x="http://schemas.xmlsoap.org/ws/2004/09/transfer">'
+                    '<w:SelectorSet><w:Selector Name="ShellId">%s</w:Selector></w:SelectorSet>'
+                    '</x:ResourceCreated><rsp:Shell><rsp:ShellId>%s</rsp:ShellId></rsp:Shell>'
+                    % (shell_id, shell_id))
+        elif name == "Command":
+            if random.random() < self.failure_rate:
+                self.count("failures")
+                return 503, None
+            command_id = str(uuid.uuid4()).upper()
+            shell[command_id] = self._run(root.find("s:Body/rsp:CommandLine", NAMESPACES))
+            body = '<rsp:CommandResponse><rsp:CommandId>%s</rsp:CommandId></rsp:CommandResponse>' % command_id
+        elif name == "Receive":
+            command_id = root.find("s:Body/rsp:Receive/rsp:DesiredStream", NAMESPACES).get("CommandId")
+            command = shell.get(command_id)
+            if command is None:
+                return 500, self._fault(action, message_id, "The command %s does not exist" % command_id)
+            body = self._receive(command_id, command)
+        elif name == "Send":
+            stream = root.find("s:Body/rsp:Send/rsp:Stream", NAMESPACES)
+            command = shell.get(stream.get("CommandId"))
+            if command is None:
+                return 500, self._fault(action, message_id, "The command %s does not exist" % stream.get("CommandId"))
+            command["stdin"] += base64.b64decode(stream.text or "")
+            if stream.get("End") == "true":
+                self._execute(command)
+            body = "<rsp:SendResponse/>"
+        elif name == "Signal":
+            shell.pop(root.find("s:Body/rsp:Signal", NAMESPACES).get("CommandId"), None)
+            body = "<rsp:SignalResponse/>"
+        elif name == "Delete":
+            with self.lock:
+                self.shells.pop(shell_id, None)
+            body = ""
+        else:
+            return 500, self._fault(action, message_id, "The action %s is not supported" % action)
+        return 200, ENVELOPE % (action + "Response", message_id, body)
+
+    def _run(self, command_line):
+        command = command_line.find("rsp:Command", NAMESPACES).text or ""
+        arguments = command_line.find("rsp:Arguments", NAMESPACES)
+        if arguments is not None and arguments.text:
+            command += " " + arguments.text
+        encoded = re.match(r"powershell -encodedcommand (\S+)", command)
+        script = base64.b64decode(encoded.group(1)).decode("utf_16_le") if encoded else command
+
+        self.count("commands")
+        command = {"script": script, "stdin": b"", "std_out": None, "offset": 0, "started": time.monotonic()}
+        # a script reading its parameters runs when the input is closed
+        if READ_PARAMETERS not in script:
+            self._execute(command)
+        return command
+
+    def _execute(self, command):
+        time.sleep(max(0.0, command["started"] + self.latency - time.monotonic()))
+        command["exit_code"], command["std_out"], command["std_err"] = self.adcs.run_script(command["script"],
+                                                                                          command["stdin"])
+
+    def _receive(self, command_id, command):
+        std_out = command["std_out"]
+        if std_out is None:
+            return ('<rsp:ReceiveResponse><rsp:CommandState CommandId="%s" State="%sRunning"/></rsp:ReceiveResponse>'
+                    % (command_id, COMMAND_STATE))
+        chunk = std_out[command["offset"]:command["offset"] + self.chunk_size]
+        command["offset"] += len(chunk)
+        time.sleep(self.row_latency * chunk.count(b"\n"))
+
+        streams = '<rsp:Stream Name="stdout" CommandId="%s">%s</rsp:Stream>' % (
+            command_id, base64.b64encode(chunk).decode())
+        if command["offset"] < len(std_out):
+            state = '<rsp:CommandState CommandId="%s" State="%sRunning"/>' % (command_id, COMMAND_STATE)
+        else:
+            if command["std_err"]:
+                streams += '<rsp:Stream Name="stderr" CommandId="%s">%s</rsp:Stream>' % (
+                    command_id, base64.b64encode(command["std_err"]).decode())
+            state = ('<rsp:CommandState CommandId="%s" State="%sDone"><rsp:ExitCode>%d</rsp:ExitCode>'
+                     '</rsp:CommandState>' % (command_id, COMMAND_STATE, command["exit_code"]))
+        return "<rsp:ReceiveResponse>%s%s</rsp:ReceiveResponse>" % (streams, state)
+
+    @staticmethod
+    def _fault(action, message_id, reason):
+        body = ('<s:Fault><s:Code><s:Value>s:Sender</s:Value><s:Subcode><s:Value>w:InvalidSelectors</s:Value>'
+                '</s:Subcode></s:Code><s:Reason><s:Text xml:lang="en-US">%s</s:Text></s:Reason><s:Detail>'
+                '<f:WSManFault xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" Code="%d" '
+                'Machine="fake-adcs"><f:Message>%s</f:Message></f:WSManFault></s:Detail></s:Fault>'
+                % (reason, INVALID_SELECTORS_FAULT_CODE, reason))
+        return ENVELOPE % ("http://schemas.xmlsoap.org/ws/2004/08/addressing/fault", message_id, body)
+
+
+class FakeWsmanHandler(BaseHTTPRequestHandler):
+    # the authentication and the sealing context belong to the connection, keep-alive is required
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately, they must not wait for the acknowledgement of the client
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.context = None
+        self.transport = None
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        scheme, _, token = self.headers.get("Authorization", "").partition(" ")
+        scheme = scheme.lower()
+
+        if scheme == "basic":
+            credentials = ("%s:%s" % (self.server.username, self.server.password)).encode()
+            if token != base64.b64encode(credentials).decode():
+                return self._unauthorized()
+            self.context = None
+            self.transport = "basic"
+        elif scheme in ("negotiate", "credssp"):
+            return self._authenticate(scheme, token)
+        elif self.transport is None:
+            return self._unauthorized()
+
+        if self.context is not None:
+            body = unseal_message(self.context, self.transport, self.headers.get("Content-Type", ""), body)
+        status, response = self.server.handle_message(body)
+        if response is None:
+            return self._reply(status, b"")
+        response = response.encode("utf-8")
+        if self.context is not None:
+            response, content_type = seal_message(self.context, self.transport, response)
+        else:
+            content_type = SOAP_CONTENT_TYPE
+        self._reply(status, response, {"Content-Type": content_type})
+
+    def _authenticate(self, scheme, token):
+        if self.context is None or self.context.complete:
+            self.context = spnego.server(protocol="ntlm" if scheme == "negotiate" else "credssp")
+            self.transport = None
+        try:
+            out_token = self.context.step(base64.b64decode(token))
+        except Exception as e:
+            logger.debug("Authentication failed: %s" % e)
+            self.context = None
+            return self._unauthorized()
+
+        header_scheme = "Negotiate" if scheme == "negotiate" else "CredSSP"
+        headers = {"WWW-Authenticate": "%s %s" % (header_scheme, base64.b64encode(out_token).decode())} \
+            if out_token else {}
+        if not self.context.complete:
+            return self._reply(401, b"", headers)
+        self.transport = "ntlm" if scheme == "negotiate" else "credssp"
+        self.server.count("handshakes")
+        self._reply(200, b"", headers)
+
+    def _unauthorized(self):
+        self.send_response(401)
+        for challenge in ("Negotiate", "CredSSP", 'Basic realm="WSMAN"'):
+            self.send_header("WWW-Authenticate", challenge)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import json
+from base64 import b64encode
+
+# reads the parameters of the script sent to the standard input, JSON keeps the payload ASCII whatever the
+# code page of the shell is
+READ_PARAMETERS = "$params = [Console]::In.ReadToEnd() | ConvertFrom-Json"
+
+SCRIPT_TEMPLATES = {}
+
+
+def encoded_ps_command(script):
+    # must use utf16 little endian on windows
+    encoded_ps = b64encode(script.encode('utf_16_le')).decode('ascii')
+    return 'powershell -encodedcommand {0}'.format(encoded_ps)
+
+
+class ScriptTemplate(object):
+    """
+    Script whose text does not change between calls, the values are read from the $params object. The text is
+    encoded for the command line once, the parameters are sent to the standard input of the powershell process,
+    so a large value like a certificate request does not count against the command line length limit.
+    """
+
+    def __init__(self, name, prelude, body):
+        self.name = name
+        self.prelude = prelude
+        self.body = body
+        self.parameterized = "$params" in body
+        SCRIPT_TEMPLATES[name] = self
+
+    @property
+    def text(self):
+        return self.prelude + "\n" + self.body
+
+    @property
+    def command_text(self):
+        """text run by the powershell process, the parameters are read after the console encoding is set"""
+        if not self.parameterized:
+            return self.text
+        return "\n".join([self.prelude, READ_PARAMETERS, self.body])
+
+    @functools.cached_property
+    def encoded_command(self):
+        return encoded_ps_command(self.command_text)
+
+    def bind(self, **parameters):
+        return Script(self, parameters)
+
+    def defer(self):
+        return PendingScript(self)
+
+
+class Script(str):
+    """
+    Script of the template with the parameter values of one call. It is the text of the template, so it can be
+    used wherever the script text is, the engines pass the parameters apart from the text.
+    """
+
+    def __new__(cls, template, parameters):
+        script = super().__new__(cls, template.text)
+        script.template = template
+        script.parameters = parameters
+        return script
+
+    @property
+    def stdin(self):
+        if not self.template.parameterized:
+            return None
+        return json.dumps(self.parameters).encode("ascii")
+
+
+class PendingScript(Script):
+    """
+    Script of the template whose parameters are given after it is started. The powershell process loads the
+    modules of the prelude in the meantime and runs the script once the parameters reach its standard input.
+    Must be created on the event loop of the session streaming it.
+    """
+
+    def __new__(cls, template):
+        script = super().__new__(cls, template, None)
+        script._stdin = asyncio.get_running_loop().create_future()
+        return script
+
+    def resolve(self, **parameters):
+        self.parameters = parameters
+        self._stdin.set_result(json.dumps(parameters).encode("ascii"))
+
+    def abandon(self):
+        """the script is not needed, the process is terminated before it reads any input"""
+        if not self._stdin.done():
+            self._stdin.set_result(None)
+
+    @property
+    def stdin(self):
+        """future of the input, None when the script was abandoned"""
+        return self._stdin
+
+
+def get_script_template(command_text):
+    """returns the template whose command text is the given one, None when the text is not of a template"""
+    for template in SCRIPT_TEMPLATES.values():
+        if template.command_text == command_text:
+            return template
+    return None
@@ -1,3 +1,5 @@
+from CZERTAINLY_PyADCS_Connector.settings import ADCS_SCRIPT_OUTPUT_FORMAT, ADCS_DUMP_COMPRESSION_ENABLED
+from PyADCSConnector.remoting.winrm.script_template import ScriptTemplate
 from PyADCSConnector.utils.dump_parser import AuthorityData, TemplateData
 from PyADCSConnector.utils.revocation_reason import CertificateRevocationReason
 
@@ -9,62 +11,252 @@ IMPORTS = """$OutputEncoding = [console]::InputEncoding = [console]::OutputEncod
 $Host.UI.RawUI.BufferSize = New-Object Management.Automation.Host.Size (2048, $Host.UI.RawUI.BufferSize.Height)"""
 
 
+def psrp_runspace_initialization_script(ca_cache_ttl: int):
+    """
+    Returns a script that prepares a PSRP runspace once, so that the scripts executed in it later do not need
+    the IMPORT_MODULE prelude. Certification authorities are cached in the runspace, the function shadows
+    the PSPKI cmdlet of the same name.
+    """
+    return f"""Import-Module PSPKI
+$global:CzertainlyCertificationAuthorities = @{{}}
+function global:Get-CertificationAuthority {{
+    # only the calls with -ComputerName and -Name are cached, other parameters are passed to the PSPKI cmdlet
+    $parameters = @{{}}
+    for ($i = 0; $i -lt $args.Count; $i++) {{
+        if ($i + 1 -lt $args.Count -and $args[$i] -is [string] -and $args[$i] -match '^-(ComputerName|Name):?$') {{
+            $parameters[$Matches[1]] = $args[++$i]
+        }} else {{
+            return PSPKI\\Get-CertificationAuthority @args
+        }}
+    }}
+    $key = "$($parameters.ComputerName)|$($parameters.Name)"
+    $entry = $global:CzertainlyCertificationAuthorities[$key]
+    if ($null -eq $entry -or $entry.Expires -lt [DateTime]::UtcNow) {{
+        $entry = @{{
+            Value = @(PSPKI\\Get-CertificationAuthority @parameters)
+            Expires = [DateTime]::UtcNow.AddSeconds({ca_cache_ttl})
+        }}
+        $global:CzertainlyCertificationAuthorities[$key] = $entry
+    }}
+    $entry.Value
+}}"""
+
+
+def strip_prelude(script: str):
+    """
+    Removes the module import and console setup from the beginning of the script, they are not needed
+    in a prepared runspace.
+    """
+    for prelude in (IMPORT_MODULE, IMPORTS):
+        if script.startswith(prelude):
+            return script[len(prelude):].lstrip("\n")
+    return script
+
+
+VERIFY_CONNECTION = ScriptTemplate("verify_connection", IMPORT_MODULE, "")
+
+GET_CA = ScriptTemplate("get_ca", IMPORT_MODULE,
+                        "Get-CertificationAuthority -ComputerName $params.ComputerName | Format-List *")
+
+GET_CAS = ScriptTemplate("get_cas", IMPORT_MODULE, '\n'.join([
+    "$TemplateList = @()",
+    "(Get-CertificationAuthority) | Foreach-Object {",
+    "$template = $_",
+    "$OutputObject = \"\" | Select Name, DisplayName, ComputerName, ConfigString, Type, IsEnterprise, IsRoot, "
+    "IsAccessible, ServiceStatus",
+    "$outputObject.Name = $template.Name",
+    "$OutputObject.DisplayName = $template.DisplayName",
+    "$OutputObject.ComputerName = $template.ComputerName",
+    "$OutputObject.ConfigString = $template.ConfigString",
+    "$OutputObject.Type = $template.Type",
+    "$OutputObject.IsEnterprise = $template.IsEnterprise",
+    "$OutputObject.IsRoot = $template.IsRoot",
+    "$OutputObject.IsAccessible = $template.IsAccessible",
+    "$OutputObject.ServiceStatus = $template.ServiceStatus",
+    "$TemplateList += $OutputObject",
+    "}",
+    "$TemplateList | Format-List"
+]))
+
+GET_TEMPLATES = ScriptTemplate("get_templates", IMPORT_MODULE, '\n'.join([
+    "$TemplateList = @()",
+    "(Get-CertificateTemplate) | Foreach-Object {",
+    "$template = $_",
+    "$OutputObject = \"\" | Select Name, DisplayName, SchemaVersion, Version, OID",
+    "$outputObject.Name = $template.Name",
+    "$OutputObject.DisplayName = $template.DisplayName",
+    "$OutputObject.SchemaVersion = $template.SchemaVersion",
+    "$OutputObject.Version = $template.Version",
+    "$OutputObject.OID = $template.Oid.Value",
+    "$TemplateList += $OutputObject",
+    "}",
+    "$TemplateList | Format-List"
+]))
+
+DUMP_FILTER = '\n'.join([
+    # the restriction of the indexed RequestID column comes first, the view is sorted by it and the page
+    # continues after the last row of the previous one without skipping the rows before it
+    '$filter = @("RequestID -gt $($params.After)", "Request.Disposition -ge 12", "Request.Disposition -le 21")',
+    'if ($params.Template) { $filter += "CertificateTemplate -eq $($params.Template)" }',
+    'if ($params.IssuedAfter) {',
+    '$issued_after = Get-Date -Date $params.IssuedAfter',
+    '$filter += "NotBefore -ge $issued_after"',
+    '}',
+])
+
+# columns of the database rows read by the dump, the default view of Get-AdcsDatabaseRow adds the request
+# columns to every row, they are dropped by the explicit selection
+DUMP_PROPERTIES = ("RequestID", "CertificateTemplate", "RawCertificate")
+
+DUMP_ROWS = ('Get-CertificationAuthority -Name $params.CaName | Get-AdcsDatabaseRow -Property $params.Properties'
+             ' -Page 1 -PageSize $params.PageSize -Filter $filter'
+             ' | Select-Object -Property $params.Properties')
+
+DUMP_CERTIFICATES = ScriptTemplate("dump_certificates", IMPORT_MODULE, '\n'.join([
+    DUMP_FILTER,
+    DUMP_ROWS + ' | Format-List',
+]))
+
+SUBMIT_CERTIFICATE_REQUEST = ScriptTemplate("submit_certificate_request", IMPORTS, """$config = $params.ConfigString
+$template = "CertificateTemplate:$($params.Template)"
+$encoding = 0x1
+$pollMilliseconds = $params.PollingInterval
+$timeoutMilliseconds = $params.Timeout
+
+$csr = $params.Request
+
+$req = New-Object -ComObject CertificateAuthority.Request
+
+$disposition = $req.Submit(0xff, $csr, $template, $config)
+$requestId   = $req.GetRequestId()
+
+if ($disposition -eq 0 -or $disposition -eq 3) {
+    $certB64 = $req.GetCertificate($encoding)
+} else {
+    do {
+        Start-Sleep -Milliseconds $pollMilliseconds
+        $elapsed += $pollMilliseconds
+        $disposition = $req.RetrievePending($requestId, $config)
+    } until ($disposition -eq 3 -or $elapsed -ge $timeout)   # 3 = issued
+
+    if ($disposition -eq 3) {
+        $certB64 = $req.GetCertificate($encoding)
+    } else {
+        throw "Timeout waiting for certificate (request $requestId)."
+    }
+}
+
+$certB64
+""")
+
+GET_TEMPLATE_OID = ScriptTemplate("get_template_oid", IMPORT_MODULE,
+                                  "(Get-CertificateTemplate -Name $params.Template).Oid.Value")
+
+IDENTIFY_CERTIFICATE = ScriptTemplate(
+    "identify_certificate", IMPORT_MODULE,
+    'Get-CertificationAuthority -Name $params.CaName | Get-AdcsDatabaseRow'
+    ' -Filter "SerialNumber -eq $($params.SerialNumber)", "Request.Disposition -ge 12", "Request.Disposition -le 21"'
+    ' -Property "SerialNumber", "CertificateTemplate", "ConfigString"'
+    # getting only issued requests without revoked ones
+    # 'Get-CertificationAuthority -Name $params.CaName | Get-IssuedRequest'
+    # ' -Filter "SerialNumber -eq $($params.SerialNumber)"'
+)
+
+# Variants of the scripts writing every record as one line of compressed JSON instead of the padded Format-List
+# output, the values are converted to strings and booleans so that the output does not depend on the PSPKI types
+
+GET_CAS_JSON = ScriptTemplate("get_cas_json", IMPORT_MODULE, '\n'.join([
+    "(Get-CertificationAuthority) | Foreach-Object {",
+    "[pscustomobject]@{",
+    "Name = [string]$_.Name",
+    "DisplayName = [string]$_.DisplayName",
+    "ComputerName = [string]$_.ComputerName",
+    "ConfigString = [string]$_.ConfigString",
+    "Type = [string]$_.Type",
+    "IsEnterprise = [bool]$_.IsEnterprise",
+    "IsRoot = [bool]$_.IsRoot",
+    "IsAccessible = [bool]$_.IsAccessible",
+    "ServiceStatus = [string]$_.ServiceStatus",
+    "} | ConvertTo-Json -Compress",
+    "}"
+]))
+
+GET_TEMPLATES_JSON = ScriptTemplate("get_templates_json", IMPORT_MODULE, '\n'.join([
+    "(Get-CertificateTemplate) | Foreach-Object {",
+    "[pscustomobject]@{",
+    "Name = [string]$_.Name",
+    "DisplayName = [string]$_.DisplayName",
+    "SchemaVersion = [string]$_.SchemaVersion",
+    "Version = [string]$_.Version",
+    "OID = [string]$_.Oid.Value",
+    "} | ConvertTo-Json -Compress",
+    "}"
+]))
+
+DUMP_CERTIFICATES_JSON = ScriptTemplate("dump_certificates_json", IMPORT_MODULE, '\n'.join([
+    DUMP_FILTER,
+    DUMP_ROWS + ' | Foreach-Object { ConvertTo-Json -InputObject $_ -Compress }',
+]))
+
+IDENTIFY_CERTIFICATE_JSON = ScriptTemplate("identify_certificate_json", IMPORT_MODULE, '\n'.join([
+    'Get-CertificationAuthority -Name $params.CaName | Get-AdcsDatabaseRow'
+    ' -Filter "SerialNumber -eq $($params.SerialNumber)", "Request.Disposition -ge 12", "Request.Disposition -le 21"'
+    ' -Property "SerialNumber", "CertificateTemplate", "ConfigString" | Foreach-Object {',
+    '[pscustomobject]@{',
+    'SerialNumber = [string]$_.SerialNumber',
+    'CertificateTemplate = [string]$_.CertificateTemplate',
+    'ConfigString = [string]$_.ConfigString',
+    '} | ConvertTo-Json -Compress',
+    '}'
+]))
+
+# the JSON records of the page are compressed in memory and written as one base64 block, the block starts with
+# H4sI, the encoded gzip header. The RawCertificate stays base64 inside the records, gzip takes back most of its
+# expansion: 400 certificates with RSA 2048 keys compress to 0.972 of their DER size, and to 0.961 with the DER
+# written as length-prefixed bytes, which is not worth a binary record format
+DUMP_CERTIFICATES_GZIP = ScriptTemplate("dump_certificates_gzip", IMPORT_MODULE, '\n'.join([
+    DUMP_FILTER,
+    '$buffer = New-Object System.IO.MemoryStream',
+    '$gzip = New-Object System.IO.Compression.GZipStream($buffer, [System.IO.Compression.CompressionMode]::Compress)',
+    '$writer = New-Object System.IO.StreamWriter($gzip, (New-Object System.Text.UTF8Encoding($false)))',
+    DUMP_ROWS + ' | Foreach-Object {',
+    'if ($_.RawCertificate) { $_.RawCertificate = $_.RawCertificate -replace "\\s", "" }',
+    '$writer.WriteLine((ConvertTo-Json -InputObject $_ -Compress))',
+    '}',
+    '$writer.Close()',
+    '[Convert]::ToBase64String($buffer.ToArray(), [Base64FormattingOptions]::InsertLineBreaks)'
+]))
+
+REVOKE_CERTIFICATE = ScriptTemplate(
+    "revoke_certificate", IMPORT_MODULE,
+    "Get-CertificationAuthority -Name $params.CaName | Get-IssuedRequest -Filter"
+    " \"SerialNumber -eq $($params.SerialNumber)\" | Revoke-Certificate -Reason $params.Reason"
+)
+
+
+def output_template(list_template: ScriptTemplate, json_template: ScriptTemplate):
+    """returns the variant of the script for the configured output format"""
+    return json_template if ADCS_SCRIPT_OUTPUT_FORMAT == "json" else list_template
+
+
 def verify_connection_script():
     """
     Returns a script that verifies the connection to the remote server.
     """
-    return '\n'.join([
-        IMPORT_MODULE,
-        # "Get-CertificationAuthority | Ping-ICertInterface"
-    ])
+    # "Get-CertificationAuthority | Ping-ICertInterface"
+    return VERIFY_CONNECTION.bind()
 
 
 def get_ca_script(computer_name: str):
-    return '\n'.join([
-        IMPORT_MODULE,
-        "Get-CertificationAuthority -ComputerName " + computer_name + " | Format-List *",
-    ])
+    return GET_CA.bind(ComputerName=computer_name)
 
 
 def get_cas_script():
-    return '\n'.join([
-        IMPORT_MODULE,
-        "$TemplateList = @()",
-        "(Get-CertificationAuthority) | Foreach-Object {",
-        "$template = $_",
-        "$OutputObject = \"\" | Select Name, DisplayName, ComputerName, ConfigString, Type, IsEnterprise, IsRoot, "
-        "IsAccessible, ServiceStatus",
-        "$outputObject.Name = $template.Name",
-        "$OutputObject.DisplayName = $template.DisplayName",
-        "$OutputObject.ComputerName = $template.ComputerName",
-        "$OutputObject.ConfigString = $template.ConfigString",
-        "$OutputObject.Type = $template.Type",
-        "$OutputObject.IsEnterprise = $template.IsEnterprise",
-        "$OutputObject.IsRoot = $template.IsRoot",
-        "$OutputObject.IsAccessible = $template.IsAccessible",
-        "$OutputObject.ServiceStatus = $template.ServiceStatus",
-        "$TemplateList += $OutputObject",
-        "}",
-        "$TemplateList | Format-List"
-    ])
+    return output_template(GET_CAS, GET_CAS_JSON).bind()
 
 
 def get_templates_script():
-    return '\n'.join([
-        IMPORT_MODULE,
-        "$TemplateList = @()",
-        "(Get-CertificateTemplate) | Foreach-Object {",
-        "$template = $_",
-        "$OutputObject = \"\" | Select Name, DisplayName, SchemaVersion, Version, OID",
-        "$outputObject.Name = $template.Name",
-        "$OutputObject.DisplayName = $template.DisplayName",
-        "$OutputObject.SchemaVersion = $template.SchemaVersion",
-        "$OutputObject.Version = $template.Version",
-        "$OutputObject.OID = $template.Oid.Value",
-        "$TemplateList += $OutputObject",
-        "}",
-        "$TemplateList | Format-List"
-    ])
+    return output_template(GET_TEMPLATES, GET_TEMPLATES_JSON).bind()
 
 
 def select_objects(command, select_property):
@@ -75,88 +267,49 @@ def select_objects(command, select_property):
     return f"{command} | Select-Object -Property {properties}"
 
 
-def dump_certificates_script(ca: AuthorityData, template: TemplateData or None, issued_after, page, page_size):
-    commands = [IMPORT_MODULE]
-    if issued_after:
-        commands.append(f'$issued_after = Get-Date -Date "{issued_after}"')
-    base_cmd = (f'Get-CertificationAuthority -Name "{ca.name}" | Get-AdcsDatabaseRow -Property "RawCertificate"'
-                f' -Page {page} -PageSize {page_size} -Filter "Request.Disposition -ge 12",'
-                f' "Request.Disposition -le 21"')
+def dump_certificates_template():
+    """returns the variant of the dump script for the configured output format and compression"""
+    if ADCS_DUMP_COMPRESSION_ENABLED:
+        return DUMP_CERTIFICATES_GZIP
+    return output_template(DUMP_CERTIFICATES, DUMP_CERTIFICATES_JSON)
+
+
+def dump_certificates_parameters(ca: AuthorityData, template: TemplateData or None, issued_after, after_request_id,
+                                 page_size, properties=DUMP_PROPERTIES):
+    template_filter = None
     if template:
-        if template.schema_version == "1":
-            base_cmd = f'{base_cmd}, "CertificateTemplate -eq {template.name}"'
-        else:
-            base_cmd = f'{base_cmd}, "CertificateTemplate -eq {template.oid}"'
+        template_filter = template.name if template.schema_version == "1" else template.oid
+    return dict(CaName=ca.name, Template=template_filter, IssuedAfter=issued_after or None,
+                After=int(after_request_id or 0), PageSize=page_size, Properties=list(properties))
 
-    if issued_after:
-        commands.append(f'{base_cmd}, "NotBefore -ge $issued_after"')
-    else:
-        commands.append(base_cmd)
 
-    return '\n'.join(commands)
+def dump_certificates_script(ca: AuthorityData, template: TemplateData or None, issued_after, after_request_id,
+                             page_size, properties=DUMP_PROPERTIES):
+    """
+    Returns a script reading a page of the issued certificates with the RequestID greater than the given one, the
+    next page continues after the RequestID of the last certificate. Only the given columns of the rows are
+    written, they must include the RequestID, CertificateTemplate and RawCertificate parsed by the DumpParser.
+    """
+    return dump_certificates_template().bind(**dump_certificates_parameters(
+        ca, template, issued_after, after_request_id, page_size, properties))
 
 
 def submit_certificate_request_script(request, ca: AuthorityData, template: TemplateData,
                                       polling_interval=100, timeout=3000):
-    script = f"""{IMPORTS}
-$config = "{ca.config_string}"
-$template = "CertificateTemplate:{template.name}"
-$encoding = 0x1
-$pollMilliseconds = {polling_interval}
-$timeoutMilliseconds = {timeout}
-
-$csr = "{request}"
-
-$req = New-Object -ComObject CertificateAuthority.Request
-
-$disposition = $req.Submit(0xff, $csr, $template, $config)
-$requestId   = $req.GetRequestId()
-
-if ($disposition -eq 0 -or $disposition -eq 3) {{
-    $certB64 = $req.GetCertificate($encoding)
-}} else {{
-    do {{
-        Start-Sleep -Milliseconds $pollMilliseconds
-        $elapsed += $pollMilliseconds
-        $disposition = $req.RetrievePending($requestId, $config)
-    }} until ($disposition -eq 3 -or $elapsed -ge $timeout)   # 3 = issued
-
-    if ($disposition -eq 3) {{
-        $certB64 = $req.GetCertificate($encoding)
-    }} else {{
-        throw "Timeout waiting for certificate (request $requestId)."
-    }}
-}}
-
-$certB64
-"""
-    return script
+    return SUBMIT_CERTIFICATE_REQUEST.bind(Request=request, ConfigString=ca.config_string, Template=template.name,
+                                           PollingInterval=int(polling_interval), Timeout=int(timeout))
 
 
 def get_template_oid_script(template):
-    return '\n'.join([
-        IMPORT_MODULE,
-        f"(Get-CertificateTemplate -Name \"{template}\").Oid.Value"
-    ])
+    return GET_TEMPLATE_OID.bind(Template=template)
 
 
 def identify_certificate_script(serial_number, ca: AuthorityData):
-    return '\n'.join([
-        IMPORT_MODULE,
-        f'Get-CertificationAuthority -Name "{ca.name}" | Get-AdcsDatabaseRow'
-        f' -Filter "SerialNumber -eq {serial_number}", "Request.Disposition -ge 12", "Request.Disposition -le 21"'
-        f' -Property "SerialNumber", "CertificateTemplate", "ConfigString"'
-        # getting only issued requests without revoked ones
-        # f'Get-CertificationAuthority -Name "{ca.name}" | Get-IssuedRequest'
-        # f' -Filter "SerialNumber -eq {serial_number}"'
-    ])
+    script_template = output_template(IDENTIFY_CERTIFICATE, IDENTIFY_CERTIFICATE_JSON)
+    return script_template.bind(SerialNumber=serial_number, CaName=ca.name)
 
 
 def get_revoke_script(ca: AuthorityData, certificate_serial_number: str, reason: str) -> str:
     adcs_reason = CertificateRevocationReason.from_string(reason).to_string_ps_value()
 
-    return '\n'.join([
-        IMPORT_MODULE,
-        f"Get-CertificationAuthority -Name \"{ca.name}\" | Get-IssuedRequest -Filter"
-        f" \"SerialNumber -eq {certificate_serial_number}\" | Revoke-Certificate -Reason \"{adcs_reason}\""
-    ])
+    return REVOKE_CERTIFICATE.bind(CaName=ca.name, SerialNumber=certificate_serial_number, Reason=adcs_reason)
@@ -1,14 +1,33 @@
 import logging
-from base64 import b64encode
+import threading
 
+import requests
 import winrm
+from winrm.exceptions import InvalidCredentialsError, WinRMOperationTimeoutError
 
+from CZERTAINLY_PyADCS_Connector.settings import ADCS_WINRM_POOL_ENABLED, ADCS_WINRM_POOL_MIN_SIZE, \
+    ADCS_WINRM_POOL_MAX_SIZE, ADCS_WINRM_POOL_IDLE_TIMEOUT, ADCS_WINRM_POOL_ACQUIRE_TIMEOUT, \
+    ADCS_WINRM_POOL_LIVENESS_CHECK_AFTER, ADCS_WINRM_MAX_SHELLS_PER_USER, ADCS_REMOTING_ENGINE
+from PyADCSConnector.exceptions.remoting_exception import RemotingException
 from PyADCSConnector.exceptions.winrm_execution_exception import WinRMExecutionException
 from PyADCSConnector.models.authority_instance import AuthorityInstance
+from PyADCSConnector.remoting.admission import admit
+from PyADCSConnector.remoting.circuit_breaker import GuardedSession, get_circuit_breaker
+from PyADCSConnector.remoting.psrp_remoting import PsrpRemoting
+from PyADCSConnector.remoting.retry import retrying
+from PyADCSConnector.remoting.shell_pool import ShellPool, ShellQuota
+from PyADCSConnector.remoting.transport_cache import transport_cache
+from PyADCSConnector.remoting.winrm.script_template import Script, encoded_ps_command
+from PyADCSConnector.remoting.winrm.scripts import verify_connection_script
 from PyADCSConnector.utils import attribute_definition_utils
 
 logger = logging.getLogger(__name__)
 
+# failures of a reused transport after which the connection is authenticated again
+REAUTHENTICATE_ERRORS = (InvalidCredentialsError, requests.exceptions.ConnectionError)
+# bytes of the standard input sent in one message, well below the maximum envelope size of the service
+STDIN_CHUNK_SIZE = 65536
+
 
 class WinRmRemoting(object):
     def __init__(self, username, password, hostname, use_https=False, port=5985, transport='credssp'):
@@ -22,16 +41,35 @@ class WinRmRemoting(object):
         self.protocol = None
 
     def connect(self):
-        self.protocol = winrm.Protocol(
-            endpoint='http' + ('s' if self.use_https else '') + '://' + self.hostname + ':' + str(self.port) + '/wsman',
-            transport=self.transport,
-            username=self.username,
-            password=self.password)
+        self.protocol = transport_cache.checkout(self._transport_key())
+        if self.protocol is not None:
+            try:
+                self.shell_id = self.protocol.open_shell()
+                transport_cache.record_handshake(avoided=True)
+                return
+            except REAUTHENTICATE_ERRORS as e:
+                # the server closed the connection or the security context expired
+                logger.debug("Reused WinRM transport to %s failed, authenticating again: %s" % (self.hostname, e))
+                self.protocol.transport.close_session()
+                transport_cache.record_reauthentication()
+        else:
+            self.protocol = winrm.Protocol(
+                endpoint=self._endpoint(),
+                transport=self.transport,
+                username=self.username,
+                password=self.password)
         self.shell_id = self.protocol.open_shell()
+        transport_cache.record_handshake(avoided=False)
 
-    def run(self, command, args=()):
+    def _endpoint(self):
+        return 'http' + ('s' if self.use_https else '') + '://' + self.hostname + ':' + str(self.port) + '/wsman'
+
+    def _transport_key(self):
+        return "winrm", self._endpoint(), self.transport, self.username, self.password
+
+    def run(self, command, args=(), stdin=None):
         logger.debug("Running command: " + command + " " + str(args))
-        command_id = self.protocol.run_command(self.shell_id, command, args)
+        command_id = self._start(command, args, stdin)
         result = winrm.Response(self.protocol.get_command_output(self.shell_id, command_id))
         self.protocol.cleanup_command(self.shell_id, command_id)
 
@@ -48,15 +86,148 @@ class WinRmRemoting(object):
     def run_ps(self, script):
         """base64 encodes a Powershell script and executes the powershell encoded script command"""
         logger.debug("Running Powershell script: " + script)
-        # must use utf16 little endian on windows
-        encoded_ps = b64encode(script.encode('utf_16_le')).decode('ascii')
-        result = self.run('powershell -encodedcommand {0}'.format(encoded_ps))
+        command, stdin = powershell_command(script)
+        result = self.run(command, stdin=stdin)
         return result
 
+    def _start(self, command, args, stdin):
+        # the input is read as a pipe, not as typed on a console
+        command_id = self.protocol.run_command(self.shell_id, command, args, console_mode_stdin=stdin is None)
+        if stdin is not None:
+            for chunk, end in stdin_chunks(stdin):
+                self.protocol.send_command_input(self.shell_id, command_id, chunk, end)
+        return command_id
+
+    def stream(self, command, args=(), stdin=None):
+        """runs the command and yields the chunks of stdout as the Receive responses arrive"""
+        logger.debug("Streaming command: " + command + " " + str(args))
+        command_id = self._start(command, args, stdin)
+        std_err = []
+        return_code = -1
+        try:
+            done = False
+            while not done:
+                try:
+                    std_out, err, return_code, done = self.protocol.get_command_output_raw(self.shell_id, command_id)
+                except WinRMOperationTimeoutError:
+                    # expected while waiting for a long-running command, just receive again
+                    continue
+                std_err.append(err)
+                if std_out:
+                    yield std_out
+        finally:
+            self.protocol.cleanup_command(self.shell_id, command_id)
+        check_result(winrm.Response((b"", b"".join(std_err), return_code)))
+
+    def stream_ps(self, script):
+        logger.debug("Streaming Powershell script: " + script)
+        command, stdin = powershell_command(script)
+        yield from self.stream(command, stdin=stdin)
+
+    def is_alive(self):
+        """runs a trivial command to check that the shell was not closed by the server in the meantime"""
+        try:
+            command_id = self.protocol.run_command(self.shell_id, "echo", ["alive"])
+            self.protocol.get_command_output(self.shell_id, command_id)
+            self.protocol.cleanup_command(self.shell_id, command_id)
+            return True
+        except Exception as e:
+            logger.debug("WinRM shell %s is not alive: %s" % (self.shell_id, e))
+            return False
+
     def disconnect(self):
-        self.protocol.close_shell(self.shell_id)
-        self.protocol = None
-        self.shell_id = None
+        try:
+            # keep the authenticated session of the transport for the next shell
+            self.protocol.close_shell(self.shell_id, close_session=False)
+        except Exception:
+            self.protocol.transport.close_session()
+            raise
+        else:
+            transport_cache.checkin(self._transport_key(), self.protocol, close_protocol)
+        finally:
+            self.protocol = None
+            self.shell_id = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
+
+
+class PooledSession(object):
+    """
+    Session leased from the shell pool of the authority instance. The connect() and disconnect() methods lease
+    and return the shell instead of opening and closing it.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.shell = None
+        self.broken = False
+
+    def connect(self):
+        self.shell = self.pool.acquire(ADCS_WINRM_POOL_ACQUIRE_TIMEOUT)
+        self.broken = False
+
+    def run(self, command, args=()):
+        return self._call(self.shell.session.run, command, args)
+
+    def run_ps(self, script):
+        return self._call(self.shell.session.run_ps, script)
+
+    def stream_ps(self, script):
+        try:
+            yield from self.shell.session.stream_ps(script)
+        except WinRMExecutionException:
+            raise
+        except Exception:
+            self.broken = True
+            raise
+
+    def _call(self, method, *args):
+        try:
+            return method(*args)
+        except WinRMExecutionException:
+            # the command failed, the shell itself is still usable
+            raise
+        except Exception:
+            self.broken = True
+            raise
+
+    def disconnect(self):
+        if self.shell is None:
+            return
+        self.pool.release(self.shell, discard=self.broken)
+        self.shell = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
+
+
+def powershell_command(script):
+    """
+    returns the command line running the script and the standard input with its parameters, the command line
+    of a template script is encoded once and reused
+    """
+    if isinstance(script, Script):
+        return script.template.encoded_command, script.stdin
+    return encoded_ps_command(script), None
+
+
+def stdin_chunks(stdin):
+    """splits the input to the messages sent to the command, the last one closes the input"""
+    chunks = [stdin[i:i + STDIN_CHUNK_SIZE] for i in range(0, len(stdin), STDIN_CHUNK_SIZE)] or [b""]
+    return [(chunk, i == len(chunks) - 1) for i, chunk in enumerate(chunks)]
+
+
+def close_protocol(protocol):
+    protocol.transport.close_session()
 
 
 def check_result(result):
@@ -66,15 +237,51 @@ def check_result(result):
 
 def create_session_from_authority_instance_name(authority_instance_name):
     authority_instance = AuthorityInstance.objects.get(name=authority_instance_name)
-    return create_session_from_authority_instance(authority_instance)
+    return create_pooled_session_from_authority_instance(authority_instance)
 
 
 def create_session_from_authority_instance_uuid(authority_instance_uuid):
     authority_instance = AuthorityInstance.objects.get(uuid=authority_instance_uuid)
-    return create_session_from_authority_instance(authority_instance)
+    return create_pooled_session_from_authority_instance(authority_instance)
 
 
 def create_session_from_authority_instance(authority_instance):
+    username, password = get_credentials(authority_instance)
+    session = get_remoting_engine()(username, password, authority_instance.address, authority_instance.https,
+                                    authority_instance.port)
+    return session
+
+
+def get_remoting_engine():
+    if ADCS_REMOTING_ENGINE == "winrm":
+        return WinRmRemoting
+    elif ADCS_REMOTING_ENGINE == "psrp":
+        return PsrpRemoting
+    else:
+        raise RemotingException("Unsupported remoting engine: %s" % ADCS_REMOTING_ENGINE)
+
+
+def create_pooled_session_from_authority_instance(authority_instance):
+    if not ADCS_WINRM_POOL_ENABLED:
+        session = create_session_from_authority_instance(authority_instance)
+    else:
+        session = PooledSession(get_shell_pool(authority_instance))
+    # the breaker fails fast before the caller waits for admission, every retry goes through both of them again
+    session = GuardedSession(admit(session, authority_instance.uuid), get_authority_circuit_breaker(authority_instance))
+    return retrying(session, authority_instance.uuid)
+
+
+def get_authority_circuit_breaker(authority_instance):
+    return get_circuit_breaker(authority_instance.uuid, lambda: probe_authority_instance(authority_instance))
+
+
+def probe_authority_instance(authority_instance):
+    """half-open probe of the circuit breaker, uses a new session so that it does not wait for the pool"""
+    with create_session_from_authority_instance(authority_instance) as session:
+        session.run_ps(verify_connection_script())
+
+
+def get_credentials(authority_instance):
     username = attribute_definition_utils.get_attribute_value("username",
                                                               authority_instance.credential.get("attributes"))
     password = attribute_definition_utils.get_attribute_value("password",
@@ -85,6 +292,55 @@ def create_session_from_authority_instance(authority_instance):
     if isinstance(password, dict):
         password = password.get("secret")
 
-    session = WinRmRemoting(username, password, authority_instance.address, authority_instance.https,
-                            authority_instance.port)
-    return session
+    return username, password
+
+
+shell_quota = ShellQuota(ADCS_WINRM_MAX_SHELLS_PER_USER)
+_shell_pools = {}
+_shell_pools_lock = threading.Lock()
+
+
+def get_shell_pool(authority_instance):
+    """Returns the shell pool of the authority instance, the pool is recreated when the connection changes"""
+    username, password = get_credentials(authority_instance)
+    fingerprint = (authority_instance.address, authority_instance.port, authority_instance.https,
+                   authority_instance.transport, username, password)
+    key = str(authority_instance.uuid)
+
+    stale_pool = None
+    with _shell_pools_lock:
+        pool = _shell_pools.get(key)
+        if pool is not None and pool.fingerprint != fingerprint:
+            stale_pool = pool
+            pool = None
+        if pool is None:
+            pool = ShellPool(key,
+                             lambda: create_session_from_authority_instance(authority_instance),
+                             shell_quota,
+                             (authority_instance.address.lower(), username),
+                             fingerprint=fingerprint,
+                             min_size=ADCS_WINRM_POOL_MIN_SIZE,
+                             max_size=min(ADCS_WINRM_POOL_MAX_SIZE, ADCS_WINRM_MAX_SHELLS_PER_USER),
+                             idle_timeout=ADCS_WINRM_POOL_IDLE_TIMEOUT,
+                             liveness_check_after=ADCS_WINRM_POOL_LIVENESS_CHECK_AFTER)
+            _shell_pools[key] = pool
+            if pool.min_size:
+                threading.Thread(target=pool.prewarm, name="shell-pool-prewarm-%s" % key, daemon=True).start()
+
+    if stale_pool is not None:
+        logger.info("Connection of authority instance %s changed, closing its WinRM shells" % key)
+        stale_pool.close()
+    return pool
+
+
+def close_shell_pool(authority_instance_uuid):
+    with _shell_pools_lock:
+        pool = _shell_pools.pop(str(authority_instance_uuid), None)
+    if pool is not None:
+        pool.close()
+
+
+def get_shell_pool_stats():
+    with _shell_pools_lock:
+        pools = list(_shell_pools.values())
+    return {pool.key: pool.stats() for pool in pools}
@@ -13,6 +13,7 @@ def get_authority_attributes_list(kind):
     attribute_list.append(get_use_https_attribute())
     attribute_list.append(get_winrm_port_attribute())
     attribute_list.append(get_winrm_transport_attribute())
+    attribute_list.append(get_discovery_parallelism_attribute())
 
     return attribute_list
 
@@ -30,7 +31,8 @@ def get_all_authority_attributes_list(kind, winrm_transport):
 
     attribute_list = [get_adcs_info_attribute(), get_credential_type_attribute(), get_credential_attribute(),
                       get_server_attribute(), get_use_https_attribute(), get_winrm_port_attribute(),
-                      get_winrm_transport_attribute(), get_winrm_transport_config_attribute(kind)]
+                      get_winrm_transport_attribute(), get_winrm_transport_config_attribute(kind),
+                      get_discovery_parallelism_attribute()]
     return attribute_list
 
 ########################################################################################################################
@@ -246,6 +248,25 @@ def get_winrm_port_attribute():
                            None)
 
 
+def get_discovery_parallelism_attribute():
+    properties = get_data_attribute_properties(
+        AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_LABEL,
+        is_required=False,
+        is_read_only=False,
+        is_visible=True,
+        is_list=False,
+        is_multi_select=False)
+    return build_attribute(AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_NAME,
+                           AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_UUID,
+                           "data",
+                           "integer",
+                           AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_DESCRIPTION,
+                           properties,
+                           None,
+                           None,
+                           None)
+
+
 def get_winrm_transport_configuration_attributes_list(kind, winrm_transport):
     validate_authority_kind(kind)
 
@@ -317,3 +338,10 @@ AUTHORITY_CREDENTIAL_ATTRIBUTE_NAME = "authority_credential"
 AUTHORITY_CREDENTIAL_ATTRIBUTE_UUID = "93d77f65-d9c4-497c-bdee-f3330eb0f209"
 AUTHORITY_CREDENTIAL_ATTRIBUTE_LABEL = "Credential"
 AUTHORITY_CREDENTIAL_ATTRIBUTE_DESCRIPTION = "Credential to authenticate with ADCS"
+
+# Discovery Parallelism Attribute
+AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_NAME = "authority_discovery_parallelism"
+AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_UUID = "3f0b7c52-8e4d-4a3b-9d61-2c7e5a1f9b04"
+AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_LABEL = "Discovery Parallelism"
+AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_DESCRIPTION = ("Maximum number of CA and template combinations the discovery "
+                                                         "reads from the ADCS at once")
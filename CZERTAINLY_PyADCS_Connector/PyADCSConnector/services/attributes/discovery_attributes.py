@@ -14,6 +14,9 @@ def get_discovery_attributes_list(kind):
     attribute_list.append(get_ca_select_group_attribute())
     attribute_list.append(get_template_name_attribute())
     attribute_list.append(get_issued_after_attribute())
+    attribute_list.append(get_parallelism_attribute())
+    attribute_list.append(get_incremental_attribute())
+    attribute_list.append(get_full_scan_interval_attribute())
 
     return attribute_list
 
@@ -212,6 +215,69 @@ def get_issued_after_attribute():
                            None)
 
 
+def get_parallelism_attribute():
+    properties = get_data_attribute_properties(
+        DISCOVERY_PARALLELISM_ATTRIBUTE_LABEL,
+        is_required=False,
+        is_read_only=False,
+        is_visible=True,
+        is_list=False,
+        is_multi_select=False)
+
+    return build_attribute(DISCOVERY_PARALLELISM_ATTRIBUTE_NAME,
+                           DISCOVERY_PARALLELISM_ATTRIBUTE_UUID,
+                           "data",
+                           "integer",
+                           DISCOVERY_PARALLELISM_ATTRIBUTE_DESCRIPTION,
+                           properties,
+                           None,
+                           None,
+                           None)
+
+
+def get_incremental_attribute():
+    properties = get_data_attribute_properties(
+        DISCOVERY_INCREMENTAL_ATTRIBUTE_LABEL,
+        is_required=False,
+        is_read_only=False,
+        is_visible=True,
+        is_list=False,
+        is_multi_select=False)
+    content = [
+        {"reference": "False", "data": False},
+    ]
+
+    return build_attribute(DISCOVERY_INCREMENTAL_ATTRIBUTE_NAME,
+                           DISCOVERY_INCREMENTAL_ATTRIBUTE_UUID,
+                           "data",
+                           "boolean",
+                           DISCOVERY_INCREMENTAL_ATTRIBUTE_DESCRIPTION,
+                           properties,
+                           content,
+                           None,
+                           None)
+
+
+def get_full_scan_interval_attribute():
+    properties = get_data_attribute_properties(
+        DISCOVERY_FULL_SCAN_INTERVAL_ATTRIBUTE_LABEL,
+        is_required=False,
+        is_read_only=False,
+        is_visible=True,
+        is_list=False,
+        is_multi_select=False)
+
+    return build_attribute(DISCOVERY_FULL_SCAN_INTERVAL_ATTRIBUTE_NAME,
+                           DISCOVERY_FULL_SCAN_INTERVAL_ATTRIBUTE_UUID,
+                           "data",
+                           "integer",
+                           DISCOVERY_FULL_SCAN_INTERVAL_ATTRIBUTE_DESCRIPTION,
+                           properties,
+                           None,
+                           None,
+                           None)
+
+
 def get_issued_days_before_attribute():
     properties = get_data_attribute_properties(
         DISCOVERY_ISSUED_DAYS_BEFORE_ATTRIBUTE_LABEL,
@@ -314,3 +380,25 @@ DISCOVERY_CONFIGSTRING_ATTRIBUTE_NAME = "discovery_config_string"
 DISCOVERY_CONFIGSTRING_ATTRIBUTE_UUID = "ab4f8573-bf55-4863-b2ce-44597b111cf9"
 DISCOVERY_CONFIGSTRING_ATTRIBUTE_LABEL = "CA ConfigString"
 DISCOVERY_CONFIGSTRING_ATTRIBUTE_DESCRIPTION = "ConfigString of the CA"
+
+# Parallelism Attribute
+DISCOVERY_PARALLELISM_ATTRIBUTE_NAME = "discovery_parallelism"
+DISCOVERY_PARALLELISM_ATTRIBUTE_UUID = "9c4e2a7d-5b13-4f86-a0d2-7e3b6c8f1a59"
+DISCOVERY_PARALLELISM_ATTRIBUTE_LABEL = "Parallelism"
+DISCOVERY_PARALLELISM_ATTRIBUTE_DESCRIPTION = ("Number of CA and template combinations read at once, limited by the "
+                                               "parallelism of the authority instance")
+
+# Incremental Attribute
+DISCOVERY_INCREMENTAL_ATTRIBUTE_NAME = "discovery_incremental"
+DISCOVERY_INCREMENTAL_ATTRIBUTE_UUID = "2b7d9e41-c6a3-4f05-8e1d-6a9c3f2b7e18"
+DISCOVERY_INCREMENTAL_ATTRIBUTE_LABEL = "Incremental"
+DISCOVERY_INCREMENTAL_ATTRIBUTE_DESCRIPTION = ("Discover only the certificates requested after the last certificate "
+                                               "found by the previous incremental discovery of the CA and template")
+
+# Full Scan Interval Attribute
+DISCOVERY_FULL_SCAN_INTERVAL_ATTRIBUTE_NAME = "discovery_full_scan_interval"
+DISCOVERY_FULL_SCAN_INTERVAL_ATTRIBUTE_UUID = "e4a1c8f3-09b7-4d6e-a25c-7f3e8b1d4c92"
+DISCOVERY_FULL_SCAN_INTERVAL_ATTRIBUTE_LABEL = "Full Scan Interval"
+DISCOVERY_FULL_SCAN_INTERVAL_ATTRIBUTE_DESCRIPTION = ("Days after which the incremental discovery reads all "
+                                                      "certificates of the CA and template again, to find the "
+                                                      "pending requests issued since then")
@@ -61,6 +61,30 @@ def get_failed_reason_metadata_attribute(failed_reason):
                            None,
                            None)
 
+
+def get_discovery_progress_metadata_attribute(progress):
+    properties = get_metadata_attribute_properties(
+        METADATA_DISCOVERY_PROGRESS_ATTRIBUTE_LABEL,
+        is_visible=True)
+    text = "%d of %d CAs, %d certificates in %d pages, %s certificates/s" % (
+        progress["casDone"], progress["casTotal"], progress["certificatesPersisted"], progress["pagesDone"],
+        progress["certificatesPerSecond"])
+    if progress["etaSeconds"] is not None:
+        text += ", %d s remaining" % progress["etaSeconds"]
+    content = [
+        {"reference": text, "data": text}
+    ]
+
+    return build_attribute(METADATA_DISCOVERY_PROGRESS_ATTRIBUTE_NAME,
+                           METADATA_DISCOVERY_PROGRESS_ATTRIBUTE_UUID,
+                           "meta",
+                           "string",
+                           METADATA_DISCOVERY_PROGRESS_ATTRIBUTE_DESCRIPTION,
+                           properties,
+                           content,
+                           None,
+                           None)
+
 ########################################################################################################################
 # Constants
 ########################################################################################################################
@@ -83,3 +107,9 @@ METADATA_FAILED_REASON_ATTRIBUTE_NAME = "metadata_failed_reason"
 METADATA_FAILED_REASON_ATTRIBUTE_UUID = "d568c856-6b18-46a7-863f-30032d433d97"
 METADATA_FAILED_REASON_ATTRIBUTE_LABEL = "Failed Reason"
 METADATA_FAILED_REASON_ATTRIBUTE_DESCRIPTION = "Failed reason"
+
+# Discovery Progress Metadata Attribute
+METADATA_DISCOVERY_PROGRESS_ATTRIBUTE_NAME = "metadata_discovery_progress"
+METADATA_DISCOVERY_PROGRESS_ATTRIBUTE_UUID = "5e0f3b9a-71c4-4d28-b6e3-94a2c8d1f607"
+METADATA_DISCOVERY_PROGRESS_ATTRIBUTE_LABEL = "Discovery Progress"
+METADATA_DISCOVERY_PROGRESS_ATTRIBUTE_DESCRIPTION = "Progress of the running discovery"
@@ -1,6 +1,9 @@
 from PyADCSConnector.exceptions.authority_exception import AuthorityException
 from PyADCSConnector.exceptions.remoting_exception import RemotingException
 from PyADCSConnector.models.authority_instance import AuthorityInstance
+from PyADCSConnector.remoting.async_winrm import run_ps_async
+from PyADCSConnector.remoting.circuit_breaker import reset_circuit_breaker
+from PyADCSConnector.remoting.remoting_loop import run_on_remoting_loop
 from PyADCSConnector.remoting.winrm.scripts import verify_connection_script, get_cas_script, get_templates_script
 from PyADCSConnector.remoting.winrm_remoting import create_session_from_authority_instance, \
     create_session_from_authority_instance_uuid
@@ -41,6 +44,8 @@ def update_authority_instance(request_dto, authority_instance):
                                                                                    authority_instance.attributes)
 
     verify_connection(authority_instance)
+    # the connection may have changed, the failures of the previous one do not apply
+    reset_circuit_breaker(authority_instance.uuid)
 
     authority_instance.save()
 
@@ -49,20 +54,28 @@ def update_authority_instance(request_dto, authority_instance):
 
 def verify_connection(authority_instance):
     if authority_instance.transport == "credssp":
-        session = create_session_from_authority_instance(authority_instance)
-        session.connect()
-        session.run_ps(verify_connection_script())
-        session.disconnect()
+        with create_session_from_authority_instance(authority_instance) as session:
+            session.run_ps(verify_connection_script())
     else:
         raise RemotingException("Unsupported transport type: %s" % authority_instance.transport)
 
 
 def get_cas(authority_instance_uuid):
-    session = create_session_from_authority_instance_uuid(authority_instance_uuid)
-    session.connect()
-    result = session.run_ps(get_cas_script())
-    session.disconnect()
+    with create_session_from_authority_instance_uuid(authority_instance_uuid) as session:
+        result = session.run_ps(get_cas_script(), idempotent=True)
 
+    return get_cas_content(result)
+
+
+async def get_cas_async(authority_instance_uuid):
+    """same as get_cas, but the script runs on the remoting loop without blocking a thread"""
+    authority_instance = await AuthorityInstance.objects.aget(uuid=authority_instance_uuid)
+    result = await run_on_remoting_loop(run_ps_async(authority_instance, get_cas_script(), idempotent=True))
+
+    return get_cas_content(result)
+
+
+def get_cas_content(result):
     # Convert string to lines
     # regular_string = result.std_out.decode('utf-8')
     cas = DumpParser.parse_authority_data(result)
@@ -75,11 +88,21 @@ def get_cas(authority_instance_uuid):
 
 
 def get_templates(authority_instance_uuid):
-    session = create_session_from_authority_instance_uuid(authority_instance_uuid)
-    session.connect()
-    result = session.run_ps(get_templates_script())
-    session.disconnect()
+    with create_session_from_authority_instance_uuid(authority_instance_uuid) as session:
+        result = session.run_ps(get_templates_script(), idempotent=True)
+
+    return get_templates_content(result)
+
+
+async def get_templates_async(authority_instance_uuid):
+    """same as get_templates, but the script runs on the remoting loop without blocking a thread"""
+    authority_instance = await AuthorityInstance.objects.aget(uuid=authority_instance_uuid)
+    result = await run_on_remoting_loop(run_ps_async(authority_instance, get_templates_script(), idempotent=True))
+
+    return get_templates_content(result)
+
 
+def get_templates_content(result):
     # Convert string to lines
     # regular_string = result.std_out.decode('utf-8')
     templates = DumpParser.parse_template_data(result)
@@ -0,0 +1,100 @@
+import base64
+import logging
+
+from django.db import connections, router
+
+from PyADCSConnector.models.certificate_content import CertificateContent
+from PyADCSConnector.models.discovery_certificate import DiscoveryCertificate
+from PyADCSConnector.utils.bulk_insert import bulk_insert
+from PyADCSConnector.utils.fingerprint_filter import FingerprintFilter, certificate_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# key of the advisory lock, the discoveries storing the contents hold it shared and the removal of the unreferenced
+# contents exclusively, so a content is not removed between its lookup and the commit of the certificates using it
+CONTENTS_LOCK_KEY = 0x50794144
+
+
+def store_contents(contents, batch_size):
+    """
+    Stores the DER of the certificates of the dict by fingerprint that are not stored yet, in the transaction of
+    the caller. Only the fingerprints of the stored certificates are sent to the database.
+    """
+    if not contents:
+        return
+    lock_contents(exclusive=False)
+    stored = set(CertificateContent.objects.filter(fingerprint__in=list(contents)).values_list(
+        "fingerprint", flat=True))
+    if len(stored) == len(contents):
+        return
+    # a concurrent discovery may store the same certificate, the conflicting rows are skipped
+    bulk_insert(CertificateContent, (CertificateContent(fingerprint=fingerprint, der=der)
+                                     for fingerprint, der in contents.items() if fingerprint not in stored),
+                batch_size, ignore_conflicts=True)
+
+
+def delete_discovery_certificates(discovery_history):
+    """
+    Deletes the certificates of the discovery and the contents no other discovery references, in the transaction
+    of the caller. Returns the number of deleted contents.
+    """
+    lock_contents(exclusive=True)
+    connection = connections[router.db_for_write(CertificateContent)]
+    with connection.cursor() as cursor:
+        # the statement sees the certificates of the discovery it deletes, they are excluded from the references
+        cursor.execute(
+            "WITH deleted AS (DELETE FROM %(certificates)s WHERE discovery_id = %%s RETURNING fingerprint) "
+            "DELETE FROM %(contents)s c WHERE c.fingerprint IN (SELECT fingerprint FROM deleted) AND NOT EXISTS "
+            "(SELECT 1 FROM %(certificates)s d WHERE d.fingerprint = c.fingerprint AND d.discovery_id <> %%s)"
+            % {"certificates": DiscoveryCertificate._meta.db_table, "contents": CertificateContent._meta.db_table},
+            [discovery_history.id, discovery_history.id])
+        deleted = cursor.rowcount
+    logger.debug("Deleted %d certificate contents of discovery %d" % (deleted, discovery_history.id))
+    return deleted
+
+
+def lock_contents(exclusive):
+    connection = connections[router.db_for_write(CertificateContent)]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        # the lock is released when the transaction ends
+        function = "pg_advisory_xact_lock" if exclusive else "pg_advisory_xact_lock_shared"
+        cursor.execute("SELECT %s(%%s)" % function, [CONTENTS_LOCK_KEY])
+
+
+class DiscoveryFingerprints(object):
+    """
+    Fingerprints of the certificates stored in a discovery. The filter answers most of the new certificates without
+    a query, only its positive answers are looked up in the database.
+    """
+
+    def __init__(self, discovery_history, capacity):
+        self.discovery_id = discovery_history.id
+        self.filter = FingerprintFilter(capacity)
+
+    def load(self):
+        """adds the certificates committed before the discovery was interrupted"""
+        for fingerprint in DiscoveryCertificate.objects.filter(discovery_id=self.discovery_id).values_list(
+                "content_id", flat=True).iterator():
+            self.filter.add(fingerprint)
+
+    def new_certificates(self, certificates):
+        """
+        Returns the certificates not stored in the discovery yet as (certificate, der) tuples by fingerprint, and
+        adds them to the filter. Every certificate is decoded once.
+        """
+        page = {}
+        for certificate in certificates:
+            der = base64.b64decode(certificate.certificate)
+            page.setdefault(certificate_fingerprint(der), (certificate, der))
+        candidates = [fingerprint for fingerprint in page if fingerprint in self.filter]
+        if candidates:
+            for fingerprint in DiscoveryCertificate.objects.filter(
+                    discovery_id=self.discovery_id, content_id__in=candidates).values_list("content_id", flat=True):
+                del page[fingerprint]
+        for fingerprint in page:
+            self.filter.add(fingerprint)
+        logger.debug("%d of %d certificates are new in discovery %d" % (len(page), len(certificates),
+                                                                         self.discovery_id))
+        return page
@@ -39,10 +39,8 @@ def revoke(request_dto, uuid):
     reason = request_dto["reason"]
     serial_number = get_certificate_serial_number(request_dto["certificate"])
 
-    session = create_session_from_authority_instance_uuid(uuid)
-    session.connect()
-    session.run_ps(get_revoke_script(ca, serial_number, reason))
-    session.disconnect()
+    with create_session_from_authority_instance_uuid(uuid) as session:
+        session.run_ps(get_revoke_script(ca, serial_number, reason))
 
     return
 
@@ -59,11 +57,9 @@ def identify(request_dto, uuid):
     x509_cert = x509.load_der_x509_certificate(base64.b64decode(certificate), default_backend())
     serial_number = '{0:x}'.format(x509_cert.serial_number)
 
-    session = create_session_from_authority_instance_uuid(uuid)
-    session.connect()
     logger.debug("Identify certificate with serial number %s" % serial_number)
-    result = session.run_ps(identify_certificate_script(serial_number, ca))
-    session.disconnect()
+    with create_session_from_authority_instance_uuid(uuid) as session:
+        result = session.run_ps(identify_certificate_script(serial_number, ca), idempotent=True)
 
     parsed = DumpParser.parse_identified_certificates(result)
     if not parsed:
@@ -99,14 +95,12 @@ def issue_new_certificate(uuid, certificate_request, request_format: Certificate
                           template: TemplateData):
     if request_format == CertificateRequestFormat.CRMF:
         certificate_request = create_cms(certificate_request, ca.name, template).decode()
-    session = create_session_from_authority_instance_uuid(uuid)
-    session.connect()
-    result = session.run_ps(
-        submit_certificate_request_script(
-            certificate_request, ca, template, ADCS_ISSUE_POLLING_INTERVAL, ADCS_ISSUE_POLLING_TIMEOUT
+    with create_session_from_authority_instance_uuid(uuid) as session:
+        result = session.run_ps(
+            submit_certificate_request_script(
+                certificate_request, ca, template, ADCS_ISSUE_POLLING_INTERVAL, ADCS_ISSUE_POLLING_TIMEOUT
+            )
         )
-    )
-    session.disconnect()
 
     # Remove new lines and empty lines to form one Base64 string
     certificate = get_certificate_data(result)
@@ -0,0 +1,69 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from PyADCSConnector.models.discovery_checkpoint import DiscoveryCheckpoint
+from PyADCSConnector.models.discovery_history import DiscoveryHistory
+from PyADCSConnector.utils.discovery_status import DiscoveryStatus
+from PyADCSConnector.utils.dump_parser import AuthorityData, TemplateData
+
+
+@transaction.atomic
+def create_checkpoints(discovery_history, units):
+    """
+    Stores the CA and template combinations of the discovery before the scans start, units are (ca, template,
+    request_id, full_scan) tuples with the RequestID the scan continues after. Returns (ca, template, checkpoint)
+    tuples like get_checkpoints.
+    """
+    checkpoints = DiscoveryCheckpoint.objects.bulk_create([
+        DiscoveryCheckpoint(discovery_id=discovery_history.id, position=position, ca=ca.to_dict(),
+                            template=template.to_dict() if template else None, request_id=request_id,
+                            full_scan=full_scan)
+        for position, (ca, template, request_id, full_scan) in enumerate(units)])
+    return [(ca, template, checkpoint) for (ca, template, _, _), checkpoint in zip(units, checkpoints)]
+
+
+def get_checkpoints(discovery_history):
+    """returns the checkpoints of the discovery with the combinations rebuilt from them, in the discovery order"""
+    checkpoints = []
+    for checkpoint in DiscoveryCheckpoint.objects.filter(discovery_id=discovery_history.id).order_by("position"):
+        ca = AuthorityData.from_dict(checkpoint.ca)
+        template = TemplateData.from_dict(checkpoint.template) if checkpoint.template else None
+        checkpoints.append((ca, template, checkpoint))
+    return checkpoints
+
+
+def save_checkpoint(checkpoint_id, page=None, certificates=0):
+    """
+    Moves the checkpoint after the committed page with the number of its certificates stored, or marks the
+    combination as completed without a page. Called in the transaction of the page, so the checkpoint never runs
+    ahead of the persisted certificates.
+    """
+    if page is None:
+        DiscoveryCheckpoint.objects.filter(id=checkpoint_id).update(completed=True, updated_at=timezone.now())
+        return
+    DiscoveryCheckpoint.objects.filter(id=checkpoint_id).update(
+        request_id=max(certificate.request_id for certificate in page),
+        certificates=F("certificates") + certificates, updated_at=timezone.now())
+
+
+def refresh_heartbeat(discovery_history):
+    DiscoveryHistory.objects.filter(id=discovery_history.id).update(heartbeat_at=timezone.now())
+
+
+def claim_orphaned_discoveries(orphan_timeout):
+    """
+    Returns the discoveries in progress whose heartbeat is older than the orphan timeout in seconds, their process
+    was stopped. Every worker looks for them, the heartbeat is refreshed by a conditional update, so only one of
+    them claims the discovery.
+    """
+    stale = Q(heartbeat_at__lt=timezone.now() - datetime.timedelta(seconds=orphan_timeout)) | \
+        Q(heartbeat_at__isnull=True)
+    in_progress = DiscoveryHistory.objects.filter(stale, status=DiscoveryStatus.IN_PROGRESS.value)
+    claimed = []
+    for discovery_id in in_progress.values_list("id", flat=True):
+        if in_progress.filter(id=discovery_id).update(heartbeat_at=timezone.now()):
+            claimed.append(DiscoveryHistory.objects.get(id=discovery_id))
+    return claimed
@@ -1,27 +1,60 @@
+import asyncio
+import base64
+import collections
 import logging
 import threading
 
-from django.db import transaction
+from asgiref.sync import sync_to_async
+from django.db import transaction, connection
+from django.utils import timezone
 
-from CZERTAINLY_PyADCS_Connector.settings import ADCS_SEARCH_PAGE_SIZE
+from CZERTAINLY_PyADCS_Connector.settings import ADCS_SEARCH_PAGE_SIZE, ADCS_DISCOVERY_PREFETCH_DEPTH, \
+    ADCS_DISCOVERY_PARALLELISM, ADCS_ADMISSION_MAX_CONCURRENT, ADCS_DISCOVERY_INSERT_BATCH_SIZE, \
+    ADCS_DISCOVERY_QUEUE_SIZE, ADCS_DISCOVERY_FULL_SCAN_INTERVAL, ADCS_DISCOVERY_HEARTBEAT_INTERVAL, \
+    ADCS_DISCOVERY_ORPHAN_TIMEOUT, ADCS_DISCOVERY_DEDUPLICATION_CAPACITY
 from PyADCSConnector.exceptions.already_exist_exception import AlreadyExistException
+from PyADCSConnector.exceptions.validation_exception import ValidationException
 from PyADCSConnector.models.discovery_certificate import DiscoveryCertificate
 from PyADCSConnector.models.discovery_history import DiscoveryHistory
 from PyADCSConnector.objects.authority_instance_attribute import AuthorityInstanceAttribute
 from PyADCSConnector.objects.discovery_certificate_dto import DiscoveryCertificateDto
 from PyADCSConnector.objects.discovery_history_request_dto import DiscoveryHistoryRequestDto
 from PyADCSConnector.objects.discovery_history_response_dto import DiscoveryHistoryResponseDto
-from PyADCSConnector.remoting.winrm.scripts import get_cas_script, dump_certificates_script
-from PyADCSConnector.remoting.winrm_remoting import create_session_from_authority_instance
+from PyADCSConnector.remoting.winrm.scripts import get_cas_script, dump_certificates_template, \
+    dump_certificates_parameters
+from PyADCSConnector.remoting.async_winrm import create_async_session_from_authority_instance
+from PyADCSConnector.remoting.prefetch import ScriptPrefetcher
+from PyADCSConnector.remoting.remoting_loop import submit
+from PyADCSConnector.services.attributes.authority_attributes import AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_NAME
 from PyADCSConnector.services.attributes.discovery_attributes import *
+from PyADCSConnector.services.certificate_content import DiscoveryFingerprints, store_contents
+from PyADCSConnector.services.discovery_checkpoint import create_checkpoints, get_checkpoints, save_checkpoint, \
+    refresh_heartbeat, claim_orphaned_discoveries
+from PyADCSConnector.services.discovery_watermark import get_watermarks, needs_full_scan, save_watermarks, \
+    watermark_key
 from PyADCSConnector.services.attributes.metadata_attributes import get_ca_name_metadata_attribute, \
-    get_template_name_metadata_attribute, get_failed_reason_metadata_attribute
+    get_template_name_metadata_attribute, get_failed_reason_metadata_attribute, \
+    get_discovery_progress_metadata_attribute
 from PyADCSConnector.utils import attribute_definition_utils
+from PyADCSConnector.utils.bulk_insert import bulk_insert
+from PyADCSConnector.utils.discovery_progress import DiscoveryProgress
 from PyADCSConnector.utils.discovery_status import DiscoveryStatus
-from PyADCSConnector.utils.dump_parser import AuthorityData, TemplateData, DumpParser
+from PyADCSConnector.utils.dump_parser import AuthorityData, TemplateData, DumpParser, CertificateDumpParser
 
 logger = logging.getLogger(__name__)
 
+# the id of the last certificate of the recently read result pages, the platform reads the pages one after another
+# and the next page continues after the previous one instead of skipping the rows before it
+PAGE_BOUNDARIES_CACHE_SIZE = 1024
+_page_boundaries = collections.OrderedDict()
+_page_boundaries_lock = threading.Lock()
+
+# admitted sessions of the authority a discovery leaves free for the interactive operations, like the issuance
+RESERVED_INTERACTIVE_SESSIONS = 1
+
+_recovery = None
+_recovery_lock = threading.Lock()
+
 
 @transaction.atomic
 def create_discovery_history(request_dto):
@@ -33,36 +66,176 @@ def create_discovery_history(request_dto):
     discovery_history: DiscoveryHistory = DiscoveryHistory()
     discovery_history.name = request_dto["name"]
     discovery_history.status = DiscoveryStatus.IN_PROGRESS.value
+    discovery_history.request = request_dto
+    discovery_history.heartbeat_at = timezone.now()
 
     discovery_history.save()
 
     return discovery_history
 
 
+def submit_discovery(form, discovery_history_uuid):
+    """schedules the discovery on the remoting loop, all running discoveries share the loop thread"""
+    return submit(run_discovery(form, discovery_history_uuid))
+
+
 # Run certificate discovery asynchronously
-def run_discovery(form, discovery_history_uuid):
-    logger.debug("Starting discovery for %s in a new thread %s" % (form["name"], threading.get_ident()))
-    discovery_history = DiscoveryHistory.objects.get(uuid=discovery_history_uuid)
+async def run_discovery(form, discovery_history_uuid):
+    logger.debug("Starting discovery for %s on the remoting loop" % form["name"])
+    discovery_history = await in_worker_thread(DiscoveryHistory.objects.get)(uuid=discovery_history_uuid)
+    heartbeat = asyncio.ensure_future(keep_alive(discovery_history))
     try:
-        discover_certificates(form, discovery_history)
+        await discover_certificates(form, discovery_history)
     except Exception as e:
+        logger.error("Discovery %s failed: %s" % (form["name"], e), exc_info=True)
         discovery_history.status = DiscoveryStatus.FAILED.value
         discovery_history.meta = [get_failed_reason_metadata_attribute(str(e))]
-        discovery_history.save()
+        # the total and the progress are stored by the writer, they are kept as they were committed
+        await in_worker_thread(discovery_history.save)(update_fields=["status", "meta"])
         raise e
-
-
-@transaction.atomic
-def discover_certificates(request_dto, discovery_history):
+    finally:
+        heartbeat.cancel()
+
+
+async def keep_alive(discovery_history):
+    """refreshes the heartbeat of the running discovery, also while its scans wait for a slow CA"""
+    while True:
+        await asyncio.sleep(ADCS_DISCOVERY_HEARTBEAT_INTERVAL)
+        try:
+            await in_worker_thread(refresh_heartbeat)(discovery_history)
+        except Exception as e:
+            logger.warning("Heartbeat of discovery %s failed: %s" % (discovery_history.name, e))
+
+
+def start_discovery_recovery():
+    """
+    Starts looking for the interrupted discoveries on the remoting loop, once in every worker process. The workers
+    check periodically, a discovery of a stopped worker is resumed when its heartbeat expires.
+    """
+    global _recovery
+    with _recovery_lock:
+        if _recovery is None:
+            _recovery = submit(recover_discoveries())
+        return _recovery
+
+
+async def recover_discoveries():
+    while True:
+        try:
+            await in_worker_thread(resume_orphaned_discoveries)()
+        except Exception as e:
+            logger.error("Recovery of the interrupted discoveries failed: %s" % e, exc_info=True)
+        await asyncio.sleep(ADCS_DISCOVERY_HEARTBEAT_INTERVAL)
+
+
+def resume_orphaned_discoveries():
+    """
+    Resumes the discoveries in progress whose worker stopped, they continue after their last committed pages.
+    Returns the futures of the resumed discoveries.
+    """
+    resumed = []
+    for discovery_history in claim_orphaned_discoveries(ADCS_DISCOVERY_ORPHAN_TIMEOUT):
+        if not discovery_history.request:
+            # the discovery was started by a version that did not store its request
+            logger.warning("Discovery %s was interrupted and cannot be resumed" % discovery_history.name)
+            DiscoveryHistory.objects.filter(id=discovery_history.id).update(
+                status=DiscoveryStatus.FAILED.value,
+                meta=[get_failed_reason_metadata_attribute("Discovery was interrupted")])
+            continue
+        logger.warning("Resuming interrupted discovery %s" % discovery_history.name)
+        resumed.append(submit_discovery(discovery_history.request, discovery_history.uuid))
+    return resumed
+
+
+async def discover_certificates(request_dto, discovery_history):
     logger.info("Starting discovery for %s" % request_dto["name"])
 
-    select_ca_method = attribute_definition_utils.get_attribute_value(
-        DISCOVERY_SELECT_CA_METHOD_ATTRIBUTE_NAME, request_dto["attributes"])
     authority_instance = AuthorityInstanceAttribute.from_dict(
         attribute_definition_utils.get_attribute_value(
             DISCOVERY_AUTHORITY_INSTANCE_ATTRIBUTE_NAME, request_dto["attributes"]))
 
-    authority = AuthorityInstance.objects.get(uuid=authority_instance.uuid)
+    authority = await in_worker_thread(AuthorityInstance.objects.get)(uuid=authority_instance.uuid)
+
+    issued_after = attribute_definition_utils.get_attribute_value(
+        DISCOVERY_ISSUED_AFTER_ATTRIBUTE_NAME, request_dto["attributes"])
+
+    # the CA and template combinations are stored with the discovery before the scans start, the interrupted
+    # discovery continues with them after the last committed page of every combination
+    checkpoints = await in_worker_thread(get_checkpoints)(discovery_history)
+    if checkpoints:
+        logger.info("Resuming discovery %s with %d committed certificates" %
+                    (request_dto["name"], discovery_history.total_certificates))
+    else:
+        checkpoints = await in_worker_thread(create_checkpoints)(
+            discovery_history, await plan_discovery(request_dto, authority))
+
+    units = [(ca, template) for ca, template, _ in checkpoints]
+    # the CAs in the order of the discovery, without the repeated CA of every template
+    cas = list({ca.config_string: ca for ca, _ in units}.values())
+    parallelism = get_discovery_parallelism(request_dto, authority)
+    progress = DiscoveryProgress(units)
+    progress.resume([(ca, template) for ca, template, checkpoint in checkpoints if checkpoint.completed],
+                    discovery_history.total_certificates, (discovery_history.progress or {}).get("pagesDone", 0))
+
+    # the RequestID of the last certificate read for every CA and template, the next page continues after it
+    last_request_ids = {scan_key(ca, template): checkpoint.request_id for ca, template, checkpoint in checkpoints}
+    full_scans = {scan_key(ca, template) for ca, template, checkpoint in checkpoints if checkpoint.full_scan}
+    checkpoint_ids = {scan_key(ca, template): checkpoint.id for ca, template, checkpoint in checkpoints}
+    pending = [(ca, template) for ca, template, checkpoint in checkpoints if not checkpoint.completed]
+
+    # the pages flow from the scans to the database writer through a bounded queue, a full queue stops the scans
+    # until the writer catches up, so the memory depends on the page size and not on the size of the CA
+    pages = asyncio.Queue(ADCS_DISCOVERY_QUEUE_SIZE)
+
+    async def scan():
+        try:
+            async with ScriptPrefetcher(lambda: create_async_session_from_authority_instance(authority),
+                                        dump_certificates_template(), ADCS_DISCOVERY_PREFETCH_DEPTH) as prefetcher:
+                return await scan_units(prefetcher, pending, issued_after, parallelism, pages.put, progress,
+                                        last_request_ids)
+        finally:
+            await pages.put(None)
+
+    scanner = asyncio.ensure_future(scan())
+    writer = asyncio.ensure_future(in_worker_thread(write_discovered_certificates)(
+        discovery_history, cas, received_pages(pages, asyncio.get_running_loop()), progress, checkpoint_ids))
+    try:
+        await asyncio.wait([scanner, writer], return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        if not scanner.done():
+            # the writer failed or the discovery was cancelled, the scans must not wait for the full queue
+            scanner.cancel()
+            while not pages.empty():
+                pages.get_nowait()
+    # the failure of the writer is raised first, the scans were cancelled because of it
+    count = await writer
+    failures = await scanner
+
+    for failure in failures.values():
+        logger.error("Discovery %s failed for %s" % (request_dto["name"], failure))
+
+    # the discovery fails when nothing could be read, otherwise it reports the failed CAs and templates
+    if failures and len(failures) == len(units):
+        raise Exception("; ".join(failures.values()))
+
+    if attribute_definition_utils.get_attribute_value(
+            DISCOVERY_INCREMENTAL_ATTRIBUTE_NAME, request_dto["attributes"]) in (True, "true"):
+        # the failed CAs and templates are read again from their previous watermark
+        await in_worker_thread(save_watermarks)(authority, [
+            (ca, template, last_request_ids[scan_key(ca, template)], scan_key(ca, template) in full_scans)
+            for ca, template in units if scan_key(ca, template) not in failures])
+
+    await in_worker_thread(complete_discovery)(
+        request_dto, discovery_history, count, progress, list(failures.values()))
+
+
+async def plan_discovery(request_dto, authority):
+    """
+    Returns the CA and template combinations of a new discovery as (ca, template, request_id, full_scan) tuples,
+    the scan of the combination continues after the RequestID.
+    """
+    select_ca_method = attribute_definition_utils.get_attribute_value(
+        DISCOVERY_SELECT_CA_METHOD_ATTRIBUTE_NAME, request_dto["attributes"])
 
     if select_ca_method == CaSelectMethod.SEARCH.method:
         cas = AuthorityData.from_dicts(
@@ -86,65 +259,192 @@ def discover_certificates(request_dto, discovery_history):
     templates = TemplateData.from_dicts(
         attribute_definition_utils.get_attribute_value_list(
             DISCOVERY_TEMPLATE_NAME_ATTRIBUTE_NAME, request_dto["attributes"]))
-    issued_after = attribute_definition_utils.get_attribute_value(
-        DISCOVERY_ISSUED_AFTER_ATTRIBUTE_NAME, request_dto["attributes"])
+    incremental = attribute_definition_utils.get_attribute_value(
+        DISCOVERY_INCREMENTAL_ATTRIBUTE_NAME, request_dto["attributes"]) in (True, "true")
+    full_scan_interval = attribute_definition_utils.get_attribute_value(
+        DISCOVERY_FULL_SCAN_INTERVAL_ATTRIBUTE_NAME, request_dto["attributes"]) or ADCS_DISCOVERY_FULL_SCAN_INTERVAL
 
     logger.debug("Authority instance: %s, CA names: %s, Template names: %s" %
-                 (authority_instance, cas, templates))
-
-    session = create_session_from_authority_instance(authority)
-    session.connect()
+                 (authority.name, cas, templates))
 
     # if ca_names is empty, then get all CAs
     # TODO: This operation may timeout if there are too many CAs, especially when their are not accessible,
     #  it should be handled
     if not cas:
-        result = session.run_ps(get_cas_script())
+        async with create_async_session_from_authority_instance(authority) as session:
+            result = await session.run_ps(get_cas_script(), idempotent=True)
         cas = DumpParser.parse_authority_data(result)
 
-    total_certificates = []
-    for ca in cas:
-        if not templates:
-            page = 1
-            result = session.run_ps(dump_certificates_script(
-                ca, None, issued_after, 1, ADCS_SEARCH_PAGE_SIZE))
-            certificates = DumpParser.parse_certificates(result)
-            total_certificates.extend(certificates)
-            while len(certificates) == ADCS_SEARCH_PAGE_SIZE:
-                page += 1
-                result = session.run_ps(dump_certificates_script(
-                    ca, None, issued_after, page, ADCS_SEARCH_PAGE_SIZE))
-                certificates = DumpParser.parse_certificates(result)
-                total_certificates.extend(certificates)
+    # every CA and template is scanned on its own session, the incremental discovery starts after the watermarks
+    # of the previous one
+    units = [(ca, template) for ca in cas for template in templates or [None]]
+    if not incremental:
+        return [(ca, template, 0, True) for ca, template in units]
+
+    watermarks = await in_worker_thread(get_watermarks)(authority)
+    planned = []
+    for ca, template in units:
+        watermark = watermarks.get(watermark_key(ca, template))
+        if needs_full_scan(watermark, int(full_scan_interval)):
+            planned.append((ca, template, 0, True))
         else:
-            for template in templates:
-                page = 1
-                result = session.run_ps(dump_certificates_script(
-                    ca, template, issued_after, page, ADCS_SEARCH_PAGE_SIZE))
-                certificates = DumpParser.parse_certificates(result)
-                total_certificates.extend(certificates)
-                while len(certificates) == ADCS_SEARCH_PAGE_SIZE:
-                    page += 1
-                    result = session.run_ps(dump_certificates_script(
-                        ca, template, issued_after, page, ADCS_SEARCH_PAGE_SIZE))
-                    certificates = DumpParser.parse_certificates(result)
-                    total_certificates.extend(certificates)
-
-    session.disconnect()
-
-    for certificate in total_certificates:
-        discovery_certificate = DiscoveryCertificate()
-        discovery_certificate.discovery_id = discovery_history.id
-        discovery_certificate.base64content = certificate.certificate
-        discovery_certificate.meta = get_certificate_meta(cas, certificate.template)
-        discovery_certificate.save()
-
-    logger.info("Discovery %s has total %d certificates" % (request_dto["name"], len(total_certificates)))
-
-    discovery_history.status = DiscoveryStatus.COMPLETED.value
+            planned.append((ca, template, watermark.request_id, False))
+    logger.info("Incremental discovery %s reads %d of %d CAs and templates from the beginning" %
+                (request_dto["name"], sum(1 for _, _, _, full_scan in planned if full_scan), len(units)))
+    return planned
+
+
+def in_worker_thread(function):
+    """
+    Runs the synchronous ORM function in a worker thread to keep the loop free. No request closes the connection
+    of the worker thread, it is closed when the function returns.
+    """
+    def call(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            connection.close()
+
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def received_pages(pages, loop):
+    """yields the pages in the queue to the writer thread, until the scans put None"""
+    while True:
+        page = asyncio.run_coroutine_threadsafe(pages.get(), loop).result()
+        if page is None:
+            return
+        yield page
+
+
+def get_discovery_parallelism(request_dto, authority):
+    """
+    The number of CA and template combinations read at once. The discovery can ask for fewer than the authority
+    instance allows, and the sessions of the prefetched pages must fit into the admitted sessions of the authority
+    with the sessions reserved for the interactive operations.
+    """
+    limit = attribute_definition_utils.get_attribute_value(
+        AUTHORITY_DISCOVERY_PARALLELISM_ATTRIBUTE_NAME, authority.attributes or []) or ADCS_DISCOVERY_PARALLELISM
+    requested = attribute_definition_utils.get_attribute_value(
+        DISCOVERY_PARALLELISM_ATTRIBUTE_NAME, request_dto["attributes"]) or limit
+    available = ADCS_ADMISSION_MAX_CONCURRENT - ADCS_DISCOVERY_PREFETCH_DEPTH - RESERVED_INTERACTIVE_SESSIONS
+    return max(1, min(int(requested), int(limit), available))
+
+
+async def scan_units(prefetcher, units, issued_after, parallelism, put_page, progress=None, last_request_ids=None):
+    """
+    Scans the CA and template combinations, at most parallelism of them at once, and passes every page to the
+    put_page coroutine as a (scan_key, page) tuple, (scan_key, None) follows the last page of a finished combination.
+    The scans continue after the RequestIDs in last_request_ids and update them. A failed combination does not stop
+    the others, the failures are returned by the scan_key of the combination.
+    """
+    if last_request_ids is None:
+        last_request_ids = {}
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def scan_unit(ca, template):
+        async with semaphore:
+            try:
+                async for page in scan_certificates(prefetcher, ca, template, issued_after, last_request_ids):
+                    await put_page((scan_key(ca, template), page))
+                await put_page((scan_key(ca, template), None))
+            finally:
+                if progress:
+                    progress.unit_done(ca)
+
+    results = await asyncio.gather(*[scan_unit(ca, template) for ca, template in units], return_exceptions=True)
+
+    failures = {}
+    for (ca, template), result in zip(units, results):
+        if isinstance(result, Exception):
+            failures[scan_key(ca, template)] = "%s/%s: %s" % (
+                ca.name, template.name if template else "all templates", result)
+        elif isinstance(result, BaseException):
+            raise result
+    return failures
+
+
+def scan_key(ca, template):
+    return ca.name, template.name if template else None
+
+
+async def scan_certificates(prefetcher, ca, template, issued_after, last_request_ids):
+    """
+    Yields the certificates of the CA and template page by page. Every page continues after the RequestID of the
+    last certificate of the previous one, so a page costs the same however deep in the database it is. The dump
+    script of the next page is started by the prefetcher while the current page is received.
+    """
+    key = scan_key(ca, template)
+    while True:
+        page = await dump_certificates_page(prefetcher, ca, template, issued_after, last_request_ids.get(key, 0))
+        if page:
+            last_request_ids[key] = max(certificate.request_id for certificate in page)
+            yield page
+        if len(page) < ADCS_SEARCH_PAGE_SIZE:
+            return
+
+
+async def dump_certificates_page(prefetcher, ca, template, issued_after, after_request_id):
+    """streams the page of the dump into the incremental parser, the whole output is never held in memory"""
+    parser = CertificateDumpParser()
+    certificates = []
+    async for chunk in prefetcher.stream(**dump_certificates_parameters(
+            ca, template, issued_after, after_request_id, ADCS_SEARCH_PAGE_SIZE)):
+        certificates.extend(parser.feed(chunk))
+    certificates.extend(parser.close())
+    return certificates
+
+
+def write_discovered_certificates(discovery_history, cas, pages, progress, checkpoint_ids):
+    """
+    Inserts the pages as they are received, every page is committed with the progress of the discovery and the
+    checkpoint of its CA and template, so a long discovery holds no transaction open and an interrupted one continues
+    after what was written. A certificate is stored once in a discovery, the repeated certificates of the overlapping
+    CAs and templates are skipped. Returns the number of certificates.
+    """
+    def discovery_certificates(certificates):
+        for fingerprint, (certificate, _) in certificates.items():
+            discovery_certificate = DiscoveryCertificate()
+            discovery_certificate.discovery_id = discovery_history.id
+            discovery_certificate.content_id = fingerprint
+            discovery_certificate.meta = get_certificate_meta(cas, certificate.template)
+            yield discovery_certificate
+
+    fingerprints = DiscoveryFingerprints(discovery_history, ADCS_DISCOVERY_DEDUPLICATION_CAPACITY)
+    if progress.certificates:
+        fingerprints.load()
+
+    for key, page in pages:
+        if page is None:
+            save_checkpoint(checkpoint_ids[key])
+            continue
+        with transaction.atomic():
+            certificates = fingerprints.new_certificates(page)
+            # the content of the certificate is shared by the discoveries, the discovery references it
+            store_contents({fingerprint: der for fingerprint, (_, der) in certificates.items()},
+                           ADCS_DISCOVERY_INSERT_BATCH_SIZE)
+            count = bulk_insert(DiscoveryCertificate, discovery_certificates(certificates),
+                                ADCS_DISCOVERY_INSERT_BATCH_SIZE)
+            save_checkpoint(checkpoint_ids[key], page, count)
+            progress.page_done(count)
+            DiscoveryHistory.objects.filter(id=discovery_history.id).update(
+                total_certificates=progress.certificates, progress=progress.to_dict(), heartbeat_at=timezone.now())
+    return progress.certificates
+
+
+def complete_discovery(request_dto, discovery_history, count, progress, failures=()):
+    logger.info("Discovery %s has total %d certificates" % (request_dto["name"], count))
+
+    discovery_history.total_certificates = count
+    discovery_history.progress = progress.to_dict()
+    if failures:
+        discovery_history.status = DiscoveryStatus.WARNING.value
+        discovery_history.meta = [get_failed_reason_metadata_attribute("; ".join(failures))]
+    else:
+        discovery_history.status = DiscoveryStatus.COMPLETED.value
     discovery_history.save()
 
-    logger.info("Discovery %s completed" % request_dto["name"])
+    logger.info("Discovery %s completed with status %s" % (request_dto["name"], discovery_history.status))
 
 
 def get_discovery_history_data(discovery_history_request: DiscoveryHistoryRequestDto, discovery_history):
@@ -154,34 +454,90 @@ def get_discovery_history_data(discovery_history_request: DiscoveryHistoryReques
     discovery_history_response.uuid = discovery_history.uuid
     discovery_history_response.status = discovery_history.status
     discovery_history_response.meta = discovery_history.meta
+    # the total is stored by the discovery with every committed page, the certificates are not counted
+    discovery_history_response.total_certificates_discovered = discovery_history.total_certificates
 
-    total_certificates = DiscoveryCertificate.objects.filter(discovery_id=discovery_history.id).count()
-
-    discovery_history_response.total_certificates_discovered = total_certificates
-
-    if discovery_history.status == DiscoveryStatus.IN_PROGRESS:
+    if discovery_history.status == DiscoveryStatus.IN_PROGRESS.value:
         discovery_history_response.certificate_data = []
-        discovery_history_response.total_certificates_discovered = 0
+        if discovery_history.progress:
+            discovery_history_response.meta = (discovery_history.meta or []) + [
+                get_discovery_progress_metadata_attribute(discovery_history.progress)]
     else:
         page_number = 0 if discovery_history_request.page_number <= 0 else discovery_history_request.page_number - 1
         items_per_page = discovery_history_request.items_per_page
 
-        # select from DiscoveryCertificate where discovery_id = discovery_history.id limit items_per_page offset
-        # page_number * items_per_page
-        # discovery_certificates = DiscoveryCertificate.objects.filter(
-        #     discovery_id=discovery_history.id)[page_number * items_per_page:items_per_page]
+        if discovery_history_request.continuation_token:
+            after_id = decode_continuation_token(discovery_history, discovery_history_request.continuation_token)
+        else:
+            after_id = get_page_boundary(discovery_history.id, items_per_page, page_number)
+
+        # the certificates are read in the order of the (discovery_id, id) index, a known page boundary or the
+        # continuation token read only the rows of the page, otherwise the ids before the page are skipped in the
+        # index without joining their contents
         discovery_certificates = DiscoveryCertificate.objects.filter(
-            discovery_id=discovery_history.id
-        ).order_by('uuid')[page_number * items_per_page:(page_number + 1) * items_per_page]
+            discovery_id=discovery_history.id).order_by("id")
+        if after_id is None and page_number > 0:
+            after_id = discovery_certificates.values_list("id", flat=True)[
+                page_number * items_per_page - 1:page_number * items_per_page].first()
+            if after_id is None:
+                # the page is after the last certificate
+                discovery_certificates = discovery_certificates.none()
+        if after_id is not None:
+            discovery_certificates = discovery_certificates.filter(id__gt=after_id)
+        discovery_certificates = list(discovery_certificates.select_related("content")[:items_per_page])
 
         discovery_history_response.certificate_data = [
-            DiscoveryCertificateDto(val.uuid, val.base64content, val.meta).to_json()
+            DiscoveryCertificateDto(val.uuid, val.content.der, val.meta).to_json()
             for val in discovery_certificates
         ]
+        if discovery_certificates and not discovery_history_request.continuation_token:
+            # the ids are integers, the page starts after the id preceding its first certificate
+            set_page_boundary(discovery_history.id, items_per_page, page_number, discovery_certificates[0].id - 1)
+        if len(discovery_certificates) == items_per_page:
+            last_id = discovery_certificates[-1].id
+            if not discovery_history_request.continuation_token:
+                set_page_boundary(discovery_history.id, items_per_page, page_number + 1, last_id)
+            discovery_history_response.continuation_token = encode_continuation_token(discovery_history, last_id)
 
     return discovery_history_response
 
 
+def get_page_boundary(discovery_id, items_per_page, page_number):
+    with _page_boundaries_lock:
+        key = (discovery_id, items_per_page, page_number)
+        if key in _page_boundaries:
+            _page_boundaries.move_to_end(key)
+        return _page_boundaries.get(key)
+
+
+def set_page_boundary(discovery_id, items_per_page, page_number, after_id):
+    with _page_boundaries_lock:
+        _page_boundaries[(discovery_id, items_per_page, page_number)] = after_id
+        _page_boundaries.move_to_end((discovery_id, items_per_page, page_number))
+        while len(_page_boundaries) > PAGE_BOUNDARIES_CACHE_SIZE:
+            _page_boundaries.popitem(last=False)
+
+
+def clear_page_boundaries():
+    with _page_boundaries_lock:
+        _page_boundaries.clear()
+
+
+def encode_continuation_token(discovery_history, after_id):
+    return base64.urlsafe_b64encode(("%s:%d" % (discovery_history.uuid, after_id)).encode()).decode()
+
+
+def decode_continuation_token(discovery_history, continuation_token):
+    try:
+        discovery_uuid, after_id = base64.urlsafe_b64decode(continuation_token.encode()).decode().split(":")
+        after_id = int(after_id)
+    except ValueError:
+        raise ValidationException("Invalid continuation token: " + continuation_token)
+    if discovery_uuid != str(discovery_history.uuid):
+        raise ValidationException("Continuation token does not belong to the discovery " + discovery_history.name)
+    return after_id
+
+
 def get_certificate_meta(cas, template_name):
     meta_list = [get_ca_name_metadata_attribute(cas[0].name), get_template_name_metadata_attribute(template_name)]
 
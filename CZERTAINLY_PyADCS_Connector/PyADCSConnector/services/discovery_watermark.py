@@ -0,0 +1,47 @@
+import datetime
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from PyADCSConnector.models.discovery_watermark import DiscoveryWatermark
+
+logger = logging.getLogger(__name__)
+
+
+def watermark_key(ca, template):
+    return ca.config_string, template.name if template else ""
+
+
+def get_watermarks(authority):
+    return {(watermark.config_string, watermark.template): watermark
+            for watermark in DiscoveryWatermark.objects.filter(authority_id=authority.id)}
+
+
+def needs_full_scan(watermark, full_scan_interval):
+    """
+    A CA and template without a watermark, or whose last full scan is older than the full scan interval in days,
+    is read from the beginning. The pending requests keep their RequestID when they are issued later, only the
+    full scan finds them.
+    """
+    if watermark is None or watermark.full_scan_at is None:
+        return True
+    return bool(full_scan_interval) and \
+        watermark.full_scan_at < timezone.now() - datetime.timedelta(days=full_scan_interval)
+
+
+@transaction.atomic
+def save_watermarks(authority, scanned):
+    """moves the watermarks of the scanned CAs and templates to the RequestID of the last certificate found"""
+    now = timezone.now()
+    for ca, template, request_id, full_scan in scanned:
+        config_string, template_name = watermark_key(ca, template)
+        watermark, _ = DiscoveryWatermark.objects.get_or_create(
+            authority_id=authority.id, config_string=config_string, template=template_name)
+        watermark.request_id = max(watermark.request_id, request_id)
+        watermark.scanned_at = now
+        if full_scan:
+            watermark.full_scan_at = now
+        watermark.save()
+        logger.debug("Watermark of %s/%s moved to RequestID %d" % (
+            ca.name, template_name or "all templates", watermark.request_id))
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+from django.test import TestCase, RequestFactory
+
+from PyADCSConnector.exceptions.exception_handler import ExceptionHandlerMiddleware
+from PyADCSConnector.exceptions.service_unavailable_exception import ServiceUnavailableException
+from PyADCSConnector.exceptions.too_many_requests_exception import TooManyRequestsException
+from PyADCSConnector.remoting.admission import AdmissionLimiter, AdmittedSession, AsyncAdmittedSession
+
+
+class SlowSession:
+    def __init__(self, delay):
+        self.delay = delay
+        self.disconnected = threading.Event()
+
+    def connect(self):
+        pass
+
+    def run_ps(self, script):
+        time.sleep(self.delay)
+        return script
+
+    def disconnect(self):
+        self.disconnected.set()
+
+
+class AsyncSlowSession:
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def connect(self):
+        pass
+
+    async def run_ps(self, script):
+        await asyncio.sleep(self.delay)
+        return script
+
+    async def stream_ps(self, script):
+        for chunk in script:
+            await asyncio.sleep(self.delay)
+            yield chunk
+
+    async def disconnect(self):
+        pass
+
+
+class AdmissionLimiterTest(TestCase):
+    def test_waiting_caller_times_out(self):
+        limiter = AdmissionLimiter("authority", max_concurrent=1, max_queued=1)
+        limiter.acquire(1)
+        with self.assertRaises(ServiceUnavailableException):
+            limiter.acquire(0.01)
+        self.assertEqual(limiter.stats()["timedOut"], 1)
+        self.assertEqual(limiter.stats()["waiting"], 0)
+
+    def test_full_queue_rejects_immediately(self):
+        limiter = AdmissionLimiter("authority", max_concurrent=1, max_queued=0)
+        limiter.acquire(1)
+        with self.assertRaises(TooManyRequestsException):
+            limiter.acquire(60)
+        limiter.release()
+        limiter.acquire(0)
+        self.assertEqual(limiter.stats()["rejected"], 1)
+
+    async def test_coroutine_waits_for_released_slot(self):
+        limiter = AdmissionLimiter("authority", max_concurrent=1, max_queued=1)
+        await limiter.acquire_async(1)
+        waiter = asyncio.ensure_future(limiter.acquire_async(5))
+        await asyncio.sleep(0.1)
+        self.assertEqual(limiter.stats()["waiting"], 1)
+        limiter.release()
+        await waiter
+        self.assertEqual(limiter.stats()["active"], 1)
+
+    def test_operation_over_deadline_returns_its_slot(self):
+        limiter = AdmissionLimiter("authority", max_concurrent=1, max_queued=1)
+        slow = SlowSession(0.5)
+        with self.assertRaises(ServiceUnavailableException):
+            with AdmittedSession(slow, limiter, 1, operation_timeout=0.05) as session:
+                session.run_ps("Get-CertificationAuthority")
+        # the slot is free before the operation ends, its session is disconnected after it
+        self.assertEqual(limiter.stats()["active"], 0)
+        self.assertFalse(slow.disconnected.is_set())
+        self.assertTrue(slow.disconnected.wait(5))
+        self.assertEqual(limiter.stats()["expired"], 1)
+
+        with AdmittedSession(SlowSession(0), limiter, 1, operation_timeout=1) as session:
+            self.assertEqual(session.run_ps("Get-CertificationAuthority"), "Get-CertificationAuthority")
+
+    async def test_coroutine_over_deadline_is_cancelled(self):
+        limiter = AdmissionLimiter("authority", max_concurrent=1, max_queued=1)
+        with self.assertRaises(ServiceUnavailableException):
+            async with AsyncAdmittedSession(AsyncSlowSession(5), limiter, 1, operation_timeout=0.05) as session:
+                await session.run_ps("Get-CertificationAuthority")
+        chunks = []
+        with self.assertRaises(ServiceUnavailableException):
+            async with AsyncAdmittedSession(AsyncSlowSession(0.1), limiter, 1, operation_timeout=0.25) as session:
+                async for chunk in session.stream_ps("abcdef"):
+                    chunks.append(chunk)
+        self.assertEqual(chunks, ["a", "b"])
+        self.assertEqual(limiter.stats()["active"], 0)
+        self.assertEqual(limiter.stats()["expired"], 2)
+
+    def test_rejection_is_mapped_to_429_with_retry_after(self):
+        request = RequestFactory().get("/v1/health")
+        response = ExceptionHandlerMiddleware.process_exception(request, TooManyRequestsException("busy", 5))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "5")
@@ -0,0 +1,212 @@
+import asyncio
+import base64
+import os
+import re
+import tempfile
+
+import spnego
+from django.test import TestCase
+from winrm.exceptions import InvalidCredentialsError
+
+from PyADCSConnector.exceptions.winrm_execution_exception import WinRMExecutionException
+from PyADCSConnector.remoting.async_winrm import AsyncWinRmRemoting, AsyncTransport, HttpResponse
+from PyADCSConnector.remoting.transport_cache import transport_cache, TransportCache
+
+ENVELOPE = ('<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" '
+            'xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" '
+            'xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell"><s:Body>%s</s:Body></s:Envelope>')
+
+
+class FakeWsmanServer:
+    """answers the WS-Man shell operations, the output of a command is returned in two Receive responses"""
+
+    def __init__(self, output=b"", exit_code=0, transport="basic"):
+        self.output = output
+        self.exit_code = exit_code
+        self.transport = transport
+        self.actions = []
+        self.connections = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        try:
+            await self.serve(reader, writer)
+        except asyncio.CancelledError:
+            # the test loop is closing while the client connection is still open
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, reader, writer):
+        self.connections += 1
+        context = spnego.server(protocol="ntlm") if self.transport == "ntlm" else None
+        # reuses the client side framing with the server context
+        security = AsyncTransport("localhost", 0, False, "ntlm", None, None)
+        security.context = context
+        receives = 0
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers["content-length"]))
+
+            authorization = headers.get("authorization", "")
+            if context is not None and authorization.startswith("Negotiate "):
+                token = context.step(base64.b64decode(authorization[len("Negotiate "):]))
+                if context.complete:
+                    self.write(writer, 200, b"")
+                else:
+                    self.write(writer, 401, b"", {"WWW-Authenticate": "Negotiate " + base64.b64encode(token).decode()})
+                continue
+            if context is None and authorization != "Basic " + base64.b64encode(b"user:password").decode():
+                self.write(writer, 401, b"")
+                continue
+
+            if context is not None:
+                body = security._decrypt(HttpResponse(200, headers, body))
+            action = re.search(r"<a:Action[^>]*>([^<]+)</a:Action>", body.decode()).group(1).rsplit("/", 1)[1]
+            self.actions.append(action)
+            if action == "Create":
+                reply = '<w:SelectorSet><w:Selector Name="ShellId">SHELL-1</w:Selector></w:SelectorSet>'
+            elif action == "Command":
+                reply = '<rsp:CommandResponse><rsp:CommandId>COMMAND-1</rsp:CommandId></rsp:CommandResponse>'
+            elif action == "Receive":
+                receives += 1
+                half = len(self.output) // 2
+                chunk = self.output[:half] if receives % 2 == 1 else self.output[half:]
+                state = "Running" if receives % 2 == 1 else "Done"
+                reply = ('<rsp:ReceiveResponse><rsp:Stream Name="stdout" CommandId="COMMAND-1">%s</rsp:Stream>'
+                         '<rsp:CommandState CommandId="COMMAND-1" '
+                         'State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/%s">'
+                         '<rsp:ExitCode>%d</rsp:ExitCode></rsp:CommandState></rsp:ReceiveResponse>'
+                         % (base64.b64encode(chunk).decode(), state, self.exit_code))
+            else:
+                reply = ""
+            payload = (ENVELOPE % reply).encode()
+            if context is not None:
+                payload, content_type = security._encrypt(payload)
+                self.write(writer, 200, payload, {"Content-Type": content_type}, chunked=True)
+            else:
+                self.write(writer, 200, payload, {"Content-Type": "application/soap+xml;charset=UTF-8"})
+
+    @staticmethod
+    def write(writer, status, body, headers=None, chunked=False):
+        lines = ["HTTP/1.1 %d X" % status]
+        lines.extend("%s: %s" % item for item in (headers or {}).items())
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+            half = len(body) // 2
+            body = b"".join(b"%x\r\n%s\r\n" % (len(part), part) for part in (body[:half], body[half:])) + b"0\r\n\r\n"
+        else:
+            lines.append("Content-Length: %d" % len(body))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+
+
+class AsyncWinRmRemotingTest(TestCase):
+    async def run_script(self, server, transport="basic", password="password"):
+        port = await server.start()
+        try:
+            async with AsyncWinRmRemoting("user", password, "127.0.0.1", port=port, transport=transport) as session:
+                return await session.run_ps("Get-CertificationAuthority")
+        finally:
+            await server.stop()
+
+    async def test_runs_command_in_shell(self):
+        server = FakeWsmanServer(output=b"Name : CA1\r\nName : CA2\r\n")
+        result = await self.run_script(server)
+
+        self.assertEqual(result.std_out, b"Name : CA1\r\nName : CA2\r\n")
+        self.assertEqual(server.actions, ["Create", "Command", "Receive", "Receive", "Signal", "Delete"])
+        self.assertEqual(server.connections, 1)
+
+    async def test_stream_yields_output_per_receive(self):
+        server = FakeWsmanServer(output=b"Name : CA1\r\nName : CA2\r\n")
+        port = await server.start()
+        try:
+            async with AsyncWinRmRemoting("user", "password", "127.0.0.1", port=port, transport="basic") as session:
+                chunks = [chunk async for chunk in session.stream_ps("Get-CertificationAuthority")]
+        finally:
+            await server.stop()
+
+        self.assertEqual(chunks, [b"Name : CA1\r\n", b"Name : CA2\r\n"])
+
+    async def test_failed_command_raises_execution_exception(self):
+        server = FakeWsmanServer(exit_code=1)
+        with self.assertRaises(WinRMExecutionException):
+            await self.run_script(server)
+
+    async def test_rejected_credentials(self):
+        with self.assertRaises(InvalidCredentialsError):
+            await self.run_script(FakeWsmanServer(), password="wrong")
+
+    async def test_ntlm_encrypted_messages(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as user_file:
+            user_file.write(":user:password\n")
+            user_file.flush()
+            os.environ["NTLM_USER_FILE"] = user_file.name
+            try:
+                server = FakeWsmanServer(output=b"x" * 50000, transport="ntlm")
+                result = await self.run_script(server, transport="ntlm")
+            finally:
+                del os.environ["NTLM_USER_FILE"]
+
+        self.assertEqual(result.std_out, b"x" * 50000)
+        self.assertEqual(server.connections, 1)
+
+    async def test_authenticated_connection_is_reused_by_next_shell(self):
+        server = FakeWsmanServer(output=b"ok", transport="ntlm")
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as user_file:
+            user_file.write(":user:password\n")
+            user_file.flush()
+            os.environ["NTLM_USER_FILE"] = user_file.name
+            port = await server.start()
+            avoided = transport_cache.stats()["handshakesAvoided"]
+            try:
+                for _ in range(3):
+                    async with AsyncWinRmRemoting("user", "password", "127.0.0.1", port=port,
+                                                  transport="ntlm") as session:
+                        await session.run("echo", ["ok"])
+            finally:
+                del os.environ["NTLM_USER_FILE"]
+                await server.stop()
+
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(transport_cache.stats()["handshakesAvoided"] - avoided, 2)
+
+
+class TransportCacheTest(TestCase):
+    def test_checkout_returns_checked_in_transport(self):
+        cache = TransportCache()
+        transport = object()
+        cache.checkin("key", transport, lambda t: None)
+        self.assertIsNone(cache.checkout("other"))
+        self.assertIs(cache.checkout("key"), transport)
+        self.assertIsNone(cache.checkout("key"))
+
+    def test_expired_and_excess_transports_are_closed(self):
+        closed = []
+        cache = TransportCache(max_idle_per_key=1, idle_timeout=-1)
+        cache.checkin("key", "first", closed.append)
+        cache.checkin("key", "second", closed.append)
+        self.assertEqual(closed, ["first"])
+        self.assertIsNone(cache.checkout("key"))
+        self.assertEqual(closed, ["first", "second"])
+
+    def test_disabled_cache_closes_transports(self):
+        closed = []
+        cache = TransportCache(enabled=False)
+        cache.checkin("key", "transport", closed.append)
+        self.assertEqual(closed, ["transport"])
+        self.assertIsNone(cache.checkout("key"))
@@ -0,0 +1,62 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+
+from PyADCSConnector.models.certificate_content import CertificateContent
+from PyADCSConnector.models.discovery_certificate import DiscoveryCertificate
+from PyADCSConnector.models.discovery_history import DiscoveryHistory
+from PyADCSConnector.utils.bulk_insert import bulk_insert
+
+
+class BulkInsertTest(TestCase):
+    def setUp(self):
+        self.discovery_history = DiscoveryHistory.objects.create(name="bulk", status="inProgress")
+
+    def certificates(self, count):
+        # the fingerprints of the test contents contain the characters escaped by COPY
+        contents = CertificateContent.objects.bulk_create(
+            [CertificateContent(fingerprint="fingerprint\\%d\n\t\r" % i, der=b"MIIB%d" % i)
+             for i in range(count)])
+        for i, content in enumerate(contents):
+            certificate = DiscoveryCertificate()
+            certificate.discovery_id = self.discovery_history.id
+            certificate.content_id = content.fingerprint
+            certificate.meta = None if i % 2 else [{"name": "caName", "content": [{"data": "Cert\\CA\t%d" % i}]}]
+            yield certificate
+
+    def assert_inserted(self, expected):
+        inserted = list(DiscoveryCertificate.objects.filter(discovery_id=self.discovery_history.id).order_by("id"))
+        self.assertEqual([(c.uuid, c.content_id, bytes(c.content.der), c.meta) for c in inserted],
+                         [(c.uuid, c.content_id, b"MIIB%d" % i, c.meta) for i, c in enumerate(expected)])
+
+    def test_rows_are_copied(self):
+        expected = list(self.certificates(25))
+        with mock.patch.object(DiscoveryCertificate.objects, "bulk_create") as bulk_create:
+            self.assertEqual(bulk_insert(DiscoveryCertificate, iter(expected), 10), 25)
+        bulk_create.assert_not_called()
+        self.assert_inserted(expected)
+
+    def test_binary_rows_are_copied(self):
+        # the backslash of the bytea hex format is escaped in the COPY stream
+        contents = [CertificateContent(fingerprint="copied%d" % i, der=bytes([i, 92, 10, 0, 255])) for i in range(3)]
+        self.assertEqual(bulk_insert(CertificateContent, iter(contents), 10), 3)
+        self.assertEqual([bytes(c.der) for c in CertificateContent.objects.filter(
+            fingerprint__startswith="copied").order_by("fingerprint")], [c.der for c in contents])
+
+    def test_conflicting_rows_are_skipped(self):
+        CertificateContent.objects.create(fingerprint="copied1", der=b"stored")
+        contents = [CertificateContent(fingerprint="copied%d" % i, der=b"copied") for i in range(3)]
+        self.assertEqual(bulk_insert(CertificateContent, iter(contents), 10, ignore_conflicts=True), 2)
+        self.assertEqual([bytes(c.der) for c in CertificateContent.objects.filter(
+            fingerprint__startswith="copied").order_by("fingerprint")], [b"copied", b"stored", b"copied"])
+
+    def test_bulk_create_in_batches_without_copy(self):
+        expected = list(self.certificates(25))
+        with mock.patch.object(connection, "vendor", "sqlite"), \
+                mock.patch.object(DiscoveryCertificate.objects, "bulk_create",
+                                  wraps=DiscoveryCertificate.objects.bulk_create) as bulk_create:
+            self.assertEqual(bulk_insert(DiscoveryCertificate, iter(expected), 10), 25)
+        self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list], [10, 10, 5])
+        self.assert_inserted(expected)
+
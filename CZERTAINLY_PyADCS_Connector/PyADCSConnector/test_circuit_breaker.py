@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+from django.test import TestCase
+from winrm.exceptions import WinRMTransportError
+
+from PyADCSConnector.exceptions.circuit_open_exception import CircuitOpenException
+from PyADCSConnector.exceptions.remoting_exception import RemotingException
+from PyADCSConnector.exceptions.too_many_requests_exception import TooManyRequestsException
+from PyADCSConnector.exceptions.winrm_execution_exception import WinRMExecutionException
+from PyADCSConnector.remoting.circuit_breaker import CircuitBreaker, GuardedSession, CLOSED, OPEN
+
+
+class FailingSession:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def connect(self):
+        pass
+
+    def run_ps(self, script):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return "ok"
+
+    def disconnect(self):
+        pass
+
+
+class CircuitBreakerTest(TestCase):
+    def open_breaker(self, probe, reset_timeout=60):
+        breaker = CircuitBreaker("authority", probe, failure_threshold=2, reset_timeout=reset_timeout)
+        session = GuardedSession(FailingSession(ConnectionRefusedError("refused")), breaker)
+        for _ in range(2):
+            with self.assertRaises(ConnectionRefusedError):
+                session.run_ps("Get-CertificationAuthority")
+        return breaker
+
+    def test_opens_after_consecutive_transport_failures_and_fails_fast(self):
+        breaker = self.open_breaker(lambda: None)
+        self.assertEqual(breaker.stats()["state"], OPEN)
+
+        session = FailingSession()
+        with self.assertRaises(CircuitOpenException) as context:
+            with GuardedSession(session, breaker) as guarded:
+                guarded.run_ps("Get-CertificationAuthority")
+        self.assertEqual(session.calls, 0)
+        self.assertGreater(context.exception.retry_after, 0)
+
+    def test_successful_probe_closes_circuit(self):
+        probes = []
+        breaker = self.open_breaker(lambda: probes.append(True), reset_timeout=0)
+
+        with GuardedSession(FailingSession(), breaker) as guarded:
+            self.assertEqual(guarded.run_ps("Get-CertificationAuthority"), "ok")
+        self.assertEqual(probes, [True])
+        self.assertEqual(breaker.stats()["state"], CLOSED)
+
+    def test_failed_probe_keeps_circuit_open(self):
+        def probe():
+            raise WinRMTransportError("http", 503, "unavailable")
+
+        breaker = self.open_breaker(probe, reset_timeout=0)
+        with self.assertRaises(CircuitOpenException):
+            breaker.before_call()
+        self.assertEqual(breaker.stats()["state"], OPEN)
+
+    def test_failed_script_is_not_a_transport_failure(self):
+        breaker = CircuitBreaker("authority", lambda: None, failure_threshold=1)
+        session = GuardedSession(FailingSession(WinRMExecutionException(1, "Access denied")), breaker)
+        with self.assertRaises(WinRMExecutionException):
+            session.run_ps("Get-CertificationAuthority")
+        self.assertEqual(breaker.stats()["state"], CLOSED)
+
+    def test_local_rejection_does_not_reset_failures(self):
+        breaker = CircuitBreaker("authority", lambda: None, failure_threshold=2)
+        for error in (ConnectionRefusedError("refused"), TooManyRequestsException("busy", 5),
+                      RemotingException("no free shell"), ConnectionRefusedError("refused")):
+            with self.assertRaises(type(error)):
+                GuardedSession(FailingSession(error), breaker).run_ps("Get-CertificationAuthority")
+        self.assertEqual(breaker.stats()["state"], OPEN)
+
+    def test_cancelled_probe_reopens_circuit(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def probe():
+            started.set()
+            finish.wait(5)
+
+        breaker = self.open_breaker(probe, reset_timeout=0)
+
+        async def cancel_probe():
+            task = asyncio.ensure_future(breaker.before_call_async())
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        try:
+            asyncio.run(cancel_probe())
+        finally:
+            finish.set()
+        self.assertEqual(breaker.stats()["state"], OPEN)
@@ -0,0 +1,284 @@
+import asyncio
+import base64
+import datetime
+import threading
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from PyADCSConnector.exceptions.validation_exception import ValidationException
+from PyADCSConnector.models.authority_instance import AuthorityInstance
+from PyADCSConnector.models.certificate_content import CertificateContent
+from PyADCSConnector.models.discovery_certificate import DiscoveryCertificate
+from PyADCSConnector.models.discovery_checkpoint import DiscoveryCheckpoint
+from PyADCSConnector.models.discovery_history import DiscoveryHistory
+from PyADCSConnector.models.discovery_watermark import DiscoveryWatermark
+from PyADCSConnector.objects.discovery_history_request_dto import DiscoveryHistoryRequestDto
+from PyADCSConnector.remoting.winrm.fake_server import FakeAdcs, FakeWsmanServer
+from PyADCSConnector.services.attributes.discovery_attributes import *
+from PyADCSConnector.services.certificate_content import store_contents
+from PyADCSConnector.services.discovery_checkpoint import create_checkpoints
+from PyADCSConnector.services.discovery_history import write_discovered_certificates, received_pages, \
+    get_discovery_history_data, discover_certificates, in_worker_thread, resume_orphaned_discoveries, \
+    get_discovery_parallelism, clear_page_boundaries
+from PyADCSConnector.utils.discovery_progress import DiscoveryProgress
+from PyADCSConnector.utils.dump_parser import AuthorityData, ParseResult
+from PyADCSConnector.utils.fingerprint_filter import certificate_fingerprint
+
+
+def encoded(number):
+    return base64.b64encode(b"certificate %d" % number).decode()
+
+
+def create_certificates(discovery_history, count):
+    contents = {certificate_fingerprint(b"certificate %d" % i): b"certificate %d" % i for i in range(count)}
+    store_contents(contents, 100)
+    DiscoveryCertificate.objects.bulk_create(
+        [DiscoveryCertificate(discovery=discovery_history, content_id=fingerprint) for fingerprint in contents])
+
+
+class DiscoveryHistoryTest(TransactionTestCase):
+    async def test_pages_are_committed_with_the_progress(self):
+        discovery_history = await DiscoveryHistory.objects.acreate(name="writer", status="inProgress")
+        cas = [AuthorityData(name, name, "fake-adcs.local", "fake-adcs.local\\" + name, "", None, None, None, None)
+               for name in ("Fake CA 1", "Fake CA 2")]
+        progress = DiscoveryProgress([(cas[0], None), (cas[1], None)])
+        checkpoints = await sync_to_async(create_checkpoints)(discovery_history, [(ca, None, 0, True) for ca in cas])
+        checkpoint_ids = {(ca.name, None): checkpoint.id for ca, _, checkpoint in checkpoints}
+        pages = asyncio.Queue(1)
+        writer = asyncio.ensure_future(in_worker_thread(write_discovered_certificates)(
+            discovery_history, cas, received_pages(pages, asyncio.get_running_loop()), progress, checkpoint_ids))
+        for page in range(4):
+            await pages.put((("Fake CA 1", None),
+                             [ParseResult("1.2.3", encoded(page * 3 + i), page * 3 + i + 1) for i in range(3)]))
+        await pages.put((("Fake CA 1", None), None))
+        progress.unit_done(cas[0])
+        await pages.put((("Fake CA 2", None), [ParseResult("1.2.3", encoded(12), 13)]))
+
+        # the committed pages are visible to the status request while the discovery runs
+        while (await DiscoveryHistory.objects.aget(id=discovery_history.id)).total_certificates < 13:
+            await asyncio.sleep(0.01)
+        running = await DiscoveryHistory.objects.aget(id=discovery_history.id)
+        response = await sync_to_async(get_discovery_history_data)(DiscoveryHistoryRequestDto(), running)
+        self.assertEqual(response.total_certificates_discovered, 13)
+        self.assertEqual(response.certificate_data, [])
+        self.assertEqual(running.progress["pagesDone"], 5)
+        self.assertEqual(running.progress["casDone"], 1)
+        self.assertIsNotNone(running.progress["etaSeconds"])
+        self.assertIn("1 of 2 CAs, 13 certificates in 5 pages", response.meta[0]["content"][0]["data"])
+
+        await pages.put(None)
+        self.assertEqual(await writer, 13)
+        self.assertEqual(await DiscoveryCertificate.objects.filter(discovery_id=discovery_history.id).acount(), 13)
+        # the checkpoints follow the committed pages of their CA
+        self.assertEqual([(checkpoint.request_id, checkpoint.certificates, checkpoint.completed)
+                          async for checkpoint in DiscoveryCheckpoint.objects.filter(
+                              discovery_id=discovery_history.id).order_by("position")],
+                         [(12, 12, True), (13, 1, False)])
+
+    def test_repeated_certificates_are_stored_once(self):
+        cas = [AuthorityData("Fake CA 1", "Fake CA 1", "fake-adcs.local", "fake-adcs.local\\Fake CA 1", "", None,
+                             None, None, None)]
+        certificates = [ParseResult("1.2.3", encoded(i), i + 1) for i in range(8)]
+
+        def write(name, pages):
+            discovery_history = DiscoveryHistory.objects.create(name=name, status="inProgress")
+            units = [(cas[0], None) for _ in pages]
+            checkpoints = create_checkpoints(discovery_history, [(ca, template, 0, True) for ca, template in units])
+            count = write_discovered_certificates(
+                discovery_history, cas, [(position, page) for position, page in enumerate(pages)],
+                DiscoveryProgress(units), {position: checkpoint.id for position, (_, _, checkpoint)
+                                           in enumerate(checkpoints)})
+            discovery_history.status = "completed"
+            return discovery_history, count, list(DiscoveryCheckpoint.objects.filter(
+                discovery_id=discovery_history.id).order_by("position").values_list("certificates", flat=True))
+
+        # the filter of the tiny capacity reports most certificates as stored, the database confirms them
+        with mock.patch("PyADCSConnector.services.discovery_history.ADCS_DISCOVERY_DEDUPLICATION_CAPACITY", 1):
+            first, count, checkpoints = write(
+                "first", [certificates[:4], certificates[2:6] + certificates[:1] + certificates[5:6]])
+        self.assertEqual((count, checkpoints), (6, [4, 2]))
+        second, count, checkpoints = write("second", [certificates[4:]])
+        self.assertEqual((count, checkpoints), (4, [4]))
+
+        fingerprints = [certificate_fingerprint(base64.b64decode(certificate.certificate))
+                        for certificate in certificates]
+        self.assertEqual(list(DiscoveryCertificate.objects.filter(discovery_id=first.id).order_by("id").values_list(
+            "content_id", flat=True)), fingerprints[:6])
+        self.assertEqual(list(DiscoveryCertificate.objects.filter(discovery_id=second.id).order_by("id").values_list(
+            "content_id", flat=True)), fingerprints[4:])
+        # the discoveries reference the contents stored once
+        self.assertEqual(CertificateContent.objects.filter(fingerprint__in=fingerprints).count(), 8)
+        response = get_discovery_history_data(DiscoveryHistoryRequestDto(items_per_page=10), second)
+        self.assertEqual([certificate["base64Content"] for certificate in response.certificate_data],
+                         [encoded(i) for i in range(4, 8)])
+
+    def test_resumed_progress_rate_counts_the_new_certificates(self):
+        ca = AuthorityData("Fake CA 1", "Fake CA 1", "fake-adcs.local", "fake-adcs.local\\Fake CA 1", "", None, None,
+                           None, None)
+        progress = DiscoveryProgress([(ca, None), (ca, "1.2.3")])
+        progress.resume([(ca, None)], 1000, 3)
+        progress.started -= 10
+        progress.page_done(20)
+
+        snapshot = progress.to_dict()
+        self.assertEqual(snapshot["certificatesPersisted"], 1020)
+        self.assertAlmostEqual(snapshot["certificatesPerSecond"], 2.0, delta=0.1)
+
+    def test_parallelism_leaves_a_session_for_interactive_operations(self):
+        authority = AuthorityInstance(attributes=[])
+        with mock.patch("PyADCSConnector.services.discovery_history.ADCS_ADMISSION_MAX_CONCURRENT", 5), \
+                mock.patch("PyADCSConnector.services.discovery_history.ADCS_DISCOVERY_PREFETCH_DEPTH", 1):
+            self.assertEqual(get_discovery_parallelism({"attributes": []}, authority), 3)
+        with mock.patch("PyADCSConnector.services.discovery_history.ADCS_ADMISSION_MAX_CONCURRENT", 2):
+            self.assertEqual(get_discovery_parallelism({"attributes": []}, authority), 1)
+
+    def test_deleted_discovery_cascades_to_its_certificates(self):
+        discovery_history = DiscoveryHistory.objects.create(name="deleted", status="completed")
+        other = DiscoveryHistory.objects.create(name="other", status="completed")
+        create_certificates(discovery_history, 3)
+        create_certificates(other, 1)
+
+        response = self.client.delete("/v1/discoveryProvider/discover/%s" % discovery_history.uuid)
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(list(DiscoveryCertificate.objects.values_list("discovery_id", flat=True)), [other.id])
+        # the content referenced by the other discovery is kept
+        fingerprints = [certificate_fingerprint(b"certificate %d" % i) for i in range(3)]
+        self.assertEqual(list(CertificateContent.objects.filter(fingerprint__in=fingerprints).values_list(
+            "fingerprint", flat=True)), fingerprints[:1])
+        # the deleted contents are stored again by the next discovery
+        store_contents({certificate_fingerprint(b"certificate %d" % i): b"certificate %d" % i for i in range(3)}, 100)
+        self.assertEqual(CertificateContent.objects.filter(fingerprint__in=fingerprints).count(), 3)
+
+    def test_pages_continue_after_the_previous_page(self):
+        discovery_history = DiscoveryHistory.objects.create(name="paged", status="completed", total_certificates=25)
+        create_certificates(discovery_history, 25)
+
+        numbered = []
+        with CaptureQueriesContext(connection) as queries:
+            for page_number in (1, 2, 3):
+                numbered.append(get_discovery_history_data(
+                    DiscoveryHistoryRequestDto(page_number=page_number, items_per_page=10), discovery_history))
+        # only the first page skips rows, the next ones continue after the last certificate of the previous one
+        self.assertEqual(["OFFSET" in query["sql"] for query in queries.captured_queries], [False] * 3)
+
+        continued = [get_discovery_history_data(DiscoveryHistoryRequestDto(items_per_page=10), discovery_history)]
+        while continued[-1].continuation_token:
+            continued.append(get_discovery_history_data(DiscoveryHistoryRequestDto(
+                items_per_page=10, continuation_token=continued[-1].continuation_token), discovery_history))
+
+        self.assertEqual([page.certificate_data for page in numbered], [page.certificate_data for page in continued])
+        self.assertEqual([certificate["base64Content"] for page in numbered for certificate in page.certificate_data],
+                         [encoded(i) for i in range(25)])
+        self.assertEqual([page.total_certificates_discovered for page in numbered], [25] * 3)
+
+        clear_page_boundaries()
+        with CaptureQueriesContext(connection) as queries:
+            page = get_discovery_history_data(
+                DiscoveryHistoryRequestDto(page_number=3, items_per_page=10), discovery_history)
+        # the rows before an unknown page are skipped in the index, only the rows of the page are joined
+        self.assertEqual([("OFFSET" in query["sql"], "JOIN" in query["sql"])
+                          for query in queries.captured_queries], [(True, False), (False, True)])
+        self.assertEqual(page.certificate_data, numbered[2].certificate_data)
+        self.assertEqual(get_discovery_history_data(DiscoveryHistoryRequestDto(
+            page_number=5, items_per_page=10), discovery_history).certificate_data, [])
+
+        other = DiscoveryHistory.objects.create(name="other", status="completed")
+        with self.assertRaises(ValidationException):
+            get_discovery_history_data(DiscoveryHistoryRequestDto(
+                continuation_token=numbered[0].continuation_token), other)
+
+    def start_authority(self, adcs):
+        server = FakeWsmanServer(("127.0.0.1", 0), adcs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        credential = {"attributes": [{"name": "username", "content": [{"data": "user"}]},
+                                     {"name": "password", "content": [{"data": "password"}]}]}
+        authority = AuthorityInstance.objects.create(name="fake", address="127.0.0.1", port=server.server_address[1],
+                                                     attributes=[], credential=credential, kind="PyADCS-WinRM")
+        return server, authority
+
+    @staticmethod
+    def discovery_request(name, authority, **attributes):
+        values = {
+            DISCOVERY_AUTHORITY_INSTANCE_ATTRIBUTE_NAME: {"name": authority.name, "uuid": str(authority.uuid)},
+            DISCOVERY_SELECT_CA_METHOD_ATTRIBUTE_NAME: CaSelectMethod.CONFIGSTRING.method,
+            DISCOVERY_CONFIGSTRING_ATTRIBUTE_NAME: "fake-adcs.local\\Fake CA 1",
+        }
+        values.update(attributes)
+        return {"name": name, "kind": "PyADCS-WinRM",
+                "attributes": [{"name": key, "content": [{"data": value}]} for key, value in values.items()]}
+
+    @mock.patch("PyADCSConnector.services.discovery_history.ADCS_SEARCH_PAGE_SIZE", 4)
+    async def test_incremental_discovery_continues_after_the_watermark(self):
+        adcs = FakeAdcs(certificate_count=10)
+        server, authority = await sync_to_async(self.start_authority)(adcs)
+
+        async def discover(name, **attributes):
+            discovery_history = await DiscoveryHistory.objects.acreate(name=name, status="inProgress")
+            await discover_certificates(self.discovery_request(name, authority, **attributes), discovery_history)
+            return await DiscoveryHistory.objects.aget(id=discovery_history.id)
+
+        first = await discover("first", **{DISCOVERY_INCREMENTAL_ATTRIBUTE_NAME: True})
+        commands = server.stats["commands"]
+        adcs.certificate_count = 13
+        second = await discover("second", **{DISCOVERY_INCREMENTAL_ATTRIBUTE_NAME: True})
+
+        self.assertEqual((first.status, first.total_certificates), ("completed", 10))
+        self.assertEqual((second.status, second.total_certificates), ("completed", 3))
+        # the second discovery reads the one page after the watermark, the other process was started ahead by the
+        # prefetcher and terminated
+        self.assertEqual(server.stats["commands"] - commands, 2)
+        watermark = await DiscoveryWatermark.objects.aget(authority_id=authority.id)
+        self.assertEqual((watermark.config_string, watermark.template, watermark.request_id),
+                         ("fake-adcs.local\\Fake CA 1", "", 13))
+
+        # a discovery that is not incremental, or an expired full scan, reads all certificates again
+        full = await discover("full")
+        await DiscoveryWatermark.objects.filter(id=watermark.id).aupdate(
+            full_scan_at=watermark.full_scan_at - datetime.timedelta(days=31))
+        rescanned = await discover("rescanned", **{DISCOVERY_INCREMENTAL_ATTRIBUTE_NAME: True})
+        self.assertEqual(full.total_certificates, 13)
+        self.assertEqual(rescanned.total_certificates, 13)
+        self.assertGreater((await DiscoveryWatermark.objects.aget(id=watermark.id)).full_scan_at,
+                           watermark.full_scan_at)
+
+    @mock.patch("PyADCSConnector.services.discovery_history.ADCS_SEARCH_PAGE_SIZE", 4)
+    def test_interrupted_discovery_resumes_after_the_checkpoint(self):
+        server, authority = self.start_authority(FakeAdcs(certificate_count=10))
+        expired = timezone.now() - datetime.timedelta(hours=1)
+        interrupted = DiscoveryHistory.objects.create(
+            name="interrupted", status="inProgress", request=self.discovery_request("interrupted", authority),
+            heartbeat_at=expired, total_certificates=4, progress={"pagesDone": 1})
+        ca = AuthorityData("Fake CA 1", "Fake CA 1", "fake-adcs.local", "fake-adcs.local\\Fake CA 1", "", None, None,
+                           None, None)
+        checkpoint, = [checkpoint for _, _, checkpoint in create_checkpoints(interrupted, [(ca, None, 0, True)])]
+        create_certificates(interrupted, 4)
+        DiscoveryCheckpoint.objects.filter(id=checkpoint.id).update(request_id=4, certificates=4)
+        running = DiscoveryHistory.objects.create(name="running", status="inProgress", heartbeat_at=timezone.now(),
+                                                  request=self.discovery_request("running", authority))
+        unknown = DiscoveryHistory.objects.create(name="unknown", status="inProgress")
+
+        resumed = resume_orphaned_discoveries()
+        self.assertEqual(len(resumed), 1)
+        resumed[0].result(timeout=30)
+
+        interrupted.refresh_from_db()
+        self.assertEqual((interrupted.status, interrupted.total_certificates), ("completed", 10))
+        self.assertEqual(DiscoveryCertificate.objects.filter(discovery_id=interrupted.id).count(), 10)
+        # the first page was committed before the interruption, the resumed scan reads the two pages after it
+        self.assertEqual(interrupted.progress["pagesDone"], 3)
+        checkpoint.refresh_from_db()
+        self.assertEqual((checkpoint.request_id, checkpoint.certificates, checkpoint.completed), (10, 10, True))
+        # the discovery with a recent heartbeat runs in another worker, the one without a request cannot be resumed
+        running.refresh_from_db()
+        unknown.refresh_from_db()
+        self.assertEqual(running.status, "inProgress")
+        self.assertEqual(unknown.status, "failed")
+        self.assertEqual(resume_orphaned_discoveries(), [])
@@ -0,0 +1,231 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+from unittest import mock
+
+import winrm
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+from django.test import TestCase
+from winrm.exceptions import WinRMTransportError
+
+from PyADCSConnector.remoting.async_winrm import AsyncWinRmRemoting
+from PyADCSConnector.remoting.prefetch import ScriptPrefetcher
+from PyADCSConnector.remoting.retry import retrying_async
+from PyADCSConnector.remoting.winrm.fake_server import FakeAdcs, FakeWsmanServer
+from PyADCSConnector.remoting.winrm.scripts import get_cas_script, get_templates_script, dump_certificates_script, \
+    dump_certificates_template, identify_certificate_script, submit_certificate_request_script
+from PyADCSConnector.remoting.winrm_remoting import WinRmRemoting, powershell_command
+from PyADCSConnector.services.discovery_history import scan_certificates, scan_units
+from PyADCSConnector.utils.dump_parser import DumpParser, AuthorityData, TemplateData
+
+
+class FakeWsmanServerTest(TestCase):
+    def start(self, ca_count=1, **kwargs):
+        server = FakeWsmanServer(("127.0.0.1", 0), FakeAdcs(ca_count=ca_count, certificate_count=30), **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def session(self, server):
+        return WinRmRemoting("user", "password", "127.0.0.1", port=server.server_address[1], transport="credssp")
+
+    def test_connector_scripts_are_answered_over_credssp(self):
+        server = self.start(chunk_size=1024)
+        with self.session(server) as session:
+            cas = DumpParser.parse_authority_data(session.run_ps(get_cas_script()))
+            templates = DumpParser.parse_template_data(session.run_ps(get_templates_script()))
+            first_page = DumpParser.parse_certificates(
+                session.run_ps(dump_certificates_script(cas[0], templates[0], None, 0, 8)))
+            last_page = DumpParser.parse_certificates(
+                session.run_ps(dump_certificates_script(cas[0], templates[0], None, first_page[-1].request_id, 8)))
+            identified = DumpParser.parse_identified_certificates(
+                session.run_ps(identify_certificate_script("1", cas[0])))
+
+        self.assertEqual([ca.name for ca in cas], ["Fake CA 1"])
+        self.assertEqual(len(templates), 3)
+        self.assertEqual(len(first_page), 8)
+        self.assertEqual(len(last_page), 2)
+        self.assertEqual([certificate.request_id for certificate in first_page + last_page], list(range(1, 31, 3)))
+        self.assertEqual({certificate.template for certificate in first_page}, {templates[0].oid})
+        self.assertEqual(identified[0].certificate_template, templates[0].oid)
+        self.assertEqual(server.stats["handshakes"], 1)
+
+    def test_request_is_sent_to_standard_input(self):
+        key = ec.generate_private_key(ec.SECP256R1())
+        request = (x509.CertificateSigningRequestBuilder()
+                   .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "submitted")]))
+                   .sign(key, hashes.SHA256()))
+        request = base64.b64encode(request.public_bytes(Encoding.DER)).decode()
+        ca = AuthorityData("Fake CA 1", "Fake CA 1", "fake-adcs.local", "fake-adcs.local\\Fake CA 1", "", None,
+                           None, None, None)
+        template = TemplateData("FakeTemplate1", "FakeTemplate1", "2", "100.2", "1.3.6.1.4.1.311.21.8.1000.1")
+        script = submit_certificate_request_script(request, ca, template)
+
+        command, stdin = powershell_command(script)
+        self.assertIs(command, powershell_command(submit_certificate_request_script("other", ca, template))[0])
+        self.assertIn(request.encode(), stdin)
+
+        server = self.start()
+        with self.session(server) as session:
+            result = session.run_ps(script)
+        certificate = x509.load_der_x509_certificate(base64.b64decode(result.std_out))
+        self.assertEqual(certificate.subject.rfc4514_string(), "CN=submitted")
+
+    def test_failure_rate_rejects_commands(self):
+        server = self.start(failure_rate=1.0)
+        with self.session(server) as session:
+            with self.assertRaises(WinRMTransportError) as context:
+                session.run_ps(get_cas_script())
+        self.assertEqual(context.exception.code, 503)
+        self.assertEqual(server.stats["failures"], 1)
+
+    def test_json_output_is_decoded_to_the_same_records(self):
+        server = self.start()
+        with self.session(server) as session:
+            def run_scripts():
+                cas = DumpParser.parse_authority_data(session.run_ps(get_cas_script()))
+                templates = DumpParser.parse_template_data(session.run_ps(get_templates_script()))
+                certificates = DumpParser.parse_certificates(
+                    session.run_ps(dump_certificates_script(cas[0], templates[1], None, 0, 5)))
+                identified = DumpParser.parse_identified_certificates(
+                    session.run_ps(identify_certificate_script("2", cas[0])))
+                return ([ca.to_dict() for ca in cas], [template.to_dict() for template in templates],
+                        [(c.template, c.certificate, c.request_id) for c in certificates],
+                        [(c.certificate_template, c.serial_number, c.config_string) for c in identified])
+
+            listed = run_scripts()
+            with mock.patch("PyADCSConnector.remoting.winrm.scripts.ADCS_SCRIPT_OUTPUT_FORMAT", "json"):
+                self.assertIn("ConvertTo-Json -Compress", get_cas_script())
+                decoded = run_scripts()
+
+        self.assertEqual(decoded, listed)
+        self.assertEqual(len(listed[2]), 5)
+        self.assertIs(listed[0][0]["is_enterprise"], True)
+
+    def test_compressed_dump_returns_the_same_certificates(self):
+        server = self.start(chunk_size=512)
+        ca = AuthorityData("Fake CA 1", "Fake CA 1", "fake-adcs.local", "fake-adcs.local\\Fake CA 1", "", None,
+                           None, None, None)
+        with self.session(server) as session:
+            listed = session.run_ps(dump_certificates_script(ca, None, None, 0, 20))
+            with mock.patch("PyADCSConnector.remoting.winrm.scripts.ADCS_DUMP_COMPRESSION_ENABLED", True):
+                compressed = session.run_ps(dump_certificates_script(ca, None, None, 0, 20))
+
+        self.assertTrue(compressed.std_out.startswith(b"H4sI"))
+        self.assertLess(len(compressed.std_out), len(listed.std_out) / 2)
+        self.assertEqual([(c.template, c.certificate, c.request_id) for c in DumpParser.parse_certificates(compressed)],
+                         [(c.template, c.certificate, c.request_id) for c in DumpParser.parse_certificates(listed)])
+
+    def test_projection_reduces_the_dump_payload(self):
+        adcs = FakeAdcs(certificate_count=50)
+        ca = AuthorityData("Fake CA 1", "Fake CA 1", "fake-adcs.local", "fake-adcs.local\\Fake CA 1", "", None,
+                           None, None, None)
+        script = dump_certificates_script(ca, None, None, 0, 50)
+        default_view = json.loads(script.stdin)
+        del default_view["Properties"]
+
+        _, projected, _ = adcs.run_script(script.template.command_text, script.stdin)
+        _, full, _ = adcs.run_script(script.template.command_text, json.dumps(default_view).encode())
+
+        self.assertNotIn(b"Request.RequesterName", projected)
+        self.assertLess(len(projected) / 50, len(full) / 50 * 0.8)
+        parsed = [[(c.template, c.certificate, c.request_id)
+                   for c in DumpParser.parse_certificates(winrm.Response((output, b"", 0)))]
+                  for output in (projected, full)]
+        self.assertEqual(parsed[0], parsed[1])
+
+    def prefetcher(self, server, depth):
+        def session():
+            return retrying_async(AsyncWinRmRemoting("user", "password", "127.0.0.1", port=server.server_address[1],
+                                                     transport="credssp"), "fake")
+        return ScriptPrefetcher(session, dump_certificates_template(), depth)
+
+    @mock.patch("PyADCSConnector.services.discovery_history.ADCS_SEARCH_PAGE_SIZE", 4)
+    async def test_discovery_scan_continues_after_the_last_request_id(self):
+        server = self.start()
+        ca = AuthorityData("Fake CA 1", "Fake CA 1", "fake-adcs.local", "fake-adcs.local\\Fake CA 1", "", None,
+                           None, None, None)
+        template = TemplateData("FakeTemplate1", "FakeTemplate1", "2", "100.2", "1.3.6.1.4.1.311.21.8.1000.1")
+        last_request_ids = {}
+        async with self.prefetcher(server, 0) as prefetcher:
+            pages = [page async for page in scan_certificates(prefetcher, ca, template, None, last_request_ids)]
+        certificates = [certificate for page in pages for certificate in page]
+
+        self.assertEqual([certificate.request_id for certificate in certificates], list(range(1, 31, 3)))
+        self.assertEqual(last_request_ids, {("Fake CA 1", "FakeTemplate1"): 28})
+        self.assertEqual(server.stats["commands"], 3)
+
+    @mock.patch("PyADCSConnector.services.discovery_history.ADCS_SEARCH_PAGE_SIZE", 4)
+    async def test_prefetch_starts_the_next_page_during_the_current_one(self):
+        server = self.start(latency=0.3)
+        ca = AuthorityData("Fake CA 1", "Fake CA 1", "fake-adcs.local", "fake-adcs.local\\Fake CA 1", "", None,
+                           None, None, None)
+        template = TemplateData("FakeTemplate1", "FakeTemplate1", "2", "100.2", "1.3.6.1.4.1.311.21.8.1000.1")
+        started = time.monotonic()
+        async with self.prefetcher(server, 2) as prefetcher:
+            certificates = [certificate async for page in scan_certificates(prefetcher, ca, template, None, {})
+                            for certificate in page]
+        elapsed = time.monotonic() - started
+
+        self.assertEqual([certificate.request_id for certificate in certificates], list(range(1, 31, 3)))
+        # the two pages after the last one were started ahead and terminated before they read their input
+        self.assertEqual(server.stats["commands"], 5)
+        self.assertEqual(server.stats["action:Send"], 3)
+        self.assertEqual(server.stats["action:Signal"], 5)
+        # the sequential scan waits for the start of every one of the three processes
+        self.assertLess(elapsed, 0.75)
+
+    @mock.patch("PyADCSConnector.services.discovery_history.ADCS_SEARCH_PAGE_SIZE", 4)
+    async def test_discovery_scans_the_cas_and_templates_in_parallel(self):
+        server = self.start(ca_count=2, latency=0.2)
+        cas = [AuthorityData(name, name, "fake-adcs.local", "fake-adcs.local\\" + name, "", None, None, None, None)
+               for name in ("Fake CA 1", "Fake CA 2", "Missing CA")]
+        templates = [TemplateData("FakeTemplate%d" % i, "FakeTemplate%d" % i, "2", "100.2",
+                                  "1.3.6.1.4.1.311.21.8.1000.%d" % i) for i in (1, 2)]
+        units = [(ca, template) for ca in cas for template in templates]
+        pages = []
+        started = time.monotonic()
+        async with self.prefetcher(server, 0) as prefetcher:
+            failures = await scan_units(prefetcher, units, None, 4, lambda page: asyncio.sleep(0, pages.append(page)))
+        certificates = [certificate for _, page in pages for certificate in page or []]
+        elapsed = time.monotonic() - started
+
+        # every of the four available combinations reads ten certificates in three pages
+        self.assertEqual(len(certificates), 40)
+        self.assertEqual(len({certificate.certificate for certificate in certificates}), 40)
+        self.assertEqual(list(failures), [("Missing CA", "FakeTemplate1"), ("Missing CA", "FakeTemplate2")])
+        self.assertTrue(all(failure.startswith("Missing CA/FakeTemplate") for failure in failures.values()))
+        self.assertIn("not available", failures[("Missing CA", "FakeTemplate1")])
+        # the end of every available combination follows its pages
+        self.assertEqual(sum(1 for _, page in pages if page is None), 4)
+        # the sequential scan would wait for the start of 14 processes
+        self.assertLess(elapsed, 14 * 0.2 / 2)
+
+    @mock.patch("PyADCSConnector.services.discovery_history.ADCS_SEARCH_PAGE_SIZE", 4)
+    async def test_full_queue_stops_the_scan(self):
+        server = self.start()
+        ca = AuthorityData("Fake CA 1", "Fake CA 1", "fake-adcs.local", "fake-adcs.local\\Fake CA 1", "", None,
+                           None, None, None)
+        pages = asyncio.Queue(1)
+        async with self.prefetcher(server, 0) as prefetcher:
+            scan = asyncio.ensure_future(scan_units(prefetcher, [(ca, None)], None, 1, pages.put))
+            await asyncio.sleep(0.3)
+            # the first page waits in the queue and the second one for a free place in it
+            self.assertEqual(server.stats["commands"], 2)
+            self.assertFalse(scan.done())
+
+            received = []
+            while len(received) < 9:
+                received.append(await pages.get())
+            self.assertEqual(await scan, {})
+
+        self.assertEqual([len(page) for _, page in received[:-1]], [4] * 7 + [2])
+        self.assertEqual(received[-1], (("Fake CA 1", None), None))
+        self.assertEqual(server.stats["commands"], 8)
@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from PyADCSConnector.exceptions.winrm_execution_exception import WinRMExecutionException
+from PyADCSConnector.remoting.psrp_remoting import PsrpRemoting
+from PyADCSConnector.remoting.winrm.scripts import get_templates_script, strip_prelude, IMPORT_MODULE, \
+    submit_certificate_request_script, IMPORTS, psrp_runspace_initialization_script
+from PyADCSConnector.utils.dump_parser import AuthorityData, TemplateData
+
+
+class FakePowerShell:
+    scripts = []
+    local_scopes = []
+    output = []
+    errors = []
+    had_errors = False
+
+    def __init__(self, runspace_pool):
+        self.streams = mock.Mock(error=FakePowerShell.errors)
+        self.had_errors = FakePowerShell.had_errors
+
+    def add_script(self, script, use_local_scope=None):
+        FakePowerShell.scripts.append(script)
+        FakePowerShell.local_scopes.append(use_local_scope)
+        return self
+
+    def add_command(self, command):
+        return self
+
+    def add_parameter(self, name, value):
+        return self
+
+    def invoke(self):
+        return FakePowerShell.output
+
+
+class PsrpRemotingTest(TestCase):
+    def setUp(self):
+        FakePowerShell.scripts = []
+        FakePowerShell.local_scopes = []
+        FakePowerShell.output = []
+        FakePowerShell.errors = []
+        FakePowerShell.had_errors = False
+
+    def test_strip_prelude(self):
+        script = get_templates_script()
+        self.assertTrue(script.startswith(IMPORT_MODULE))
+        self.assertTrue(strip_prelude(script).startswith("$TemplateList = @()"))
+
+        ca = AuthorityData("CA", "CA", "host", "host\\CA", "", None, None, None, None)
+        template = TemplateData("WebServer", "Web Server", "1", "4.1", "1.2.3")
+        script = submit_certificate_request_script("MIIC-REQUEST", ca, template)
+        self.assertTrue(script.startswith(IMPORTS))
+        # the values are passed apart from the script text
+        self.assertTrue(strip_prelude(script).startswith("$config = $params.ConfigString"))
+        self.assertNotIn("MIIC-REQUEST", script)
+        self.assertEqual(script.parameters["ConfigString"], "host\\CA")
+        self.assertEqual(script.parameters["Request"], "MIIC-REQUEST")
+
+    @mock.patch("PyADCSConnector.remoting.psrp_remoting.PowerShell", FakePowerShell)
+    def test_run_ps_in_runspace(self):
+        FakePowerShell.output = ["Name : WebServer\r\n", "OID  : 1.2.3\r\n"]
+        session = PsrpRemoting("user", "password", "host")
+        result = session.run_ps(get_templates_script())
+
+        self.assertNotIn("Import-Module PSPKI", FakePowerShell.scripts[0])
+        self.assertEqual(FakePowerShell.local_scopes, [True])
+        self.assertEqual(result.status_code, 0)
+        self.assertEqual(result.std_out, b"Name : WebServer\r\nOID  : 1.2.3\r\n")
+
+    @mock.patch("PyADCSConnector.remoting.psrp_remoting.PowerShell", FakePowerShell)
+    def test_run_ps_failure(self):
+        FakePowerShell.had_errors = True
+        FakePowerShell.errors = ["Timeout waiting for certificate"]
+        session = PsrpRemoting("user", "password", "host")
+        with self.assertRaises(WinRMExecutionException) as context:
+            session.run_ps(get_templates_script())
+        self.assertEqual(context.exception.std_err, "Timeout waiting for certificate")
+
+    def test_runspace_initialization_passes_other_parameters_to_pspki(self):
+        script = psrp_runspace_initialization_script(60)
+        self.assertIn("'^-(ComputerName|Name):?$'", script)
+        self.assertIn("return PSPKI\\Get-CertificationAuthority @args", script)
+        self.assertIn("AddSeconds(60)", script)
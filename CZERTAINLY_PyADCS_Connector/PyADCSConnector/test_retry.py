@@ -0,0 +1,82 @@
+from django.test import TestCase
+from winrm.exceptions import WinRMOperationTimeoutError, WinRMTransportError
+
+from PyADCSConnector.exceptions.winrm_execution_exception import WinRMExecutionException
+from PyADCSConnector.remoting.retry import RetryingSession, AsyncRetryingSession, RetryPolicy, RetryBudget, \
+    is_transient
+
+
+class FlakySession:
+    """fails the first runs of a script with the given errors"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.runs = 0
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+
+    def run_ps(self, script):
+        self.runs += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+    def disconnect(self):
+        pass
+
+
+class AsyncFlakySession(FlakySession):
+    async def connect(self):
+        super().connect()
+
+    async def run_ps(self, script):
+        return super().run_ps(script)
+
+    async def disconnect(self):
+        pass
+
+
+class RetryTest(TestCase):
+    policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+
+    def test_idempotent_script_is_retried_on_new_connection(self):
+        session = FlakySession(ConnectionResetError("reset"), WinRMTransportError("http", 503, "unavailable"))
+        with RetryingSession(session, self.policy, RetryBudget("authority")) as retrying:
+            self.assertEqual(retrying.run_ps("Get-CertificationAuthority", idempotent=True), "ok")
+        self.assertEqual(session.runs, 3)
+        self.assertEqual(session.connects, 3)
+
+    def test_non_idempotent_script_is_not_retried(self):
+        session = FlakySession(ConnectionResetError("reset"))
+        with self.assertRaises(ConnectionResetError):
+            with RetryingSession(session, self.policy, RetryBudget("authority")) as retrying:
+                retrying.run_ps("Submit-CertificateRequest")
+        self.assertEqual(session.runs, 1)
+
+    def test_attempts_and_budget_are_limited(self):
+        session = FlakySession(*[WinRMOperationTimeoutError()] * 5)
+        retrying = RetryingSession(session, self.policy, RetryBudget("authority"))
+        with self.assertRaises(WinRMOperationTimeoutError):
+            retrying.run_ps("Get-CertificationAuthority", idempotent=True)
+        self.assertEqual(session.runs, 3)
+
+        budget = RetryBudget("authority", ratio=0.5, capacity=1)
+        session = FlakySession(*[ConnectionResetError("reset")] * 5)
+        retrying = RetryingSession(session, self.policy, budget)
+        with self.assertRaises(ConnectionResetError):
+            retrying.run_ps("Get-CertificationAuthority", idempotent=True)
+        self.assertEqual(session.runs, 2)
+        self.assertEqual(budget.stats()["exhausted"], 1)
+
+    def test_failed_script_and_client_errors_are_not_transient(self):
+        self.assertFalse(is_transient(WinRMExecutionException(1, "Access denied")))
+        self.assertFalse(is_transient(WinRMTransportError("http", 400, "bad request")))
+        self.assertTrue(is_transient(WinRMTransportError("http", 500, "error")))
+
+    async def test_coroutine_is_retried(self):
+        session = AsyncFlakySession(ConnectionResetError("reset"))
+        async with AsyncRetryingSession(session, self.policy, RetryBudget("authority")) as retrying:
+            self.assertEqual(await retrying.run_ps("Get-CertificationAuthority", idempotent=True), "ok")
+        self.assertEqual(session.runs, 2)
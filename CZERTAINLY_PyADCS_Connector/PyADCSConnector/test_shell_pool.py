@@ -0,0 +1,107 @@
+from django.test import TestCase
+from winrm.exceptions import WSManFaultError
+
+from PyADCSConnector.exceptions.remoting_exception import RemotingException
+from PyADCSConnector.remoting.shell_pool import ShellPool, ShellQuota
+
+
+class FakeSession:
+    def __init__(self, fail_connect=None, alive=True):
+        self.fail_connect = fail_connect
+        self.alive = alive
+        self.connected = False
+
+    def connect(self):
+        if self.fail_connect:
+            raise self.fail_connect
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def is_alive(self):
+        return self.alive
+
+
+def quota_fault():
+    return WSManFaultError(400, "Bad HTTP response returned from server. Code 400", "",
+                           "This user is allowed a maximum number of 1 concurrent shells, which has been exceeded.")
+
+
+class ShellPoolTest(TestCase):
+    def create_pool(self, factory=FakeSession, quota=None, **kwargs):
+        return ShellPool("authority", factory, quota or ShellQuota(10), ("host", "user"), **kwargs)
+
+    def test_reuses_released_shell(self):
+        pool = self.create_pool()
+        shell = pool.acquire(1)
+        pool.release(shell)
+        self.assertIs(pool.acquire(1), shell)
+        self.assertEqual(pool.stats()["created"], 1)
+        self.assertEqual(pool.stats()["reused"], 1)
+
+    def test_acquire_times_out_when_pool_is_exhausted(self):
+        pool = self.create_pool(max_size=1)
+        pool.acquire(1)
+        with self.assertRaises(RemotingException):
+            pool.acquire(0)
+
+    def test_discarded_shell_is_closed(self):
+        pool = self.create_pool()
+        shell = pool.acquire(1)
+        pool.release(shell, discard=True)
+        self.assertFalse(shell.session.connected)
+        self.assertEqual(pool.size(), 0)
+
+    def test_dead_shell_is_replaced(self):
+        pool = self.create_pool(liveness_check_after=-1)
+        shell = pool.acquire(1)
+        shell.session.alive = False
+        pool.release(shell)
+        self.assertIsNot(pool.acquire(1), shell)
+        self.assertEqual(pool.stats()["created"], 2)
+
+    def test_idle_shells_are_evicted_down_to_min_size(self):
+        pool = self.create_pool(min_size=1, idle_timeout=-1)
+        first = pool.acquire(1)
+        second = pool.acquire(1)
+        pool.release(first)
+        pool.release(second)
+        pool.acquire(1)
+        self.assertEqual(pool.stats()["evicted"], 1)
+        self.assertFalse(first.session.connected)
+
+    def test_quota_is_shared_between_pools(self):
+        quota = ShellQuota(1)
+        first_pool = self.create_pool(quota=quota)
+        second_pool = self.create_pool(quota=quota)
+        shell = first_pool.acquire(1)
+        with self.assertRaises(RemotingException):
+            second_pool.acquire(0)
+        first_pool.release(shell, discard=True)
+        self.assertIsNotNone(second_pool.acquire(1))
+
+    def test_quota_fault_lowers_ceiling(self):
+        sessions = [FakeSession(), FakeSession(fail_connect=quota_fault())]
+        pool = self.create_pool(factory=lambda: sessions.pop(0))
+        pool.acquire(1)
+        with self.assertRaises(RemotingException):
+            pool.acquire(0)
+        self.assertEqual(pool.stats()["ceiling"], 1)
+
+    def test_lowered_ceiling_recovers_after_quiet_period(self):
+        sessions = [FakeSession(), FakeSession(fail_connect=quota_fault()), FakeSession()]
+        pool = self.create_pool(factory=lambda: sessions.pop(0), max_size=3, ceiling_recovery_interval=0)
+        pool.acquire(1)
+        pool.acquire(0)
+        self.assertEqual(pool.stats()["ceiling"], 2)
+        self.assertEqual(pool.stats()["created"], 2)
+
+    def test_prewarm_opens_min_size_shells(self):
+        pool = self.create_pool(min_size=2)
+        pool.prewarm()
+        self.assertEqual(pool.stats()["idle"], 2)
+        pool.prewarm()
+        self.assertEqual(pool.stats()["created"], 2)
+        self.assertTrue(pool.acquire(1).session.connected)
+        self.assertEqual(pool.stats()["reused"], 1)
@@ -1,7 +1,10 @@
+import base64
+import gzip
+
 import winrm
 from django.test import TestCase
 
-from PyADCSConnector.utils.dump_parser import DumpParser
+from PyADCSConnector.utils.dump_parser import DumpParser, CertificateDumpParser
 
 
 class DumpParserTest(TestCase):
@@ -245,6 +248,13 @@ Properties                 : {[RequestID, 789], [Request.StatusCode, 0], [Reques
         self.assertEqual(len(templates), 5)
         self.assertEqual(templates[2].template, "WebServer")
 
+        # the same certificates are parsed when the output is received in small chunks
+        parser = CertificateDumpParser()
+        chunks = [result.std_out[i:i + 7] for i in range(0, len(result.std_out), 7)]
+        streamed = [certificate for chunk in chunks for certificate in parser.feed(chunk)] + parser.close()
+        self.assertEqual([(c.template, c.certificate) for c in streamed],
+                         [(c.template, c.certificate) for c in templates])
+
     def test_parse_template(self):
         data = """
         
@@ -450,3 +460,60 @@ ServiceStatus :
         self.assertEqual(templates[0].is_root, False)
         self.assertEqual(templates[0].is_accessible, False)
         self.assertEqual(templates[0].service_status, "")
+
+    def test_parse_json_output(self):
+        data = (
+            '{"Name":"3KEY-LAB-CA1","DisplayName":"3KEY-LAB-CA1","ComputerName":"labca1.3key.local",'
+            '"ConfigString":"labca1.3key.local\\\\3KEY-LAB-CA1","Type":"Enterprise Root CA","IsEnterprise":true,'
+            '"IsRoot":true,"IsAccessible":false,"ServiceStatus":"Running"}\r\n'
+            '{"Name":"Demo MS Sub CA","DisplayName":"Demo MS Sub CA","ComputerName":"vmi307469.3key.local",'
+            '"ConfigString":"vmi307469.3key.local\\\\Demo MS Sub CA","Type":"","IsEnterprise":false,'
+            '"IsRoot":false,"IsAccessible":true,"ServiceStatus":""}\r\n'
+        )
+        result = winrm.Response((bytes(data, 'utf-8'), b"", 0))
+        authorities = DumpParser.parse_authority_data(result)
+        self.assertEqual(len(authorities), 2)
+        self.assertEqual(authorities[0].config_string, "labca1.3key.local\\3KEY-LAB-CA1")
+        self.assertEqual(authorities[0].is_root, True)
+        self.assertEqual(authorities[1].is_accessible, True)
+        self.assertEqual(authorities[1].ca_type, "")
+
+        data = ('{"Name":"WebServer","DisplayName":"Web Server","SchemaVersion":"1","Version":"4.1",'
+                '"OID":"1.3.6.1.4.1.311.21.8.1.2"}\r\n')
+        templates = DumpParser.parse_template_data(winrm.Response((bytes(data, 'utf-8'), b"", 0)))
+        self.assertEqual([(t.name, t.schema_version, t.oid) for t in templates],
+                         [("WebServer", "1", "1.3.6.1.4.1.311.21.8.1.2")])
+
+        data = ('{"SerialNumber":"180000032a9a1aac7197589cef00000000032a","CertificateTemplate":"WebServer",'
+                '"ConfigString":"vmi307469.3key.local\\\\Demo MS Sub CA"}\r\n')
+        identified = DumpParser.parse_identified_certificates(winrm.Response((bytes(data, 'utf-8'), b"", 0)))
+        self.assertEqual(identified[0].serial_number, "180000032a9a1aac7197589cef00000000032a")
+        self.assertEqual(identified[0].config_string, "vmi307469.3key.local\\Demo MS Sub CA")
+
+        data = ('{"CertificateTemplate":"WebServer","RawCertificate":"MIIB\\r\\nAAAA\\r\\n"}\r\n'
+                '{"CertificateTemplate":"User","RawCertificate":"MIIC"}\r\n')
+        parser = CertificateDumpParser()
+        chunks = [data.encode()[i:i + 7] for i in range(0, len(data), 7)]
+        certificates = [certificate for chunk in chunks for certificate in parser.feed(chunk)] + parser.close()
+        self.assertEqual([(c.template, c.certificate) for c in certificates],
+                         [("WebServer", "MIIBAAAA"), ("User", "MIIC")])
+
+    def test_parse_compressed_certificates(self):
+        records = ('{"CertificateTemplate":"WebServer","RawCertificate":"MIIBAAAA"}\n'
+                   '{"CertificateTemplate":"User","RawCertificate":"MIIC"}\n')
+        encoded = base64.encodebytes(gzip.compress(records.encode())).replace(b"\n", b"\r\n")
+        result = winrm.Response((encoded, b"", 0))
+        certificates = DumpParser.parse_certificates(result)
+        self.assertEqual([(c.template, c.certificate) for c in certificates],
+                         [("WebServer", "MIIBAAAA"), ("User", "MIIC")])
+
+        parser = CertificateDumpParser()
+        chunks = [encoded[i:i + 3] for i in range(0, len(encoded), 3)]
+        streamed = [certificate for chunk in chunks for certificate in parser.feed(chunk)] + parser.close()
+        self.assertEqual([(c.template, c.certificate) for c in streamed],
+                         [(c.template, c.certificate) for c in certificates])
+
+        parser = CertificateDumpParser()
+        parser.feed(encoded[:len(encoded) // 2])
+        with self.assertRaises(ValueError):
+            parser.close()
@@ -0,0 +1,112 @@
+import json
+import logging
+
+from django.db import connections, router, transaction
+from django.db.models import BinaryField, JSONField
+
+logger = logging.getLogger(__name__)
+
+# characters escaped in the text format of COPY
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+_COPY_NULL = "\\N"
+
+
+def bulk_insert(model, objects, batch_size, ignore_conflicts=False):
+    """
+    Inserts the objects of the model, the iterable is consumed lazily. PostgreSQL receives the rows as a stream with
+    COPY FROM STDIN in one statement, other databases and drivers without COPY use bulk_create in batches.
+    The rows conflicting with the existing ones are skipped when ignore_conflicts is set.
+    Returns the number of inserted rows, bulk_create counts the skipped rows too.
+    """
+    connection = connections[router.db_for_write(model)]
+    fields = [field for field in model._meta.concrete_fields if field is not model._meta.auto_field]
+    with connection.cursor() as cursor:
+        # the django cursor wrapper does not expose copy_expert, the driver cursor does
+        driver_cursor = getattr(cursor, "cursor", cursor)
+        if connection.vendor == "postgresql" and hasattr(driver_cursor, "copy_expert"):
+            reader = CopyReader(copy_line(connection, fields, obj) for obj in objects)
+            if not ignore_conflicts:
+                driver_cursor.copy_expert(copy_statement(connection, model._meta.db_table, fields), reader)
+                return reader.rows
+            return copy_ignoring_conflicts(connection, cursor, driver_cursor, model, fields, reader)
+
+    logger.debug("COPY is not available on %s, inserting %s in batches" % (connection.vendor, model.__name__))
+    count = 0
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            count += len(model.objects.bulk_create(batch, batch_size=batch_size, ignore_conflicts=ignore_conflicts))
+            batch = []
+    if batch:
+        count += len(model.objects.bulk_create(batch, batch_size=batch_size, ignore_conflicts=ignore_conflicts))
+    return count
+
+
+def copy_ignoring_conflicts(connection, cursor, driver_cursor, model, fields, reader):
+    """COPY can not skip the existing rows, they are copied into a temporary table and inserted from it"""
+    table = model._meta.db_table
+    temporary_table = connection.ops.quote_name("bulk_insert_%s" % model._meta.model_name)
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    # the temporary table is dropped by the rollback when the COPY fails
+    with transaction.atomic(using=connection.alias):
+        cursor.execute("CREATE TEMPORARY TABLE %s (LIKE %s INCLUDING DEFAULTS)" % (temporary_table, table))
+        driver_cursor.copy_expert(copy_statement(connection, temporary_table, fields), reader)
+        cursor.execute("INSERT INTO %s (%s) SELECT %s FROM %s ON CONFLICT DO NOTHING"
+                       % (table, columns, columns, temporary_table))
+        count = cursor.rowcount
+        cursor.execute("DROP TABLE %s" % temporary_table)
+    return count
+
+
+def copy_statement(connection, table, fields):
+    # the table name of the models already contains the quoted schema
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    return "COPY %s (%s) FROM STDIN" % (table, columns)
+
+
+def copy_line(connection, fields, obj):
+    """formats the object as a line of the text format of COPY"""
+    values = []
+    for field in fields:
+        value = field.pre_save(obj, True)
+        if value is None:
+            values.append(_COPY_NULL)
+            continue
+        if isinstance(field, JSONField):
+            value = json.dumps(value, cls=field.encoder)
+        elif isinstance(field, BinaryField):
+            # the hex format of bytea with its backslash escaped, the hex digits need no escaping
+            values.append("\\\\x" + bytes(value).hex())
+            continue
+        else:
+            value = field.get_db_prep_save(value, connection)
+        values.append(str(value).translate(_COPY_ESCAPES))
+    return "\t".join(values) + "\n"
+
+
+class CopyReader(object):
+    """file like object reading the lines produced by the iterator, as the input of COPY FROM STDIN"""
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.rows = 0
+        self._buffer = b""
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            line = line.encode("utf-8")
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+        data = b"".join(chunks)
+        if size < 0:
+            self._buffer = b""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
@@ -0,0 +1,57 @@
+import collections
+import time
+
+
+class DiscoveryProgress(object):
+    """
+    Progress of a running discovery. The scans report the finished CA and template combinations, the writer the
+    persisted pages, and the writer stores the snapshot with every committed page.
+    """
+
+    def __init__(self, units):
+        self.started = time.monotonic()
+        self.units_total = len(units)
+        self.units_done = 0
+        self.units_resumed = 0
+        self.pages_done = 0
+        self.certificates = 0
+        self.certificates_resumed = 0
+        # number of combinations of every CA that are not finished yet
+        self._remaining = collections.Counter(ca.name for ca, _ in units)
+
+    def unit_done(self, ca):
+        self.units_done += 1
+        self._remaining[ca.name] -= 1
+
+    def resume(self, completed, certificates, pages_done):
+        """counts the combinations and pages committed before the discovery was interrupted"""
+        for ca, _ in completed:
+            self.unit_done(ca)
+        self.units_resumed = len(completed)
+        self.certificates = certificates
+        self.certificates_resumed = certificates
+        self.pages_done = pages_done
+
+    def page_done(self, count):
+        self.pages_done += 1
+        self.certificates += count
+
+    def to_dict(self):
+        elapsed = time.monotonic() - self.started
+        # the rate and the estimate count only the work done since the discovery was started or resumed
+        certificates = self.certificates - self.certificates_resumed
+        # the number of certificates of the remaining combinations is not known, they are expected to take as long
+        # as the ones finished
+        eta = None
+        if self.units_done > self.units_resumed:
+            eta = round(elapsed * (self.units_total - self.units_done) / (self.units_done - self.units_resumed))
+        return {
+            "casDone": sum(1 for remaining in self._remaining.values() if remaining == 0),
+            "casTotal": len(self._remaining),
+            "unitsDone": self.units_done,
+            "unitsTotal": self.units_total,
+            "pagesDone": self.pages_done,
+            "certificatesPersisted": self.certificates,
+            "certificatesPerSecond": round(certificates / elapsed, 1) if elapsed > 0 else 0,
+            "etaSeconds": eta,
+        }
@@ -1,7 +1,22 @@
+import base64
+import codecs
+import json
+import zlib
+
+# beginning of the base64 encoded gzip header written by the compressed dump script
+GZIP_BASE64_MAGIC = b"H4sI"
+
+
 class ParseResult:
-    def __init__(self, template, certificate):
+    def __init__(self, template, certificate, request_id=None):
         self.template = template
         self.certificate = certificate
+        self.request_id = request_id
+
+    @staticmethod
+    def from_json(record):
+        return ParseResult(record["CertificateTemplate"], strip_certificate(record["RawCertificate"]),
+                           record.get("RequestID"))
 
 
 class IdentifiedCertificate:
@@ -10,6 +25,10 @@ class IdentifiedCertificate:
         self.serial_number = serial_number
         self.config_string = config_string
 
+    @staticmethod
+    def from_json(record):
+        return IdentifiedCertificate(record["CertificateTemplate"], record["SerialNumber"], record["ConfigString"])
+
 
 class TemplateData:
     def __init__(self, name, display_name, schema_version, version, oid):
@@ -38,6 +57,11 @@ class TemplateData:
             oid=template["oid"])
         return template_data
 
+    @staticmethod
+    def from_json(record):
+        return TemplateData(record["Name"], record["DisplayName"], record["SchemaVersion"], record["Version"],
+                            record["OID"])
+
     @staticmethod
     def from_dicts(templates):
         template_data = []
@@ -86,6 +110,12 @@ class AuthorityData:
             service_status=authority["service_status"])
         return authority_data
 
+    @staticmethod
+    def from_json(record):
+        return AuthorityData(
+            record["Name"], record["DisplayName"], record["ComputerName"], record["ConfigString"], record["Type"],
+            record["IsEnterprise"], record["IsRoot"], record["IsAccessible"], record["ServiceStatus"])
+
     @staticmethod
     def from_dicts(authorities):
         authority_data = []
@@ -97,40 +127,14 @@ class AuthorityData:
 class DumpParser:
     @staticmethod
     def parse_certificates(input_data):
-        input_string = input_data.std_out.decode('utf-8')
-        lines = input_string.strip().split('\n')
-        result = []
-        in_cert = False
-        cert = []
-        template = ""
-
-        for line in lines:
-            if in_cert and line.startswith("      "):
-                cert.append(line.strip())
-            elif line.startswith("CertificateTemplate "):  # the space is important
-                template = get_value_from_line(line)
-            elif line.startswith("RawCertificate "):
-                # first line
-                cert.append(get_value_from_line(line))
-                in_cert = True
-            else:
-                if in_cert:
-                    # cert_data = "-----BEGIN CERTIFICATE-----\n" + "\n".join(cert) + "\n-----END CERTIFICATE-----"
-                    cert_data = ("".join(cert)
-                                 .replace("-----BEGIN CERTIFICATE-----", "")
-                                 .replace("-----END CERTIFICATE-----", "")
-                                 .replace("\r", "")
-                                 .replace("\n", ""))
-                    result.append(ParseResult(template, cert_data))
-                    cert = []
-                    template = ""
-                in_cert = False
-
-        return result
+        parser = CertificateDumpParser()
+        return parser.feed(input_data.std_out.strip()) + parser.close()
 
     @staticmethod
     def parse_identified_certificates(input_data):
         input_string = input_data.std_out.decode('utf-8')
+        if is_json_output(input_string):
+            return [IdentifiedCertificate.from_json(record) for record in parse_json_records(input_string)]
         lines = input_string.strip().split('\n')
         result = []
         complete_record = False
@@ -159,6 +163,8 @@ class DumpParser:
     @staticmethod
     def parse_template_data(input_data):
         input_string = input_data.std_out.decode('utf-8')
+        if is_json_output(input_string):
+            return [TemplateData.from_json(record) for record in parse_json_records(input_string)]
         lines = input_string.strip().split('\n')
         result = []
         complete_record = False
@@ -195,6 +201,8 @@ class DumpParser:
     @staticmethod
     def parse_authority_data(input_data):
         input_string = input_data.std_out.decode('utf-8')
+        if is_json_output(input_string):
+            return [AuthorityData.from_json(record) for record in parse_json_records(input_string)]
         lines = input_string.strip().split('\n')
         result = []
         complete_record = False
@@ -247,6 +255,147 @@ class DumpParser:
         return result
 
 
+class CertificateDumpParser:
+    """
+    Incremental variant of DumpParser.parse_certificates. The output of the dump script is fed in chunks as it
+    is received and the certificates are returned as soon as their RawCertificate block is complete, so only
+    the current line and the current certificate are kept in memory. The output of the compressed dump script is
+    recognized by its beginning and inflated as it is fed.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._pending = ""
+        self._in_cert = False
+        self._cert = []
+        self._template = ""
+        self._request_id = None
+        # beginning of the output kept until its format is known
+        self._head = b""
+        self._inflater = None
+
+    def feed(self, data):
+        """parses the next chunk of the output, returns the list of certificates completed by the chunk"""
+        if self._head is not None:
+            self._head += data
+            if len(self._head.lstrip()) < len(GZIP_BASE64_MAGIC):
+                return []
+            data = self._detect_format()
+        if self._inflater is not None:
+            data = self._inflater.feed(data)
+        return self._feed_text(data)
+
+    def close(self):
+        """parses the rest of the output, returns the remaining certificates"""
+        result = []
+        if self._head is not None:
+            result.extend(self.feed(self._detect_format()))
+        if self._inflater is not None:
+            result.extend(self._feed_text(self._inflater.close()))
+        text = self._pending + self._decoder.decode(b"", final=True)
+        self._pending = ""
+        for line in text.split('\n') + [""]:
+            certificate = self._parse_line(line)
+            if certificate is not None:
+                result.append(certificate)
+        return result
+
+    def _detect_format(self):
+        data, self._head = self._head, None
+        if data.lstrip().startswith(GZIP_BASE64_MAGIC):
+            self._inflater = GzipBase64Decoder()
+        return data
+
+    def _feed_text(self, data):
+        text = self._pending + self._decoder.decode(data)
+        lines = text.split('\n')
+        # the last line is not complete yet
+        self._pending = lines.pop()
+
+        result = []
+        for line in lines:
+            certificate = self._parse_line(line)
+            if certificate is not None:
+                result.append(certificate)
+        return result
+
+    def _parse_line(self, line):
+        if line.startswith("{"):
+            # one record of the JSON output
+            return ParseResult.from_json(json.loads(line))
+        if self._in_cert and line.startswith("      "):
+            self._cert.append(line.strip())
+        elif line.startswith("RequestID "):
+            self._request_id = int(get_value_from_line(line))
+        elif line.startswith("CertificateTemplate "):  # the space is important
+            self._template = get_value_from_line(line)
+        elif line.startswith("RawCertificate "):
+            # first line
+            self._cert.append(get_value_from_line(line))
+            self._in_cert = True
+        else:
+            result = None
+            if self._in_cert:
+                # cert_data = "-----BEGIN CERTIFICATE-----\n" + "\n".join(cert) + "\n-----END CERTIFICATE-----"
+                result = ParseResult(self._template, strip_certificate("".join(self._cert)), self._request_id)
+                self._cert = []
+                self._template = ""
+                self._request_id = None
+            self._in_cert = False
+            return result
+        return None
+
+
+class GzipBase64Decoder:
+    """Incremental decoder of gzip data encoded in base64, the whitespace between the base64 lines is ignored"""
+
+    def __init__(self):
+        self._encoded = b""
+        self._inflater = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+
+    def feed(self, data):
+        """returns the inflated data of the chunk, a partial base64 quantum is kept for the next chunk"""
+        self._encoded += b"".join(data.split())
+        complete = len(self._encoded) - len(self._encoded) % 4
+        encoded, self._encoded = self._encoded[:complete], self._encoded[complete:]
+        return self._inflater.decompress(base64.b64decode(encoded))
+
+    def close(self):
+        if self._encoded:
+            raise ValueError("Compressed output ends with an incomplete base64 block")
+        data = self._inflater.flush()
+        if not self._inflater.eof:
+            raise ValueError("Compressed output is truncated")
+        return data
+
+
+def strip_certificate(data):
+    return (data
+            .replace("-----BEGIN CERTIFICATE-----", "")
+            .replace("-----END CERTIFICATE-----", "")
+            .replace("\r", "")
+            .replace("\n", ""))
+
+
+def is_json_output(text):
+    return text.lstrip().startswith(("{", "["))
+
+
+def parse_json_records(text):
+    """
+    Decodes the output of the JSON scripts, a record on every line, in a single pass of the JSON decoder. A line
+    with an array of records is accepted as well.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    records = []
+    for value in json.loads("[" + ",".join(lines) + "]"):
+        if isinstance(value, list):
+            records.extend(value)
+        else:
+            records.append(value)
+    return records
+
+
 def get_value_from_line(line):
     _, value = map(str.strip, line.split(":", 1))
     return value
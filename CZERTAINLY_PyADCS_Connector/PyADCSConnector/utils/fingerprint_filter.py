@@ -0,0 +1,33 @@
+import hashlib
+import math
+
+
+def certificate_fingerprint(der):
+    """hex SHA-256 of the DER of the certificate"""
+    return hashlib.sha256(der).hexdigest()
+
+
+class FingerprintFilter(object):
+    """
+    Bloom filter of certificate fingerprints. A fingerprint that was not added is reported as missing, except for
+    the false positives at the error rate while the filter holds at most the capacity, so a positive answer must be
+    confirmed. The fingerprints are SHA-256 digests, their bytes are used as the hashes.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / max(1, capacity) * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, fingerprint):
+        digest = bytes.fromhex(fingerprint)
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:16], "big") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, fingerprint):
+        for position in self._positions(fingerprint):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, fingerprint):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(fingerprint))
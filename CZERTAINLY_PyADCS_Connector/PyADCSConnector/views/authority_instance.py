@@ -5,6 +5,10 @@ from django.http import JsonResponse, HttpResponse
 from django.views.decorators.http import require_http_methods
 
 from PyADCSConnector.models.authority_instance import AuthorityInstance
+from PyADCSConnector.remoting.async_winrm import close_async_shell_pool
+from PyADCSConnector.remoting.circuit_breaker import reset_circuit_breaker
+from PyADCSConnector.remoting.remoting_loop import submit
+from PyADCSConnector.remoting.winrm_remoting import close_shell_pool
 from PyADCSConnector.serializers.authority_instance_serializer import AuthorityInstanceSerializer
 from PyADCSConnector.services.authority_instance import create_authority_instance, update_authority_instance
 
@@ -36,6 +40,9 @@ def authority_instance_operations(request, uuid, *args, **kwargs):
     elif request.method == "DELETE":
         try:
             AuthorityInstance.objects.get(uuid=uuid).delete()
+            close_shell_pool(uuid)
+            submit(close_async_shell_pool(uuid))
+            reset_circuit_breaker(uuid)
             return HttpResponse(status=204)
         except AuthorityInstance.DoesNotExist:
             return JsonResponse({"message": "Requested Authority with UUID %s not found" % uuid}, status=404)
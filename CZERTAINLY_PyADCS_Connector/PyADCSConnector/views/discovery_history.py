@@ -1,16 +1,15 @@
 import json
 import logging
-from threading import Thread
 
 from django.db import transaction
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 
-from PyADCSConnector.models.discovery_certificate import DiscoveryCertificate
 from PyADCSConnector.models.discovery_history import DiscoveryHistory
 from PyADCSConnector.objects.discovery_history_request_dto import DiscoveryHistoryRequestDto
+from PyADCSConnector.services.certificate_content import delete_discovery_certificates
 from PyADCSConnector.services.discovery_history import create_discovery_history, get_discovery_history_data, \
-    run_discovery
+    submit_discovery
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +20,8 @@ def start_discovery(request, *args, **kwargs):
 
     discovery_history = create_discovery_history(request_dto)
 
-    # create a new thread and run discovery
-    # TODO: make running the discovery asynchronous
-    # run_discovery(form, discovery_history)
-
-    Thread(target=run_discovery, args=(request_dto, discovery_history.uuid), daemon=True).start()
+    # run the discovery on the remoting event loop, the request does not wait for it
+    submit_discovery(request_dto, discovery_history.uuid)
 
     discovery_history_request = DiscoveryHistoryRequestDto()
     discovery_history_request.name = request_dto["name"]
@@ -43,8 +39,8 @@ def discovery_operations(request, uuid, *args, **kwargs):
     if request.method == "DELETE":
         try:
             discovery_history = DiscoveryHistory.objects.get(uuid=uuid)
-            discovery_certificates = DiscoveryCertificate.objects.filter(discovery_id=discovery_history.id)
-            discovery_certificates.delete()
+            # the contents referenced only by the discovery are deleted with its certificates
+            delete_discovery_certificates(discovery_history)
             discovery_history.delete()
             # return 204 no content
             return JsonResponse({}, status=204)
@@ -1,7 +1,38 @@
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 
+from PyADCSConnector.remoting.admission import get_admission_stats
+from PyADCSConnector.remoting.circuit_breaker import get_circuit_breaker_stats, CLOSED
+from PyADCSConnector.remoting.retry import get_retry_stats
+from PyADCSConnector.remoting.transport_cache import transport_cache
+
 
 @require_http_methods(["GET"])
 def get_health(request, *args, **kwargs):
-    return JsonResponse({"status": "ok", "description": "string"})
+    transport_stats = transport_cache.stats()
+    parts = {
+        "winrmTransports": {
+            "status": "ok",
+            "description": "%(handshakesPerformed)d handshakes performed, %(handshakesAvoided)d avoided, "
+                           "%(reauthentications)d re-authentications, %(idle)d idle connections"
+                           % transport_stats,
+        }
+    }
+
+    admission_stats = get_admission_stats()
+    retry_stats = get_retry_stats()
+    for uuid, breaker in get_circuit_breaker_stats().items():
+        description = "circuit %s" % breaker["state"]
+        if breaker["state"] != CLOSED:
+            description += " after %d consecutive failures: %s" % (breaker["consecutiveFailures"],
+                                                                   breaker["lastFailure"])
+        if uuid in admission_stats:
+            description += ", %(active)d active and %(waiting)d waiting operations" % admission_stats[uuid]
+        if uuid in retry_stats:
+            description += ", %(retries)d retries, %(exhausted)d denied by the retry budget" % retry_stats[uuid]
+        parts["authority:" + uuid] = {
+            "status": "ok" if breaker["state"] == CLOSED else "nok",
+            "description": description,
+        }
+
+    return JsonResponse({"status": "ok", "description": "string", "parts": parts})
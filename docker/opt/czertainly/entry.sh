@@ -2,7 +2,6 @@
 
 CPU_COUNT=$(getconf _NPROCESSORS_ONLN)   # honours the cgroup CPU quota
 : "${GUNICORN_WORKERS:=${CPU_COUNT:-1}}"
-: "${GUNICORN_THREADS:=${GUNICORN_THREADS:-4}}"
 
 czertainlyHome="/opt/czertainly"
 source ${czertainlyHome}/static-functions
@@ -13,13 +12,14 @@ cd /opt/czertainly
 #python manage.py migrate
 python migrate.py
 
+# the ASGI worker awaits the remote calls of the async views on the remoting loop without holding a thread, the
+# synchronous views run in the threads of the worker
 exec gunicorn \
-  --worker-class gthread \
+  --worker-class uvicorn_worker.UvicornWorker \
   --workers "$GUNICORN_WORKERS" \
-  --threads  "$GUNICORN_THREADS" \
   --timeout  600 \
   --bind     0.0.0.0:8080 \
   --worker-tmp-dir /dev/shm \
-  CZERTAINLY_PyADCS_Connector.wsgi:application
+  CZERTAINLY_PyADCS_Connector.asgi:application
 
 #exec "$@"